@@ -0,0 +1,404 @@
+# admission.py - Admission control, load shedding and the upstream circuit breaker
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from statement_chunker import compact_json
+
+# Client-supplied time budget in seconds, capped at the endpoint's own deadline
+DEADLINE_HEADER = 'X-Request-Timeout'
+SHED_REASONS = ('queue_full', 'queue_timeout', 'deadline')
+
+
+class Overloaded(Exception):
+    """A request shed before doing any work
+
+    `status` is 429 when its class's queue is full and 503 when it waited
+    too long or its deadline passed; `retry_after` is the suggested
+    Retry-After in seconds.
+    """
+
+    def __init__(self, message: str, status: int, reason: str, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def response(self) -> Tuple[Dict, Dict[str, str]]:
+        """Body and headers of the 429/503"""
+        return {
+            'success': False,
+            'error': str(self),
+            'reason': self.reason
+        }, {'Retry-After': str(self.retry_after)}
+
+# ==========================================
+# DEADLINES
+# ==========================================
+
+def request_deadline(request, default_seconds: float) -> float:
+    """Absolute deadline (time.monotonic) of a request: X-Request-Timeout, at most `default_seconds`"""
+    seconds = default_seconds
+    value = request.headers.get(DEADLINE_HEADER)
+    if value:
+        try:
+            seconds = min(float(value), default_seconds)
+        except ValueError:
+            pass
+    if math.isnan(seconds):
+        seconds = default_seconds
+    return time.monotonic() + seconds
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left before `deadline` (None: no deadline)"""
+    return None if deadline is None else deadline - time.monotonic()
+
+# ==========================================
+# ADMISSION CONTROL
+# ==========================================
+
+class PriorityClass(NamedTuple):
+    """Scheduling settings of one kind of request"""
+    priority: int       # lower is served first when a slot frees up
+    limit: int          # in flight at once (within the shared capacity)
+    queue: int          # waiting for a slot; more are shed with 429
+    max_wait: float     # seconds a request may wait before it is shed with 503
+
+
+class _Waiter:
+    __slots__ = ('wake', 'granted')
+
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+        self.granted = False
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Ticket:
+    """An admitted request's slot, given back when the with-block exits (or on release())"""
+
+    __slots__ = ('controller', 'name', 'deadline', 'waited', 'started', 'released')
+
+    def __init__(self, controller: 'AdmissionController', name: str, deadline: Optional[float],
+                 waited: float):
+        self.controller = controller
+        self.name = name
+        self.deadline = deadline
+        self.waited = waited
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self.name, time.monotonic() - self.started)
+
+    def __enter__(self) -> 'Ticket':
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class AdmissionController:
+    """Bounded concurrency with one bounded wait queue per priority class
+
+    At most `capacity` admitted requests run at once, and at most
+    `limit` of each class, so long generations cannot take every slot
+    from cheap searches. A request that cannot start waits in its class's
+    FIFO queue; a freed slot goes to the highest-priority class with a
+    waiter that fits. Requests are shed instead of queued without bound:
+    429 when the queue is full, 503 once they have waited `max_wait` or
+    their deadline has passed, both with a Retry-After estimated from the
+    class's recent service time.
+
+    `admit` blocks the calling thread; `aadmit` is the same for coroutines
+    and shares the slots and queues, so the WSGI and ASGI serving modes of
+    one process are limited together.
+    """
+
+    def __init__(self, capacity: int, classes: Dict[str, PriorityClass], enabled: bool = True):
+        self.capacity = capacity
+        self.classes = classes
+        self.enabled = enabled
+        self.order = sorted(classes, key=lambda name: classes[name].priority)
+        self.lock = threading.Lock()
+        self.total = 0
+        self.in_flight = {name: 0 for name in classes}
+        self.queues: Dict[str, deque] = {name: deque() for name in classes}
+        self.service_seconds: Dict[str, Optional[float]] = {name: None for name in classes}
+        self.admitted = {name: 0 for name in classes}
+        self.shed = {name: {reason: 0 for reason in SHED_REASONS} for name in classes}
+
+    # ---------- slots (called with the lock held) ----------
+
+    def _fits(self, name: str) -> bool:
+        return self.total < self.capacity and self.in_flight[name] < self.classes[name].limit
+
+    def _start(self, name: str):
+        self.total += 1
+        self.in_flight[name] += 1
+        self.admitted[name] += 1
+
+    def _dispatch(self):
+        for name in self.order:
+            queue = self.queues[name]
+            while queue and self._fits(name):
+                waiter = queue.popleft()
+                self._start(name)
+                waiter.granted = True
+                waiter.wake()
+
+    def _retry_after(self, name: str) -> int:
+        """Seconds until this class has likely worked through its current queue"""
+        settings = self.classes[name]
+        service = self.service_seconds[name] or settings.max_wait
+        estimate = service * (len(self.queues[name]) + 1) / max(1, settings.limit)
+        return int(min(60, max(1, math.ceil(estimate))))
+
+    def _shed(self, name: str, reason: str) -> Overloaded:
+        self.shed[name][reason] += 1
+        if reason == 'queue_full':
+            message, status = f"Too many '{name}' requests waiting; try again later", 429
+        elif reason == 'deadline':
+            message, status = "Request deadline passed before it could be served", 503
+        else:
+            message, status = f"Server is busy: no '{name}' slot became free in time", 503
+        return Overloaded(message, status, reason, self._retry_after(name))
+
+    def _release(self, name: str, seconds: Optional[float]):
+        with self.lock:
+            self.total -= 1
+            self.in_flight[name] -= 1
+            if seconds is not None:
+                previous = self.service_seconds[name]
+                self.service_seconds[name] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+            self._dispatch()
+
+    # ---------- admission ----------
+
+    def _enter(self, name: str, deadline: Optional[float],
+               wake: Callable[[], None]) -> Tuple[Optional[Ticket], Optional[_Waiter], float]:
+        """(ticket if it can start now, else the queued waiter, seconds it may wait)"""
+        settings = self.classes[name]
+        with self.lock:
+            budget = remaining(deadline)
+            if self.enabled and budget is not None and budget <= 0:
+                raise self._shed(name, 'deadline')
+            if not self.enabled or (not self.queues[name] and self._fits(name)):
+                self._start(name)
+                return Ticket(self, name, deadline, 0.0), None, 0.0
+            if len(self.queues[name]) >= settings.queue:
+                raise self._shed(name, 'queue_full')
+            waiter = _Waiter(wake)
+            self.queues[name].append(waiter)
+        wait = settings.max_wait if budget is None else min(settings.max_wait, budget)
+        return None, waiter, max(0.0, wait)
+
+    def _settle(self, name: str, deadline: Optional[float], waiter: _Waiter, arrived: float) -> Ticket:
+        """Ticket of a waiter whose wait ended, or Overloaded if it was never granted a slot"""
+        with self.lock:
+            if not waiter.granted:
+                self.queues[name].remove(waiter)
+                budget = remaining(deadline)
+                raise self._shed(name, 'deadline' if budget is not None and budget <= 0 else 'queue_timeout')
+        return Ticket(self, name, deadline, time.monotonic() - arrived)
+
+    def admit(self, name: str, deadline: Optional[float] = None) -> Ticket:
+        """Slot for a request of class `name`, waiting for one if need be; raises Overloaded"""
+        arrived = time.monotonic()
+        event = threading.Event()
+        ticket, waiter, wait = self._enter(name, deadline, event.set)
+        if ticket is not None:
+            return ticket
+        event.wait(wait)
+        return self._settle(name, deadline, waiter, arrived)
+
+    async def aadmit(self, name: str, deadline: Optional[float] = None) -> Ticket:
+        """admit() for coroutines: waits on the event loop instead of blocking a thread"""
+        arrived = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        ticket, waiter, wait = self._enter(name, deadline,
+                                           lambda: loop.call_soon_threadsafe(_resolve, future))
+        if ticket is not None:
+            return ticket
+        try:
+            await asyncio.wait_for(future, wait)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Client went away while queued: leave the queue, or hand back a slot granted meanwhile
+            with self.lock:
+                if not waiter.granted:
+                    self.queues[name].remove(waiter)
+                    waiter = None
+            if waiter is not None:
+                self._release(name, None)
+            raise
+        return self._settle(name, deadline, waiter, arrived)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'capacity': self.capacity,
+                'in_flight': self.total,
+                'queued': sum(len(queue) for queue in self.queues.values()),
+                'classes': {
+                    name: {
+                        'priority': settings.priority,
+                        'limit': settings.limit,
+                        'queue_limit': settings.queue,
+                        'in_flight': self.in_flight[name],
+                        'queued': len(self.queues[name]),
+                        'admitted': self.admitted[name],
+                        'shed': dict(self.shed[name]),
+                        'service_seconds': (round(self.service_seconds[name], 3)
+                                            if self.service_seconds[name] is not None else None),
+                    }
+                    for name, settings in self.classes.items()
+                },
+            }
+
+# ==========================================
+# CIRCUIT BREAKER
+# ==========================================
+
+class CircuitBreaker:
+    """Stops calling a failing upstream for a while, then lets one probe through
+
+    closed: calls go through; once `failure_threshold` of the last
+    `window` calls have failed, the circuit opens. open: allow() is False
+    for `reset_timeout` seconds, so callers answer without the upstream
+    at once instead of waiting on it. half-open: one probe at a time is
+    allowed; its success closes the circuit, its failure reopens it. A
+    probe whose outcome is never recorded (cancelled) is replaced after
+    `reset_timeout`. A call cut short by its request's deadline only
+    counts as a failure if it ran for `slow_call_seconds`: a client asking
+    for a tight deadline says nothing about the upstream's health.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, window: int = 20,
+                 reset_timeout: float = 30.0, slow_call_seconds: float = 10.0, enabled: bool = True):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_seconds = slow_call_seconds
+        self.enabled = enabled
+        self.outcomes = deque(maxlen=window)     # True for a failure
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.probe_started: Optional[float] = None
+        self.lock = threading.Lock()
+        self.counters = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def _open(self, now: float):
+        self.state = 'open'
+        self.opened_at = now
+        self.probe_started = None
+        self.counters['opened'] += 1
+
+    def allow(self) -> bool:
+        """Whether to call the upstream now"""
+        if not self.enabled:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            if self.state == 'open' and now - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and (self.probe_started is None
+                                              or now - self.probe_started >= self.reset_timeout):
+                self.probe_started = now
+                return True
+            self.counters['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.counters['successes'] += 1
+            if self.state == 'half_open':
+                self.state = 'closed'
+                self.outcomes.clear()
+                self.probe_started = None
+            else:
+                self.outcomes.append(False)
+
+    def record_failure(self):
+        now = time.monotonic()
+        with self.lock:
+            self.counters['failures'] += 1
+            if self.state == 'half_open':
+                self._open(now)
+                return
+            self.outcomes.append(True)
+            if self.state == 'closed' and sum(self.outcomes) >= self.failure_threshold:
+                self._open(now)
+
+    def record_timeout(self, seconds: float):
+        """A call that ran out of deadline after `seconds`"""
+        if seconds >= self.slow_call_seconds:
+            self.record_failure()
+        else:
+            with self.lock:
+                if self.state == 'half_open':
+                    self.probe_started = None
+
+    def retry_after(self) -> int:
+        """Seconds until the next probe is allowed"""
+        with self.lock:
+            if self.state != 'open':
+                return 1
+            return max(1, math.ceil(self.reset_timeout - (time.monotonic() - self.opened_at)))
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                **self.counters,
+                'name': self.name,
+                'enabled': self.enabled,
+                'state': self.state,
+                'recent_failures': sum(self.outcomes),
+                'window': self.outcomes.maxlen,
+            }
+
+# ==========================================
+# DEGRADED ANSWERS
+# ==========================================
+
+DEGRADED_NOTICE = ("The answer service is unavailable right now, so this reply lists the "
+                   "closest matching records instead of a written answer.")
+
+
+def _snippet(document: Dict, length: int = 200) -> str:
+    content = document.get('content')
+    text = content if isinstance(content, str) else compact_json(content)
+    text = ' '.join(text.split())
+    return text if len(text) <= length else text[:length - 1] + '…'
+
+
+def retrieval_only_answer(context_docs: List[Dict], stats_text: Optional[str] = None,
+                          max_sources: int = 5) -> str:
+    """Answer built from the retrieved records (and exact figures, if any) without the model"""
+    lines = [DEGRADED_NOTICE]
+    if stats_text:
+        lines += ['', stats_text]
+    if context_docs:
+        lines.append('')
+        for document in context_docs[:max_sources]:
+            source = document.get('source') or (document.get('metadata') or {}).get('source_file', 'Unknown')
+            lines.append(f"- {source}: {_snippet(document)}")
+    elif not stats_text:
+        lines += ['', 'No matching records were found.']
+    return '\n'.join(lines)
@@ -0,0 +1,317 @@
+# async_serving.py - ASGI serving mode: native async routes in front of the Flask (WSGI) app
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+# A native route returns (status, JSON body, extra headers)
+Handler = Callable[['AsgiRequest'], Awaitable[Tuple[int, Dict, Dict[str, str]]]]
+
+_DONE = object()
+
+# ==========================================
+# UPSTREAM LIMITS
+# ==========================================
+
+class UpstreamLimits:
+    """Caps concurrent calls per upstream (embed, search, generate) across all requests
+
+    Thousands of parked requests then translate into at most this many
+    outbound connections per upstream; the rest wait their turn in the loop.
+    A limit of 0 means unbounded.
+    """
+
+    def __init__(self, **limits: int):
+        self.limits = limits
+        self.semaphores = {name: asyncio.Semaphore(limit) for name, limit in limits.items() if limit > 0}
+        self.in_use = {name: 0 for name in limits}
+        self.waiting = {name: 0 for name in limits}
+
+    @asynccontextmanager
+    async def slot(self, name: str):
+        semaphore = self.semaphores.get(name)
+        if semaphore is None:
+            yield
+            return
+        self.waiting[name] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting[name] -= 1
+        self.in_use[name] += 1
+        try:
+            yield
+        finally:
+            self.in_use[name] -= 1
+            semaphore.release()
+
+    def stats(self) -> Dict:
+        return {name: {'limit': limit, 'in_use': self.in_use[name], 'waiting': self.waiting[name]}
+                for name, limit in self.limits.items()}
+
+
+async def agenerate(model, prompt: str, limits: Optional[UpstreamLimits] = None) -> str:
+    """Answer text from the model's generate_content_async, or the blocking call on a thread"""
+    async with limits.slot('generate') if limits is not None else nullcontext():
+        generate = getattr(model, 'generate_content_async', None)
+        if generate is not None:
+            response = await generate(prompt)
+        else:
+            response = await asyncio.to_thread(model.generate_content, prompt)
+    return response.text
+
+# ==========================================
+# REQUESTS
+# ==========================================
+
+class _Headers:
+    """Case-insensitive, read-only view of the ASGI header list"""
+
+    def __init__(self, raw: List[Tuple[bytes, bytes]]):
+        self.values: Dict[str, str] = {}
+        for name, value in raw:
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            self.values[name] = f"{self.values[name]}, {value}" if name in self.values else value
+
+    def get(self, name: str, default=None):
+        return self.values.get(name.lower(), default)
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self.values
+
+
+class AsgiRequest:
+    """The parts of flask.request the route helpers use (headers, args, get_json)"""
+
+    def __init__(self, scope: Dict, body: bytes):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = _Headers(scope.get('headers', []))
+        self.args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.body = body
+        self._json = _DONE
+
+    def get_json(self, silent: bool = False):
+        if self._json is _DONE:
+            try:
+                self._json = json.loads(self.body) if self.body else None
+            except ValueError:
+                if not silent:
+                    raise
+                return None
+        return self._json
+
+    @property
+    def json(self):
+        return self.get_json()
+
+# ==========================================
+# ASGI APPLICATION
+# ==========================================
+
+class AsgiApp:
+    """ASGI application serving `routes` as coroutines and everything else via `wsgi_app`
+
+    Native routes get a per-request timeout (504) and are cancelled, along
+    with the upstream calls they are awaiting, when the client disconnects.
+    Other requests (streaming, batch, stats, health, CORS preflight) run
+    the Flask app on a bounded thread pool, streamed chunk by chunk.
+    Blocking calls made from coroutines (asyncio.to_thread) use a separate
+    bounded pool installed as the loop's default executor. With an
+    `encoder` (response_encoding.ResponseEncoder), native responses follow
+    the request's Accept / Accept-Encoding; otherwise they are `dumps` JSON.
+    """
+
+    def __init__(self, wsgi_app, routes: Dict[Tuple[str, str], Handler],
+                 dumps: Callable[[object], str] = json.dumps, request_timeout: float = 60.0,
+                 blocking_threads: int = 32, wsgi_threads: int = 16, cors_origin: Optional[str] = '*',
+                 encoder=None):
+        self.wsgi_app = wsgi_app
+        self.routes = routes
+        self.dumps = dumps
+        self.encoder = encoder
+        self.request_timeout = request_timeout
+        self.blocking_threads = blocking_threads
+        self.cors_origin = cors_origin
+        self.wsgi_executor = ThreadPoolExecutor(max_workers=wsgi_threads, thread_name_prefix='asgi-wsgi')
+        self.loops = set()
+        self.counters = {'native': 0, 'wsgi': 0, 'timeouts': 0, 'disconnects': 0}
+        self.active = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        self._install_executor()
+        handler = self.routes.get((scope['method'], scope['path']))
+        if handler is not None:
+            await self._native(handler, scope, receive, send)
+        else:
+            await self._wsgi(scope, receive, send)
+
+    def _install_executor(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.loops:
+            loop.set_default_executor(
+                ThreadPoolExecutor(max_workers=self.blocking_threads, thread_name_prefix='async-blocking')
+            )
+            self.loops.add(loop)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._install_executor()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.wsgi_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(receive) -> Tuple[bytes, bool]:
+        """(request body, client disconnected while sending it)"""
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return b'', True
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks), False
+
+    async def _native(self, handler: Handler, scope, receive, send):
+        body, disconnected = await self._read_body(receive)
+        if disconnected:
+            return
+        request = AsgiRequest(scope, body)
+        self.counters['native'] += 1
+        self.active += 1
+        task = asyncio.ensure_future(asyncio.wait_for(handler(request), self.request_timeout))
+        watcher = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not task.done():
+                # Client went away: cancel the handler and whatever it is awaiting
+                self.counters['disconnects'] += 1
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                return
+            try:
+                status, payload, headers = task.result()
+            except asyncio.TimeoutError:
+                self.counters['timeouts'] += 1
+                status, payload, headers = 504, {
+                    'success': False,
+                    'error': f"Request timed out after {self.request_timeout:g}s"
+                }, {}
+            except Exception as e:
+                status, payload, headers = 500, {'success': False, 'error': str(e)}, {}
+            await self._send_json(send, request, status, payload, headers)
+        finally:
+            self.active -= 1
+            watcher.cancel()
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def _send_json(self, send, request: AsgiRequest, status: int, payload: Dict,
+                         headers: Dict[str, str]):
+        if self.encoder is not None:
+            body, encoded = self.encoder.encode(payload, request.headers.get('accept'),
+                                                request.headers.get('accept-encoding'))
+        else:
+            body, encoded = self.dumps(payload).encode('utf-8'), {'Content-Type': 'application/json'}
+        response_headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in encoded.items()]
+        response_headers.append((b'content-length', str(len(body)).encode('latin-1')))
+        if self.cors_origin and 'origin' in request.headers:
+            response_headers.append((b'access-control-allow-origin', self.cors_origin.encode('latin-1')))
+        response_headers += [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                             for name, value in headers.items()]
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    # ------------------------------------------
+    # WSGI bridge
+    # ------------------------------------------
+
+    @staticmethod
+    def _environ(scope, body: bytes) -> Dict:
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': str(client[0]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            key = 'HTTP_' + name
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def _wsgi(self, scope, receive, send):
+        body, disconnected = await self._read_body(receive)
+        if disconnected:
+            return
+        self.counters['wsgi'] += 1
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+
+        iterable = await loop.run_in_executor(self.wsgi_executor, self.wsgi_app,
+                                              self._environ(scope, body), start_response)
+        iterator = iter(iterable)
+        watcher = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            # Flask calls start_response before returning, but WSGI allows the first chunk
+            chunk = await loop.run_in_executor(self.wsgi_executor, next, iterator, _DONE)
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': started['headers']})
+            while chunk is not _DONE:
+                if watcher.done():
+                    self.counters['disconnects'] += 1
+                    return
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(self.wsgi_executor, next, iterator, _DONE)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            # Closing runs the response's cleanup, e.g. cancelling an abandoned stream
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(self.wsgi_executor, close)
+
+    def stats(self) -> Dict:
+        return {**self.counters, 'active': self.active, 'request_timeout': self.request_timeout}
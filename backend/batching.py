@@ -0,0 +1,81 @@
+# batching.py - Request parsing and source de-duplication for the batch endpoints
+import hashlib
+import json
+from typing import Dict, List
+
+
+class BatchRequestError(ValueError):
+    """The batch as a whole is malformed (answered with 400)"""
+
+
+def parse_batch(items, name: str, field: str, default_k: int, max_items: int) -> List[Dict]:
+    """Normalize a list of strings or {field, k} objects into {index, query, k, error}
+
+    A malformed item only gets an 'error'; the rest of the batch still runs.
+    """
+    if not isinstance(items, list) or not items:
+        raise BatchRequestError(f"'{name}' must be a non-empty list")
+    if len(items) > max_items:
+        raise BatchRequestError(f"Batch of {len(items)} items exceeds the limit of {max_items}")
+    if not isinstance(default_k, int) or isinstance(default_k, bool) or default_k < 1:
+        raise BatchRequestError("'k' must be a positive integer")
+
+    parsed = []
+    for position, item in enumerate(items):
+        if isinstance(item, str):
+            item = {field: item}
+        if not isinstance(item, dict):
+            parsed.append({'index': position, 'query': None, 'k': default_k,
+                           'error': f"Item must be a string or an object with '{field}'"})
+            continue
+        query = item.get(field)
+        query = query.strip() if isinstance(query, str) else ''
+        k = item.get('k', default_k)
+        error = None
+        if not query:
+            error = f"No {field} provided"
+        elif not isinstance(k, int) or isinstance(k, bool) or k < 1:
+            error = "'k' must be a positive integer"
+        parsed.append({'index': position, 'query': query, 'k': k, 'error': error})
+    return parsed
+
+
+def item_error(item: Dict, error) -> Dict:
+    """Entry for an item that failed; the batch response itself is still a success"""
+    entry = {'index': item['index'], 'query': item['query'], 'success': False, 'error': str(error)}
+    if isinstance(error, Exception):
+        entry['error_type'] = type(error).__name__
+    return entry
+
+
+def document_id(source: Dict) -> str:
+    """Stable ID of a retrieved document: its doc_id, else a hash of its content"""
+    doc_id = (source.get('metadata') or {}).get('doc_id')
+    if doc_id:
+        return doc_id
+    content = json.dumps(source.get('content'), sort_keys=True, default=str)
+    return 'sha256:' + hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+
+def dedupe_sources(entries: List[Dict], field: str) -> Dict[str, Dict]:
+    """Replace each entry's `field` list by ID references; return the shared documents
+
+    Per-query data (the 'retrieval' ranks and scores) stays on the reference.
+    Entries are rewritten in place; the source dicts themselves are not touched,
+    as they may be shared with the retrieval cache.
+    """
+    documents: Dict[str, Dict] = {}
+    for entry in entries:
+        if not entry.get(field):
+            continue
+        references = []
+        for source in entry[field]:
+            doc_id = document_id(source)
+            if doc_id not in documents:
+                documents[doc_id] = {key: value for key, value in source.items() if key != 'retrieval'}
+            reference = {'id': doc_id}
+            if 'retrieval' in source:
+                reference['retrieval'] = source['retrieval']
+            references.append(reference)
+        entry[field] = references
+    return documents
@@ -0,0 +1,439 @@
+# benchmark.py - Offline end-to-end benchmark of the chat and search endpoints
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from fakes import FakeEmbeddings, FakeGenerativeModel, FakeIndex, FakeVectorStore
+from ingest_manifest import IngestManifest
+from ingest_pipeline import IngestionPipeline
+from lexical_index import LexicalIndexWriter
+from statement_chunker import StatementChunker
+from statement_loader import discover_json_files
+
+APPS = {'flask': 'RAG_bot_flask', 'raw': 'RAG_chatbot'}
+STAGES = ('embed', 'search', 'lexical', 'prompt_build', 'generate', 'serialize')
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(HERE, 'benchmarks', 'queries.jsonl')
+DEFAULT_BASELINE = os.path.join(HERE, 'benchmarks', 'baseline.json')
+# Settings that change the numbers; comparing runs that differ in them is meaningless
+COMPARABLE_SETTINGS = ('requests', 'embed_latency', 'search_latency', 'generate_latency',
+                       'token_latency', 'answer_tokens', 'dimension', 'warm_cache')
+
+# ==========================================
+# MEASUREMENT
+# ==========================================
+
+def percentiles(samples: List[float]) -> Dict:
+    """p50/p95/p99/mean/max of millisecond samples"""
+    if not samples:
+        return {'count': 0}
+    values = np.asarray(samples, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': int(values.size),
+        'p50': round(float(p50), 3),
+        'p95': round(float(p95), 3),
+        'p99': round(float(p99), 3),
+        'mean': round(float(values.mean()), 3),
+        'max': round(float(values.max()), 3),
+    }
+
+
+def rss_bytes() -> int:
+    """Current resident set size (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class StageRecorder:
+    """Thread-safe per-stage latency samples (milliseconds)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+
+    def record(self, stage: str, elapsed_ms: float):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(elapsed_ms)
+
+    def timed(self, stage: str, func: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, (time.perf_counter() - started) * 1000)
+        return wrapper
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+
+    def summary(self) -> Dict:
+        with self.lock:
+            return {stage: percentiles(self.samples.get(stage, [])) for stage in STAGES}
+
+
+class _Timed:
+    """Proxy that times the named methods of `target` and forwards everything else"""
+
+    def __init__(self, target, recorder: StageRecorder, stages: Dict[str, str]):
+        self._target = target
+        self._recorder = recorder
+        self._stages = stages
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        stage = self._stages.get(name)
+        return self._recorder.timed(stage, attr) if stage and callable(attr) else attr
+
+    def __len__(self):
+        return len(self._target)
+
+# ==========================================
+# FAKE BACKEND
+# ==========================================
+
+def load_corpus(path: str) -> List[Dict]:
+    items = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault('endpoint', 'chat')
+                items.append(item)
+    if not items:
+        raise ValueError(f"Empty query corpus: {path}")
+    return items
+
+
+def prepare_workspace(workdir: str, datasets_folder: str, dimension: int) -> FakeIndex:
+    """Chunk and 'embed' the statements into a FakeIndex plus the BM25 index, like the uploader"""
+    index = FakeIndex()
+    pipeline = IngestionPipeline(
+        FakeEmbeddings(dimension=dimension), index, StatementChunker(),
+        IngestManifest(os.path.join(workdir, 'manifest.json')),
+        requests_per_second=0,
+        lexical_index=LexicalIndexWriter(os.path.join(workdir, 'lexical_index'))
+    )
+    stats = pipeline.run(discover_json_files(datasets_folder))
+    if stats.counts['failed'] or not stats.counts['upserted']:
+        raise RuntimeError(f"Benchmark ingest failed: {stats.summary()['errors']}")
+    return index
+
+
+def configure_environment(workdir: str, datasets_folder: str, warm_cache: bool):
+    """App Config is read at import time, so point it at the workspace first"""
+    os.environ.update({
+        'GEMINI_API_KEY': 'benchmark',
+        'PINECONE_API_KEY': 'benchmark',
+        'VECTOR_BACKEND': 'local',
+        'LOCAL_VECTOR_STORE_PATH': os.path.join(workdir, 'local_index'),
+        'INGEST_MANIFEST_PATH': os.path.join(workdir, 'manifest.json'),
+        'LEXICAL_INDEX_PATH': os.path.join(workdir, 'lexical_index'),
+        'EMBEDDING_CACHE_PATH': '',
+        'EMBEDDING_CACHE_MEMORY_ENTRIES': '2048' if warm_cache else '0',
+        'RETRIEVAL_CACHE_SIZE': '1024' if warm_cache else '0',
+        'SESSION_BACKEND': 'memory',
+        'DATASETS_FOLDER': datasets_folder,
+        'STATS_SNAPSHOT_PATH': os.path.join(workdir, 'stats_snapshot'),
+        # Build the app at import and skip warm-up: the fakes replace the clients afterwards
+        'LAZY_STARTUP': 'false',
+        'WARMUP_QUERIES': '',
+    })
+
+
+def install_fakes(module, index: FakeIndex, recorder: StageRecorder, args) -> object:
+    """Swap the app's Gemini and vector clients for timed, latency-injected fakes"""
+    from embedding_cache import build_cached_embeddings
+
+    chatbot = module.chatbot
+    embeddings = _Timed(
+        build_cached_embeddings(
+            FakeEmbeddings(dimension=args.dimension, latency=args.embed_latency),
+            model='fake/embedding-001', disk_path=None,
+            memory_entries=int(os.environ['EMBEDDING_CACHE_MEMORY_ENTRIES'])
+        ),
+        recorder, {'embed_query': 'embed', 'embed_documents': 'embed', 'embed_queries': 'embed'}
+    )
+    index.latency = args.search_latency
+    store = FakeVectorStore(_Timed(index, recorder, {'query': 'search'}), embeddings)
+
+    chatbot.embeddings = embeddings
+    chatbot.vectorstore = store
+    chatbot.retriever.vectorstore = store
+    if chatbot.retriever.lexical is not None:
+        chatbot.retriever.lexical = _Timed(chatbot.retriever.lexical, recorder, {'search': 'lexical'})
+    chatbot.model = _Timed(
+        FakeGenerativeModel(latency=args.generate_latency, token_latency=args.token_latency,
+                            answer_tokens=args.answer_tokens),
+        recorder, {'generate_content': 'generate'}
+    )
+    chatbot.build_prompt = recorder.timed('prompt_build', chatbot.build_prompt)
+    # Responses are encoded by the app's ResponseEncoder (JSON or MessagePack)
+    module.encoder.serialize = recorder.timed('serialize', module.encoder.serialize)
+    return chatbot
+
+# ==========================================
+# LOAD GENERATION
+# ==========================================
+
+def _send(client, item: Dict, session_id: str):
+    headers = {'X-Session-ID': session_id}
+    endpoint = item['endpoint']
+    if endpoint == 'search':
+        body = {'query': item['query'], **({'k': item['k']} if 'k' in item else {})}
+        return client.post('/api/search', json=body, headers=headers)
+    body = {'message': item['query'], **({'k': item['k']} if 'k' in item else {})}
+    if endpoint == 'stream':
+        return client.post('/api/chat/stream', json=body, headers=headers, buffered=True)
+    return client.post('/api/chat', json=body, headers=headers)
+
+
+def _is_success(response) -> bool:
+    if response.status_code != 200:
+        return False
+    if response.mimetype == 'text/event-stream':
+        return b'event: done' in response.get_data()
+    return bool((response.get_json(silent=True) or {}).get('success'))
+
+
+def run_level(module, corpus: List[Dict], concurrency: int, requests: int, warmup: int,
+              recorder: StageRecorder, memory_interval: int) -> Dict:
+    """Replay the corpus `requests` times over `concurrency` worker threads"""
+    app = module.app
+    for position in range(warmup):
+        _send(app.test_client(), corpus[position % len(corpus)], 'warmup')
+    recorder.reset()
+
+    lock = threading.Lock()
+    cursor = [0]
+    totals: Dict[str, List[float]] = {}
+    errors: List[str] = []
+    memory = [rss_bytes()]
+
+    def worker(number: int):
+        client = app.test_client()
+        while True:
+            with lock:
+                position = cursor[0]
+                if position >= requests:
+                    return
+                cursor[0] += 1
+            item = corpus[position % len(corpus)]
+            started = time.perf_counter()
+            try:
+                response = _send(client, item, f"bench-{concurrency}-{number}")
+                ok = _is_success(response)
+                detail = f"HTTP {response.status_code}"
+            except Exception as e:
+                ok, detail = False, repr(e)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                totals.setdefault(item['endpoint'], []).append(elapsed)
+                if not ok:
+                    errors.append(f"{item['endpoint']} {item['query']!r}: {detail}")
+                if memory_interval and (position + 1) % memory_interval == 0:
+                    memory.append(rss_bytes())
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    memory.append(rss_bytes())
+
+    all_samples = [sample for samples in totals.values() for sample in samples]
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'total': percentiles(all_samples),
+            **{endpoint: percentiles(samples) for endpoint, samples in sorted(totals.items())},
+        },
+        'stages_ms': recorder.summary(),
+        'memory': {
+            'rss_start_mb': round(memory[0] / 2 ** 20, 2),
+            'rss_end_mb': round(memory[-1] / 2 ** 20, 2),
+            'rss_peak_mb': round(max(memory) / 2 ** 20, 2),
+            'growth_mb': round((memory[-1] - memory[0]) / 2 ** 20, 2),
+            'growth_mb_per_1k_requests': round((memory[-1] - memory[0]) / 2 ** 20 / requests * 1000, 3),
+        },
+    }
+
+# ==========================================
+# BASELINE COMPARISON
+# ==========================================
+
+def compare(results: Dict, baseline: Dict, tolerance: float, memory_slack_mb: float) -> List[str]:
+    """Regressions of p50/p95 latency, throughput and memory growth against `baseline`"""
+    previous = {(run['app'], run['concurrency']): run for run in baseline.get('runs', [])}
+    for key in COMPARABLE_SETTINGS:
+        old, new = baseline.get('config', {}).get(key), results['config'].get(key)
+        if old != new:
+            print(f"⚠️ Baseline was recorded with {key}={old} (this run: {new})", file=sys.stderr)
+    regressions = []
+    for run in results['runs']:
+        before = previous.get((run['app'], run['concurrency']))
+        if before is None:
+            continue
+        label = f"{run['app']} @ concurrency {run['concurrency']}"
+        for key in ('p50', 'p95'):
+            old, new = before['latency_ms']['total'].get(key), run['latency_ms']['total'].get(key)
+            if old and new and new > old * (1 + tolerance):
+                regressions.append(f"{label}: total {key} {new} ms > {old} ms (+{tolerance:.0%})")
+        old, new = before['throughput_rps'], run['throughput_rps']
+        if old and new < old * (1 - tolerance):
+            regressions.append(f"{label}: throughput {new} rps < {old} rps (-{tolerance:.0%})")
+        old, new = before['memory']['growth_mb'], run['memory']['growth_mb']
+        if new > max(old, 0) + memory_slack_mb:
+            regressions.append(f"{label}: memory growth {new} MB > {old} MB + {memory_slack_mb} MB")
+        if run['errors'] > before['errors']:
+            regressions.append(f"{label}: {run['errors']} errors (baseline {before['errors']})")
+    return regressions
+
+# ==========================================
+# MAIN
+# ==========================================
+
+def _report(run: Dict):
+    total = run['latency_ms']['total']
+    print(f"  {run['app']:>5} c={run['concurrency']:<3} {run['throughput_rps']:>8} rps  "
+          f"p50 {total.get('p50')} ms  p95 {total.get('p95')} ms  p99 {total.get('p99')} ms  "
+          f"errors {run['errors']}  rss +{run['memory']['growth_mb']} MB", file=sys.stderr)
+    for stage, summary in run['stages_ms'].items():
+        if summary['count']:
+            print(f"        {stage:<13} p50 {summary['p50']:>9}  p95 {summary['p95']:>9}  "
+                  f"p99 {summary['p99']:>9}  (n={summary['count']})", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the chat/search endpoints offline against fake Gemini and Pinecone"
+    )
+    parser.add_argument('--apps', default='flask,raw', help="Comma-separated: flask, raw")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="JSONL of {endpoint, query, k}")
+    parser.add_argument('--datasets', default=os.path.join(HERE, 'datasets'))
+    parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per app and level")
+    parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per app and level")
+    parser.add_argument('--embed-latency', type=float, default=0.02, help="Seconds per embedding call")
+    parser.add_argument('--search-latency', type=float, default=0.03, help="Seconds per index query")
+    parser.add_argument('--generate-latency', type=float, default=0.25, help="Seconds to first token")
+    parser.add_argument('--token-latency', type=float, default=0.001, help="Seconds per answer token")
+    parser.add_argument('--answer-tokens', type=int, default=64)
+    parser.add_argument('--dimension', type=int, default=768)
+    parser.add_argument('--warm-cache', action='store_true',
+                        help="Keep the embedding and retrieval caches on (replays then hit them)")
+    parser.add_argument('--memory-interval', type=int, default=50, help="Sample RSS every N requests")
+    parser.add_argument('--tracemalloc', action='store_true', help="Also report traced Python heap growth")
+    parser.add_argument('--out', default=None, help="Write results JSON here (default: stdout)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline results to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed relative latency/throughput regression")
+    parser.add_argument('--memory-slack-mb', type=float, default=64.0,
+                        help="Allowed extra memory growth per run")
+    args = parser.parse_args()
+
+    apps = [name.strip() for name in args.apps.split(',') if name.strip()]
+    unknown = [name for name in apps if name not in APPS]
+    if unknown:
+        parser.error(f"unknown app(s): {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+    corpus = load_corpus(args.corpus)
+    datasets_folder = os.path.abspath(args.datasets)
+
+    workdir = tempfile.mkdtemp(prefix='dgms-bench-')
+    try:
+        print(f"Preparing fake index from {datasets_folder} ...", file=sys.stderr)
+        # Ingest and app start-up chatter goes to stderr; stdout carries the JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            index = prepare_workspace(workdir, datasets_folder, args.dimension)
+        configure_environment(workdir, datasets_folder, args.warm_cache)
+        if args.tracemalloc:
+            tracemalloc.start()
+
+        recorder = StageRecorder()
+        results = {
+            'config': {
+                key: os.path.relpath(value, HERE) if key in ('corpus', 'datasets') else value
+                for key, value in vars(args).items()
+                if key not in ('out', 'baseline', 'save_baseline')
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'corpus_size': len(corpus),
+            'runs': [],
+        }
+        for name in apps:
+            with contextlib.redirect_stdout(sys.stderr):
+                module = importlib.import_module(APPS[name])
+            install_fakes(module, index, recorder, args)
+            for level in levels:
+                traced_before = tracemalloc.get_traced_memory()[0] if args.tracemalloc else None
+                run = {'app': name, **run_level(module, corpus, level, args.requests, args.warmup,
+                                                recorder, args.memory_interval)}
+                if traced_before is not None:
+                    run['memory']['traced_growth_mb'] = round(
+                        (tracemalloc.get_traced_memory()[0] - traced_before) / 2 ** 20, 3
+                    )
+                results['runs'].append(run)
+                _report(run)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    results['regressions'] = compare(results, baseline, args.tolerance, args.memory_slack_mb) if baseline else []
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    elif not args.save_baseline:
+        print(output)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"✓ Baseline saved to {args.baseline}", file=sys.stderr)
+
+    if baseline is None and not args.save_baseline:
+        print("⚠️ No baseline to compare against", file=sys.stderr)
+    for regression in results['regressions']:
+        print(f"❌ {regression}", file=sys.stderr)
+    if results['regressions']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
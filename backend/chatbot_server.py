@@ -0,0 +1,1567 @@
+# chatbot_server.py - Config, chatbot and routes shared by RAG_bot_flask.py and RAG_chatbot.py
+from flask import Flask, Response, request, jsonify
+from flask_cors import CORS
+import google.generativeai as genai
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from embedding_cache import build_cached_embeddings
+from retrieval_cache import RetrievalCache, normalize_query
+from prompt_assembler import PromptAssembler
+from stats_engine import StatsQueryError, format_result, stats_query_from_request
+from stats_snapshot import load_stats_engine
+from code_router import CodeLookupRouter
+from heatmap import HeatmapIndex, HeatmapQueryError, etag_matches, heatmap_query_from_request
+from response_encoding import (FastJSONProvider, ResponseEncoder, SourceRegistry, content_etag,
+                               response_options)
+from admission import (AdmissionController, CircuitBreaker, Overloaded, PriorityClass, Ticket,
+                       remaining, request_deadline, retrieval_only_answer)
+from ingest_manifest import IndexVersionWatcher
+from local_vectorstore import build_vectorstore
+from lexical_index import LexicalIndex, HybridRetriever, parse_weights, weights_key
+from streaming import sse_response, chunk_text, usage_metadata, cancel_stream
+from session_store import build_session_store, session_id_from_request, SESSION_HEADER
+from coalescing import SingleFlight, history_fingerprint
+from history_compactor import HistoryCompactor
+from batching import BatchRequestError, parse_batch, item_error, dedupe_sources
+from startup import BackgroundStartup, parse_queries
+from async_serving import AsgiApp, AsgiRequest, UpstreamLimits, agenerate
+from metrics import ChatbotMetrics, RequestTimings, PROMETHEUS_CONTENT_TYPE, timings_requested
+from typing import Awaitable, List, Dict, Iterator, Optional, Set, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import time
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+class Config:
+    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "your-gemini-api-key")
+    PINECONE_API_KEY = os.getenv("PINECONE_API_KEY", "your-pinecone-api-key")
+    PINECONE_INDEX_NAME = "dgms-mining-accidents"
+    PORT = 5000
+    EMBEDDING_MODEL = "models/embedding-001"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3")
+    EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", 2048))
+    EMBEDDING_CACHE_DISK_ENTRIES = int(os.getenv("EMBEDDING_CACHE_DISK_ENTRIES", 200000))
+    # "pinecone" or "local" (memory-mapped NumPy store written by pinecone_uploader.py)
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+    LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "./local_index")
+    INGEST_MANIFEST_PATH = os.getenv(
+        "INGEST_MANIFEST_PATH",
+        os.path.join(LOCAL_VECTOR_STORE_PATH, "manifest.json") if VECTOR_BACKEND == "local"
+        else "./ingest_manifest.json"
+    )
+    RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", 1024))
+    RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", 300))
+    # Cosine threshold for near-duplicate query hits (0 disables)
+    RETRIEVAL_CACHE_SIMILARITY = float(os.getenv("RETRIEVAL_CACHE_SIMILARITY", 0)) or None
+    # "memory" (single worker) or "sqlite" (shared by all workers on the host)
+    SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+    SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "./sessions.sqlite3")
+    SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", 20))
+    SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", 10000))
+    SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", 3600))
+    # Past COMPACT_AFTER_TURNS stored turns, all but the newest COMPACT_KEEP_TURNS are
+    # folded into a rolling summary in the background (keep below SESSION_MAX_TURNS)
+    HISTORY_COMPACTION = os.getenv("HISTORY_COMPACTION", "true").lower() == "true"
+    COMPACT_AFTER_TURNS = int(os.getenv("COMPACT_AFTER_TURNS", 8))
+    COMPACT_KEEP_TURNS = int(os.getenv("COMPACT_KEEP_TURNS", 3))
+    # /api/chat/history page size (?limit=) and its upper bound
+    HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 50))
+    HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 500))
+    # Prompt size caps (estimated tokens); "auto" picks table or minified JSON per document
+    PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", 3000))
+    PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", 600))
+    PROMPT_SUMMARY_TOKENS = int(os.getenv("PROMPT_SUMMARY_TOKENS", 300))
+    PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", "auto")
+    # Statement tables for exact numeric answers; STATS_ANSWER_MODE is "augment"
+    # (computed figures go into the prompt), "direct" (no LLM call) or "off"
+    DATASETS_FOLDER = os.getenv("DATASETS_FOLDER", "./datasets")
+    # Memory-mapped, precompiled tables shared by all workers; "" parses the JSON instead
+    STATS_SNAPSHOT_PATH = os.getenv("STATS_SNAPSHOT_PATH", "./stats_snapshot")
+    STATS_ANSWER_MODE = os.getenv("STATS_ANSWER_MODE", "augment")
+    # Browser cache lifetime of /api/heatmap; revalidation after that is a 304 via ETag
+    HEATMAP_MAX_AGE = int(os.getenv("HEATMAP_MAX_AGE", 300))
+    # Wire format: gzip/brotli per Accept-Encoding for bodies of at least COMPRESS_MIN_BYTES,
+    # MessagePack for clients sending "Accept: application/msgpack"
+    RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "true").lower() == "true"
+    COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+    GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+    BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 4))
+    RESPONSE_MSGPACK = os.getenv("RESPONSE_MSGPACK", "true").lower() == "true"
+    # Documents sent by reference (include_sources=false), served by /api/sources/<id>
+    SOURCE_CACHE_ENTRIES = int(os.getenv("SOURCE_CACHE_ENTRIES", 4096))
+    SOURCE_MAX_AGE = int(os.getenv("SOURCE_MAX_AGE", 300))
+    # BM25 index written by pinecone_uploader.py, fused with vector search ("" disables)
+    LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "./lexical_index")
+    # Reciprocal-rank-fusion weights per endpoint; "vector=1,lexical=0" is pure embedding search
+    CHAT_RETRIEVAL_WEIGHTS = parse_weights(os.getenv("CHAT_RETRIEVAL_WEIGHTS", "vector=1.0,lexical=1.0"))
+    SEARCH_RETRIEVAL_WEIGHTS = parse_weights(os.getenv("SEARCH_RETRIEVAL_WEIGHTS", "vector=1.0,lexical=1.5"))
+    # Candidates taken from each retriever before fusion
+    HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", 20))
+    # Push minerals/states/districts/years/severity named in the question down as
+    # metadata filters; below FILTER_MIN_HITS matches the top-k is filled unfiltered
+    ENTITY_FILTERS = os.getenv("ENTITY_FILTERS", "true").lower() == "true"
+    FILTER_MIN_HITS = int(os.getenv("FILTER_MIN_HITS", 3))
+    # Include the per-stage timings block in every response, not only when asked for
+    RESPONSE_TIMINGS = os.getenv("RESPONSE_TIMINGS", "false").lower() == "true"
+    # Identical concurrent retrievals/answers share one computation; a result
+    # is reused for COALESCE_GRACE_SECONDS after it completes
+    COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+    COALESCE_GRACE_SECONDS = float(os.getenv("COALESCE_GRACE_SECONDS", 2.0))
+    COALESCE_WAIT_TIMEOUT = float(os.getenv("COALESCE_WAIT_TIMEOUT", 60))
+    # /api/search/batch and /api/chat/batch: items per request, concurrent index
+    # queries, and generations in flight across all chat batches
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 500))
+    BATCH_SEARCH_WORKERS = int(os.getenv("BATCH_SEARCH_WORKERS", 8))
+    BATCH_CHAT_CONCURRENCY = int(os.getenv("BATCH_CHAT_CONCURRENCY", 4))
+    # Build the clients on a background thread (false: block the import, as before);
+    # /api/* answers 503 with Retry-After until they are built and warmed up
+    LAZY_STARTUP = os.getenv("LAZY_STARTUP", "true").lower() == "true"
+    STARTUP_RETRY_AFTER = int(os.getenv("STARTUP_RETRY_AFTER", 5))
+    # Searched once before taking traffic: opens upstream connections, fills the caches
+    WARMUP_QUERIES = parse_queries(os.getenv(
+        "WARMUP_QUERIES",
+        "roof fall accidents|explosion in underground coal mine|accidents involving dumpers and trucks"
+    ))
+    WARMUP_GENERATE = os.getenv("WARMUP_GENERATE", "false").lower() == "true"
+    # Connections kept open to the Pinecone index, reused by every request
+    PINECONE_POOL_THREADS = int(os.getenv("PINECONE_POOL_THREADS", 8))
+    # ASGI serving mode (asgi_app): per-request timeout, caps on concurrent upstream
+    # calls across all requests (0 = unbounded) and pools for blocking work
+    ASYNC_REQUEST_TIMEOUT = float(os.getenv("ASYNC_REQUEST_TIMEOUT", 60))
+    ASYNC_MAX_EMBEDS = int(os.getenv("ASYNC_MAX_EMBEDS", 32))
+    ASYNC_MAX_SEARCHES = int(os.getenv("ASYNC_MAX_SEARCHES", 32))
+    ASYNC_MAX_GENERATIONS = int(os.getenv("ASYNC_MAX_GENERATIONS", 64))
+    ASYNC_BLOCKING_THREADS = int(os.getenv("ASYNC_BLOCKING_THREADS", 32))
+    ASYNC_WSGI_THREADS = int(os.getenv("ASYNC_WSGI_THREADS", 16))
+    # Admission control: at most ADMISSION_CAPACITY requests in flight, and per class
+    # (search before chat before batch) at most *_LIMIT with *_QUEUE more waiting up to
+    # *_MAX_WAIT seconds; beyond that requests are shed with 429/503 and Retry-After
+    ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+    ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", 64))
+    SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", 64))
+    SEARCH_QUEUE = int(os.getenv("SEARCH_QUEUE", 128))
+    SEARCH_MAX_WAIT = float(os.getenv("SEARCH_MAX_WAIT", 2))
+    CHAT_LIMIT = int(os.getenv("CHAT_LIMIT", 32))
+    CHAT_QUEUE = int(os.getenv("CHAT_QUEUE", 64))
+    CHAT_MAX_WAIT = float(os.getenv("CHAT_MAX_WAIT", 10))
+    BATCH_LIMIT = int(os.getenv("BATCH_LIMIT", 4))
+    BATCH_QUEUE = int(os.getenv("BATCH_QUEUE", 8))
+    BATCH_MAX_WAIT = float(os.getenv("BATCH_MAX_WAIT", 30))
+    # Per-request deadlines in seconds (a client may ask for less with X-Request-Timeout);
+    # queueing and the model call only get what is left of it
+    SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", 10))
+    CHAT_DEADLINE = float(os.getenv("CHAT_DEADLINE", 45))
+    BATCH_DEADLINE = float(os.getenv("BATCH_DEADLINE", 300))
+    # Generation circuit breaker: opens once CIRCUIT_FAILURES of the last CIRCUIT_WINDOW
+    # model calls failed; chat then answers from retrieval only until a probe succeeds
+    CIRCUIT_BREAKER = os.getenv("CIRCUIT_BREAKER", "true").lower() == "true"
+    CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", 5))
+    CIRCUIT_WINDOW = int(os.getenv("CIRCUIT_WINDOW", 20))
+    CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", 30))
+    # A call cut off by its deadline counts as a failure only after this long
+    CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", 10))
+
+# ==========================================
+# RAG CHATBOT
+# ==========================================
+
+class DGMSChatbot:
+    """RAG-powered chatbot for DGMS mining accidents"""
+    
+    # Per-variant settings (RAG_chatbot.py overrides them for raw JSON retrieval):
+    # default top-k, the response key holding the documents, and the prompt
+    DEFAULT_K = 5
+    RESULT_KEY = 'sources'
+    CONTEXT_LABEL = "[Reference {n}]"
+    PROMPT = """You are an expert assistant for the Directorate General of Mine Safety (DGMS) in India. 
+Your role is to provide accurate, detailed information about mining accident classifications, 
+safety codes, locations, and accident causes based on DGMS standards.
+
+{stats_text}Context from DGMS classification system:
+{context_text}
+{history_text}
+
+User Question: {query}
+
+Instructions:
+1. Answer based on the provided context from DGMS classification codes
+2. When mentioning accident codes, include both the code number and description
+3. Explain what each classification code represents
+4. If asked about specific accident types, list all relevant codes
+5. If the context doesn't fully answer the question, say so clearly
+6. Be concise but comprehensive
+7. Use bullet points for listing multiple codes or categories
+
+Answer:"""
+    
+    def __init__(self, gemini_api_key: str, pinecone_api_key: str, index_name: str):
+        # Configure Gemini
+        genai.configure(api_key=gemini_api_key)
+        self.model = genai.GenerativeModel('gemini-pro')
+        
+        # Setup embeddings (cached: repeated questions skip the embedding call)
+        self.embeddings = build_cached_embeddings(
+            GoogleGenerativeAIEmbeddings(
+                model=Config.EMBEDDING_MODEL,
+                google_api_key=gemini_api_key
+            ),
+            model=Config.EMBEDDING_MODEL,
+            disk_path=Config.EMBEDDING_CACHE_PATH,
+            memory_entries=Config.EMBEDDING_CACHE_MEMORY_ENTRIES,
+            disk_entries=Config.EMBEDDING_CACHE_DISK_ENTRIES
+        )
+        
+        # Connect to Pinecone, or open the local store
+        self.vectorstore = build_vectorstore(
+            Config.VECTOR_BACKEND,
+            self.embeddings,
+            index_name=index_name,
+            pinecone_api_key=pinecone_api_key,
+            local_path=Config.LOCAL_VECTOR_STORE_PATH,
+            pool_threads=Config.PINECONE_POOL_THREADS
+        )
+        
+        # Exact-token search (mine/district names, cause codes) over the same chunks
+        self.lexical_index = LexicalIndex(Config.LEXICAL_INDEX_PATH) if Config.LEXICAL_INDEX_PATH else None
+        if self.lexical_index is not None and not len(self.lexical_index):
+            print(f"⚠️ No lexical index at {Config.LEXICAL_INDEX_PATH}; using vector search only")
+        self.retriever = HybridRetriever(self.vectorstore, self.lexical_index,
+                                         fetch_k=Config.HYBRID_FETCH_K)
+        
+        # Search results, invalidated when the uploader bumps the index version
+        self.retrieval_cache = RetrievalCache(
+            max_entries=Config.RETRIEVAL_CACHE_SIZE,
+            ttl_seconds=Config.RETRIEVAL_CACHE_TTL,
+            similarity_threshold=Config.RETRIEVAL_CACHE_SIMILARITY,
+            version_source=IndexVersionWatcher(Config.INGEST_MANIFEST_PATH).current
+        )
+        
+        # Conversation history, one bounded ring buffer per session
+        self.sessions = build_session_store(
+            Config.SESSION_BACKEND,
+            path=Config.SESSION_DB_PATH,
+            max_turns=Config.SESSION_MAX_TURNS,
+            max_sessions=Config.SESSION_MAX_SESSIONS,
+            idle_ttl=Config.SESSION_IDLE_TTL
+        )
+        
+        # Fits retrieved context and history into a fixed token budget
+        self.prompt_assembler = PromptAssembler(
+            context_budget=Config.PROMPT_CONTEXT_TOKENS,
+            history_budget=Config.PROMPT_HISTORY_TOKENS,
+            encoding=Config.PROMPT_ENCODING,
+            summary_budget=Config.PROMPT_SUMMARY_TOKENS
+        )
+        
+        # Folds older turns of long sessions into a rolling summary, off the request path
+        self.compactor = HistoryCompactor(
+            self.sessions,
+            lambda prompt: self.model.generate_content(prompt).text,
+            trigger_turns=Config.COMPACT_AFTER_TURNS,
+            keep_turns=Config.COMPACT_KEEP_TURNS,
+            summary_tokens=Config.PROMPT_SUMMARY_TOKENS,
+            enabled=Config.HISTORY_COMPACTION
+        )
+        if Config.HISTORY_COMPACTION and Config.COMPACT_AFTER_TURNS >= Config.SESSION_MAX_TURNS:
+            print(f"⚠️ COMPACT_AFTER_TURNS ({Config.COMPACT_AFTER_TURNS}) >= SESSION_MAX_TURNS "
+                  f"({Config.SESSION_MAX_TURNS}); turns will be dropped before they are summarized")
+        
+        # Typed tables over the statement files for exact numeric answers,
+        # mapped from the compiled snapshot (rebuilt if the statements changed)
+        self.stats = load_stats_engine(Config.STATS_SNAPSHOT_PATH, Config.DATASETS_FOLDER)
+        
+        # Code/category lookups against statement 4.0, answered without the LLM
+        self.code_router = CodeLookupRouter.from_stats(self.stats)
+        
+        # Gazetteer of the minerals, states, districts and mines in the statement tables
+        # (the same one the stats planner uses)
+        self.entity_extractor = self.stats.entities()
+        
+        # State/district severity aggregates (4.6a/4.6b) for the heat map, pre-serialized
+        self.heatmap = HeatmapIndex.from_stats(self.stats)
+        
+        # Single-flight collapsing of identical in-flight retrievals and answers
+        self.coalescer = SingleFlight(
+            grace_seconds=Config.COALESCE_GRACE_SECONDS,
+            wait_timeout=Config.COALESCE_WAIT_TIMEOUT,
+            enabled=Config.COALESCE_REQUESTS
+        )
+        
+        # Shared pools for batch requests; the chat pool caps concurrent generations
+        self.batch_search_executor = ThreadPoolExecutor(
+            max_workers=Config.BATCH_SEARCH_WORKERS, thread_name_prefix='batch-search')
+        self.batch_chat_executor = ThreadPoolExecutor(
+            max_workers=Config.BATCH_CHAT_CONCURRENCY, thread_name_prefix='batch-chat')
+        
+        # Bounded upstream concurrency for the async serving mode
+        self.upstream = UpstreamLimits(
+            embed=Config.ASYNC_MAX_EMBEDS,
+            search=Config.ASYNC_MAX_SEARCHES,
+            generate=Config.ASYNC_MAX_GENERATIONS
+        )
+        
+        # Admission control shared by both serving modes: bounded queues per priority class
+        self.admission = AdmissionController(
+            Config.ADMISSION_CAPACITY,
+            {
+                'search': PriorityClass(0, Config.SEARCH_LIMIT, Config.SEARCH_QUEUE, Config.SEARCH_MAX_WAIT),
+                'chat': PriorityClass(1, Config.CHAT_LIMIT, Config.CHAT_QUEUE, Config.CHAT_MAX_WAIT),
+                'batch': PriorityClass(2, Config.BATCH_LIMIT, Config.BATCH_QUEUE, Config.BATCH_MAX_WAIT),
+            },
+            enabled=Config.ADMISSION_CONTROL
+        )
+        
+        # Stops calling Gemini while it keeps failing; chat degrades to retrieval-only answers
+        self.breaker = CircuitBreaker(
+            'generate',
+            failure_threshold=Config.CIRCUIT_FAILURES,
+            window=Config.CIRCUIT_WINDOW,
+            reset_timeout=Config.CIRCUIT_RESET_SECONDS,
+            slow_call_seconds=Config.CIRCUIT_SLOW_CALL_SECONDS,
+            enabled=Config.CIRCUIT_BREAKER
+        )
+        
+        # Stage timings, request/error counters and cache views for /api/metrics
+        self.metrics = ChatbotMetrics(self)
+        
+        # Sources returned by reference, resolved by ID from recent responses or the BM25 index
+        self.sources = SourceRegistry(Config.SOURCE_CACHE_ENTRIES, resolve=self.resolve_source)
+    
+    def retrieve_context(self, query: str, k: Optional[int] = None,
+                         weights: Optional[Dict[str, float]] = None,
+                         timings: Optional[RequestTimings] = None,
+                         query_embedding: Optional[List[float]] = None) -> List[Dict]:
+        """Retrieve relevant documents by hybrid vector + BM25 search (cached, coalesced)
+        
+        Entities named in the query become metadata filters, with an
+        unfiltered top-up when they match too few documents.
+        """
+        k = self.DEFAULT_K if k is None else k
+        weights = weights or Config.CHAT_RETRIEVAL_WEIGHTS
+        mode = weights_key(weights)
+        filters = self.entity_extractor.filters(query) if Config.ENTITY_FILTERS else None
+        
+        def search(embedding):
+            hits = self.retriever.filtered_search(
+                query, k, weights, filters, min(k, Config.FILTER_MIN_HITS), timings=timings,
+                embedding=embedding if embedding is not None else query_embedding
+            )
+            self.record_filter(filters, hits)
+            return self._documents(hits)
+        
+        timings = timings or self.metrics.timings()
+        with timings.span('retrieve'):
+            results, _ = self.coalescer.do(
+                ('retrieve', normalize_query(query), k, mode),
+                lambda: self.retrieval_cache.get_or_compute(
+                    query, k, search, filters=filters, embed=self.embeddings.embed_query, mode=mode
+                )
+            )
+        self.metrics.documents.observe(len(results))
+        return results
+    
+    def resolve_source(self, doc_id: str) -> Optional[Dict]:
+        """A source document by vector ID, from the BM25 index (which holds every chunk)"""
+        doc = self.lexical_index.get(doc_id) if self.lexical_index is not None else None
+        if doc is None:
+            return None
+        document = self._documents([(doc, None)])[0]
+        document.pop('retrieval', None)
+        return document
+    
+    @staticmethod
+    def _documents(hits: List[Tuple[object, Dict]]) -> List[Dict]:
+        return [
+            {
+                'content': doc.page_content,
+                'metadata': doc.metadata,
+                'retrieval': retrieval,
+            }
+            for doc, retrieval in hits
+        ]
+    
+    async def aretrieve_context(self, query: str, k: Optional[int] = None,
+                                weights: Optional[Dict[str, float]] = None,
+                                timings: Optional[RequestTimings] = None) -> List[Dict]:
+        """retrieve_context for the async serving mode (same cache and coalescing)"""
+        k = self.DEFAULT_K if k is None else k
+        weights = weights or Config.CHAT_RETRIEVAL_WEIGHTS
+        mode = weights_key(weights)
+        filters = self.entity_extractor.filters(query) if Config.ENTITY_FILTERS else None
+        
+        async def search(embedding):
+            hits = await self.retriever.afiltered_search(
+                query, k, weights, filters, min(k, Config.FILTER_MIN_HITS), embedding=embedding,
+                timings=timings, limits=self.upstream
+            )
+            self.record_filter(filters, hits)
+            return self._documents(hits)
+        
+        timings = timings or self.metrics.timings()
+        with timings.span('retrieve'):
+            results, _ = await self.coalescer.ado(
+                ('retrieve', normalize_query(query), k, mode),
+                lambda: self.retrieval_cache.aget_or_compute(
+                    query, k, search, filters=filters, embed=self.embeddings.aembed_query, mode=mode
+                )
+            )
+        self.metrics.documents.observe(len(results))
+        return results
+    
+    def record_filter(self, filters: Optional[Dict], hits: List[Tuple[object, Dict]]):
+        """Count an entity-filtered search as 'filtered' or, if topped up unfiltered, 'fallback'"""
+        if filters:
+            topped_up = any(info.get('fallback') for _, info in hits)
+            self.metrics.filtered_searches.inc('fallback' if topped_up else 'filtered')
+    
+    def build_prompt(self, query: str, context_docs: List[Dict], 
+                    conversation_history: List[Dict] = None,
+                    stats_result: Optional[Dict] = None,
+                    summary: Optional[Dict] = None) -> Tuple[str, Dict]:
+        """Build prompt with context and history; returns (prompt, token accounting)"""
+        
+        # Format context, the rolling summary and recent history within the token budget
+        context_text, history_text, prompt_usage = self.prompt_assembler.assemble(
+            query, context_docs, conversation_history, label=self.CONTEXT_LABEL, summary=summary
+        )
+        if history_text:
+            history_text = "\n\nPrevious conversation:\n" + history_text
+        
+        stats_text = ""
+        if stats_result:
+            stats_text = (
+                "Exact figures computed from the DGMS statement tables "
+                "(use these numbers as given; do not recompute them):\n"
+                f"{format_result(stats_result)}\n\n"
+            )
+        
+        prompt = self.PROMPT.format(stats_text=stats_text, context_text=context_text,
+                                    history_text=history_text, query=query)
+        
+        return prompt, prompt_usage
+    
+    def generate_response(self, query: str, k: Optional[int] = None,
+                          use_history: bool = True, session_id: str = 'default',
+                          timings: Optional[RequestTimings] = None,
+                          query_embedding: Optional[List[float]] = None,
+                          deadline: Optional[float] = None) -> Dict:
+        """Generate response using RAG; per-stage durations are recorded in `timings`"""
+        k = self.DEFAULT_K if k is None else k
+        timings = timings or self.metrics.timings()
+        route = None
+        
+        try:
+            # Code lookups (and numeric questions in direct mode) skip RAG
+            with timings.span('route'):
+                answer, context_docs, stats_result, route = self.route_query(query)
+            prompt_usage = None
+            coalesced = False
+            degraded = None
+            
+            if answer is None:
+                code_docs = context_docs
+                with timings.span('history'):
+                    summary, history = (self.sessions.get_conversation(session_id) if use_history
+                                        else (None, None))
+                
+                # Identical questions with the same recent history share one generation
+                key = ('chat', normalize_query(query), k, weights_key(Config.CHAT_RETRIEVAL_WEIGHTS),
+                       history_fingerprint(history, self.prompt_assembler.history_turns, summary))
+                waited = time.perf_counter()
+                (answer, context_docs, prompt_usage, degraded), coalesced = self.coalescer.do(
+                    key, lambda: self._rag_answer(query, k, history, stats_result, timings,
+                                                  query_embedding, summary, deadline, code_docs)
+                )
+                if coalesced:
+                    timings.add('coalesced_wait', time.perf_counter() - waited)
+            
+            # Update conversation history (a retrieval-only fallback is not part of it)
+            if use_history and degraded is None:
+                with timings.span('history'):
+                    stored = self.sessions.append(session_id, {
+                        'user': query,
+                        'assistant': answer
+                    })
+                self.compactor.maybe_compact(session_id, stored)
+            
+            self.metrics.record_request('chat', route)
+            return self._chat_result(query, answer, context_docs, session_id, prompt_usage,
+                                     stats_result, route, coalesced, timings, degraded)
+        
+        except Exception as e:
+            self.metrics.record_request('chat', route, error=e)
+            return {
+                'success': False,
+                'error': str(e),
+                'error_type': type(e).__name__,
+                'query': query,
+                'timings': timings.finish()
+            }
+    
+    def _chat_result(self, query: str, answer: str, context_docs: List[Dict], session_id: str,
+                     prompt_usage: Optional[Dict], stats_result: Optional[Dict], route: str,
+                     coalesced: bool, timings: RequestTimings,
+                     degraded: Optional[str] = None) -> Dict:
+        return {
+            'success': True,
+            'answer': answer,
+            self.RESULT_KEY: context_docs,
+            'query': query,
+            'num_sources': len(context_docs),
+            'session_id': session_id,
+            'prompt_usage': prompt_usage,
+            'stats': stats_result,
+            'route': route,
+            'coalesced': coalesced,
+            'degraded': degraded,
+            'timings': timings.finish()
+        }
+    
+    def _rag_answer(self, query: str, k: int, history: Optional[List[Dict]],
+                    stats_result: Optional[Dict], timings: RequestTimings,
+                    query_embedding: Optional[List[float]] = None,
+                    summary: Optional[Dict] = None,
+                    deadline: Optional[float] = None,
+                    code_docs: Optional[List[Dict]] = None) -> Tuple[str, List[Dict], Dict, Optional[str]]:
+        """(answer, sources, prompt usage, degraded reason) from retrieval + generation"""
+        # Retrieve relevant documents (after the entries of any codes the query names)
+        context_docs = (code_docs or []) + self.retrieve_context(query, k=k, timings=timings,
+                                                                 query_embedding=query_embedding)
+        
+        # Build prompt
+        with timings.span('prompt_build'):
+            prompt, prompt_usage = self.build_prompt(query, context_docs, history, stats_result,
+                                                     summary)
+        self.metrics.record_prompt(prompt, prompt_usage)
+        
+        # Generate response (or fall back to the retrieved records)
+        with timings.span('generate'):
+            answer, degraded = self._generate(prompt, context_docs, stats_result, deadline)
+        return answer, context_docs, prompt_usage, degraded
+    
+    async def agenerate_response(self, query: str, k: Optional[int] = None,
+                                 use_history: bool = True, session_id: str = 'default',
+                                 timings: Optional[RequestTimings] = None,
+                                 deadline: Optional[float] = None) -> Dict:
+        """generate_response for the async serving mode
+        
+        Retrieval starts first; the statistics lookup and session loading run
+        on worker threads meanwhile, and generation awaits the model without
+        holding a thread. Cancellation (timeout, client gone) stops them all.
+        """
+        k = self.DEFAULT_K if k is None else k
+        timings = timings or self.metrics.timings()
+        route = None
+        retrieval = None
+        
+        async def load_conversation():
+            if not use_history:
+                return None, None
+            with timings.span('history'):
+                return await asyncio.to_thread(self.sessions.get_conversation, session_id)
+        
+        async def lookup_stats():
+            with timings.span('route'):
+                return await asyncio.to_thread(self.answer_stats, query)
+        
+        try:
+            with timings.span('route'):
+                lookup = self.code_router.route(query)
+            prompt_usage = None
+            coalesced = False
+            degraded = None
+            
+            if lookup is not None and lookup['direct']:
+                answer, context_docs, stats_result, route = lookup['answer'], lookup['sources'], None, 'code_lookup'
+            else:
+                code_docs = lookup['sources'] if lookup is not None else []
+                # In direct mode a statistics answer makes retrieval unnecessary
+                if Config.STATS_ANSWER_MODE != 'direct':
+                    retrieval = asyncio.ensure_future(self.aretrieve_context(query, k=k, timings=timings))
+                stats_result, (summary, history) = await asyncio.gather(lookup_stats(), load_conversation())
+                
+                if stats_result is not None and Config.STATS_ANSWER_MODE == 'direct':
+                    answer, context_docs, route = format_result(stats_result), [], 'stats'
+                else:
+                    route = 'rag'
+                    if retrieval is None:
+                        retrieval = asyncio.ensure_future(self.aretrieve_context(query, k=k, timings=timings))
+                    
+                    # Identical questions with the same recent history share one generation
+                    key = ('chat', normalize_query(query), k, weights_key(Config.CHAT_RETRIEVAL_WEIGHTS),
+                           history_fingerprint(history, self.prompt_assembler.history_turns, summary))
+                    waited = time.perf_counter()
+                    (answer, context_docs, prompt_usage, degraded), coalesced = await self.coalescer.ado(
+                        key, lambda: self._arag_answer(query, retrieval, history, stats_result,
+                                                       timings, summary, deadline, code_docs)
+                    )
+                    if coalesced:
+                        timings.add('coalesced_wait', time.perf_counter() - waited)
+            
+            # Update conversation history (a retrieval-only fallback is not part of it)
+            if use_history and degraded is None:
+                with timings.span('history'):
+                    stored = await asyncio.to_thread(self.sessions.append, session_id, {
+                        'user': query,
+                        'assistant': answer
+                    })
+                self.compactor.maybe_compact(session_id, stored)
+            
+            self.metrics.record_request('chat', route)
+            return self._chat_result(query, answer, context_docs, session_id, prompt_usage,
+                                     stats_result, route, coalesced, timings, degraded)
+        
+        except asyncio.CancelledError:
+            self.metrics.record_request('chat', route, cancelled=True)
+            raise
+        except Exception as e:
+            self.metrics.record_request('chat', route, error=e)
+            return {
+                'success': False,
+                'error': str(e),
+                'error_type': type(e).__name__,
+                'query': query,
+                'timings': timings.finish()
+            }
+        finally:
+            if retrieval is not None:
+                if not retrieval.done():
+                    retrieval.cancel()
+                elif not retrieval.cancelled():
+                    retrieval.exception()   # a failure we never awaited is not "unretrieved"
+    
+    async def _arag_answer(self, query: str, retrieval: Awaitable[List[Dict]],
+                           history: Optional[List[Dict]], stats_result: Optional[Dict],
+                           timings: RequestTimings,
+                           summary: Optional[Dict] = None,
+                           deadline: Optional[float] = None,
+                           code_docs: Optional[List[Dict]] = None) -> Tuple[str, List[Dict], Dict, Optional[str]]:
+        """_rag_answer on the event loop, given the already started retrieval"""
+        context_docs = (code_docs or []) + await retrieval
+        
+        # Prompt assembly is CPU work; keep it off the loop
+        with timings.span('prompt_build'):
+            prompt, prompt_usage = await asyncio.to_thread(
+                self.build_prompt, query, context_docs, history, stats_result, summary
+            )
+        self.metrics.record_prompt(prompt, prompt_usage)
+        
+        with timings.span('generate'):
+            answer, degraded = await self._agenerate(prompt, context_docs, stats_result, deadline)
+        return answer, context_docs, prompt_usage, degraded
+    
+    def _skip_generation(self, deadline: Optional[float]) -> Optional[str]:
+        """Why the model must not be called now ('deadline', 'circuit_open'), or None"""
+        budget = remaining(deadline)
+        if budget is not None and budget <= 0:
+            return 'deadline'
+        if not self.breaker.allow():
+            return 'circuit_open'
+        return None
+    
+    def _degraded_answer(self, reason: str, context_docs: List[Dict],
+                         stats_result: Optional[Dict]) -> str:
+        self.metrics.record_degraded(reason)
+        return retrieval_only_answer(context_docs, format_result(stats_result) if stats_result else None)
+    
+    def _generation_failed(self, error: Exception, deadline: Optional[float], started: float) -> str:
+        """Record a failed model call with the breaker; its degraded reason"""
+        self.metrics.errors.inc('generate', type(error).__name__)
+        budget = remaining(deadline)
+        if budget is not None and budget <= 0:
+            self.breaker.record_timeout(time.perf_counter() - started)
+            return 'deadline'
+        self.breaker.record_failure()
+        return 'upstream_error'
+    
+    @staticmethod
+    def _request_options(deadline: Optional[float]) -> Dict:
+        """generate_content arguments bounding the call by what is left of `deadline`"""
+        budget = remaining(deadline)
+        return {} if budget is None else {'request_options': {'timeout': max(budget, 0.001)}}
+    
+    def _generate(self, prompt: str, context_docs: List[Dict], stats_result: Optional[Dict],
+                  deadline: Optional[float] = None) -> Tuple[str, Optional[str]]:
+        """(answer, degraded reason): the model's answer, or one built from the retrieved
+        records when the circuit is open, the deadline has passed or the call fails"""
+        reason = self._skip_generation(deadline)
+        if reason is None:
+            started = time.perf_counter()
+            try:
+                answer = self.model.generate_content(prompt, **self._request_options(deadline)).text
+            except Exception as e:
+                reason = self._generation_failed(e, deadline, started)
+            else:
+                self.breaker.record_success()
+                return answer, None
+        return self._degraded_answer(reason, context_docs, stats_result), reason
+    
+    async def _agenerate(self, prompt: str, context_docs: List[Dict], stats_result: Optional[Dict],
+                         deadline: Optional[float] = None) -> Tuple[str, Optional[str]]:
+        """_generate on the event loop; the model call is cancelled when the deadline passes"""
+        reason = self._skip_generation(deadline)
+        if reason is None:
+            started = time.perf_counter()
+            try:
+                answer = await asyncio.wait_for(agenerate(self.model, prompt, self.upstream),
+                                                remaining(deadline))
+            except Exception as e:
+                reason = self._generation_failed(e, deadline, started)
+            else:
+                self.breaker.record_success()
+                return answer, None
+        return self._degraded_answer(reason, context_docs, stats_result), reason
+    
+    def _embed_batch(self, queries: List[str], weights: Dict[str, float],
+                     timings: RequestTimings) -> Dict[str, List[float]]:
+        """Query embeddings for a batch in one upstream call ({} if not needed or it failed)"""
+        if not queries or not self.retriever.uses_vector(weights):
+            return {}
+        try:
+            with timings.span('embed'):
+                return dict(zip(queries, self.embeddings.embed_queries(queries)))
+        except Exception as e:
+            # Each item embeds on its own instead, so failures stay per item
+            print(f"⚠️ Batch embedding failed ({e}); embedding queries one by one")
+            return {}
+    
+    def retrieve_batch(self, items: List[Tuple[str, int]],
+                       weights: Optional[Dict[str, float]] = None,
+                       timings: Optional[RequestTimings] = None) -> List[Union[List[Dict], Exception]]:
+        """retrieve_context for many (query, k): one embedding call, concurrent index queries
+        
+        Results come back in input order; an item that failed holds its exception.
+        """
+        weights = weights or Config.CHAT_RETRIEVAL_WEIGHTS
+        timings = timings or self.metrics.timings()
+        
+        # Each distinct (query, k) is searched once
+        distinct = {}
+        for query, k in items:
+            distinct.setdefault((normalize_query(query), k), query)
+        embeddings = self._embed_batch(list(dict.fromkeys(distinct.values())), weights, timings)
+        
+        def run(key):
+            query = distinct[key]
+            try:
+                return self.retrieve_context(query, k=key[1], weights=weights,
+                                             query_embedding=embeddings.get(query))
+            except Exception as e:
+                return e
+        
+        with timings.span('retrieve'):
+            found = dict(zip(distinct, self.batch_search_executor.map(run, distinct)))
+        return [found[(normalize_query(query), k)] for query, k in items]
+    
+    def generate_batch(self, items: List[Tuple[str, int]],
+                       timings: Optional[RequestTimings] = None,
+                       deadline: Optional[float] = None) -> List[Dict]:
+        """generate_response for many independent (query, k), without session history
+        
+        Queries are embedded in one call; generations run on the shared batch
+        pool, so at most BATCH_CHAT_CONCURRENCY are in flight across all batches.
+        Items still unanswered when `deadline` passes get retrieval-only answers.
+        """
+        timings = timings or self.metrics.timings()
+        
+        distinct = {}
+        for query, k in items:
+            distinct.setdefault((normalize_query(query), k), query)
+        embeddings = self._embed_batch(list(dict.fromkeys(distinct.values())),
+                                       Config.CHAT_RETRIEVAL_WEIGHTS, timings)
+        
+        def run(key):
+            query = distinct[key]
+            return self.generate_response(query, k=key[1], use_history=False,
+                                          query_embedding=embeddings.get(query), deadline=deadline)
+        
+        with timings.span('generate'):
+            answers = dict(zip(distinct, self.batch_chat_executor.map(run, distinct)))
+        return [answers[(normalize_query(query), k)] for query, k in items]
+    
+    def warm_up(self, queries: List[str]) -> Dict:
+        """Open upstream connections and fill the caches before taking traffic"""
+        report = {'queries': len(queries)}
+        if queries:
+            started = time.perf_counter()
+            found = self.retrieve_batch([(query, self.DEFAULT_K) for query in queries])
+            report['retrieve_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            errors = [str(outcome) for outcome in found if isinstance(outcome, Exception)]
+            if errors:
+                report['errors'] = errors
+        if Config.WARMUP_GENERATE:
+            started = time.perf_counter()
+            self.model.generate_content("Reply with OK.")
+            report['generate_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return report
+    
+    def stream_response(self, query: str, k: Optional[int] = None, use_history: bool = True,
+                        session_id: str = 'default',
+                        deadline: Optional[float] = None,
+                        fields: Optional[Set[str]] = None,
+                        include_sources: bool = True) -> Iterator[Tuple[str, Dict]]:
+        """Yield (event, data): sources first, then answer tokens, then done
+        
+        `fields` and `include_sources` shape the sources event as they shape /api/chat.
+        """
+        k = self.DEFAULT_K if k is None else k
+        timings = self.metrics.timings()
+        started = timings.started
+        route = None
+        
+        try:
+            with timings.span('route'):
+                direct_answer, context_docs, stats_result, route = self.route_query(query)
+            prompt, prompt_usage = None, None
+            degraded = None
+            if direct_answer is None:
+                context_docs = context_docs + self.retrieve_context(query, k=k, timings=timings)
+                with timings.span('history'):
+                    summary, history = (self.sessions.get_conversation(session_id) if use_history
+                                        else (None, None))
+                with timings.span('prompt_build'):
+                    prompt, prompt_usage = self.build_prompt(query, context_docs, history, stats_result,
+                                                             summary)
+                self.metrics.record_prompt(prompt, prompt_usage)
+                # Circuit open or no time left: stream the retrieved records instead
+                degraded = self._skip_generation(deadline)
+                if degraded is not None:
+                    direct_answer = self._degraded_answer(degraded, context_docs, stats_result)
+        except Exception as e:
+            self.metrics.record_request('stream', route, error=e)
+            yield 'error', {'success': False, 'error': str(e), 'error_type': type(e).__name__,
+                            'query': query}
+            return
+        
+        retrieval_ms = (time.perf_counter() - started) * 1000
+        yield 'sources', self.sources.shape({
+            'query': query,
+            'session_id': session_id,
+            self.RESULT_KEY: context_docs,
+            'num_sources': len(context_docs),
+            'stats': stats_result,
+            'route': route,
+            'degraded': degraded
+        }, self.RESULT_KEY, fields, include_sources)
+        
+        response = None
+        completed = False
+        failed = False
+        parts = []
+        first_token_at = None
+        generate_started = time.perf_counter()
+        try:
+            if direct_answer is not None:
+                chunks = [direct_answer]
+            else:
+                response = self.model.generate_content(prompt, stream=True,
+                                                       **self._request_options(deadline))
+                chunks = (chunk_text(chunk) for chunk in response)
+            for text in chunks:
+                if not text:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    timings.add('first_token', first_token_at - started)
+                parts.append(text)
+                yield 'token', {'text': text}
+            completed = True
+        except Exception as e:
+            failed = True
+            if direct_answer is None:
+                self._generation_failed(e, deadline, generate_started)
+            self.metrics.record_request('stream', route, error=e)
+            yield 'error', {'success': False, 'error': str(e), 'error_type': type(e).__name__,
+                            'query': query}
+            return
+        finally:
+            # Client went away (generator closed) or generation failed
+            if not completed:
+                cancel_stream(response)
+                if not failed:
+                    self.metrics.record_request('stream', route, cancelled=True)
+        if direct_answer is None:
+            timings.add('generate', time.perf_counter() - generate_started)
+            self.breaker.record_success()
+        
+        answer = ''.join(parts)
+        
+        # Only a fully delivered model answer becomes part of the conversation
+        if use_history and degraded is None:
+            with timings.span('history'):
+                stored = self.sessions.append(session_id, {
+                    'user': query,
+                    'assistant': answer
+                })
+            self.compactor.maybe_compact(session_id, stored)
+        
+        self.metrics.record_request('stream', route)
+        yield 'done', {
+            'success': True,
+            'query': query,
+            'timings': {
+                **timings.finish(),
+                'retrieval_ms': round(retrieval_ms, 1)
+            },
+            'usage': usage_metadata(response),
+            'prompt_usage': prompt_usage,
+            'degraded': degraded
+        }
+    
+    def route_query(self, query: str) -> Tuple[Optional[str], List[Dict], Optional[Dict], str]:
+        """(direct answer, sources, stats result, route) decided before any retrieval
+        
+        Code lookups, and numeric questions when STATS_ANSWER_MODE is "direct",
+        are answered without embedding, vector search or generation. Codes named
+        in a question about the accidents under them come back as sources for
+        the RAG answer instead.
+        """
+        lookup = self.code_router.route(query)
+        if lookup is not None and lookup['direct']:
+            return lookup['answer'], lookup['sources'], None, 'code_lookup'
+        code_docs = lookup['sources'] if lookup is not None else []
+        stats_result = self.answer_stats(query)
+        if stats_result is not None and Config.STATS_ANSWER_MODE == 'direct':
+            return format_result(stats_result), [], stats_result, 'stats'
+        return None, code_docs, stats_result, 'rag'
+    
+    def answer_stats(self, query: str) -> Optional[Dict]:
+        """Exact figures for a recognised numeric question, or None"""
+        if Config.STATS_ANSWER_MODE == 'off':
+            return None
+        return self.stats.answer(query)
+    
+    def get_history(self, session_id: str, before: Optional[int] = None,
+                    limit: int = 50) -> Dict:
+        """One page of a session's stored turns (oldest first, older than seq `before`)
+        plus its rolling summary; 'next_before' is the cursor for the page before it"""
+        summary, _ = self.sessions.get_conversation(session_id)
+        turns, total = self.sessions.get_page(session_id, before=before, limit=limit + 1)
+        more = len(turns) > limit
+        turns = turns[-limit:]
+        return {
+            'summary': summary,
+            'history': turns,
+            'count': len(turns),
+            'total': total,
+            'next_before': turns[0]['seq'] if more else None
+        }
+    
+    def clear_history(self, session_id: str):
+        """Clear conversation history of one session"""
+        return self.sessions.clear(session_id)
+
+# ==========================================
+# FLASK APPLICATION
+# ==========================================
+
+# Probes that must answer while the chatbot is still starting
+READINESS_EXEMPT = {'/api/health', '/api/health/live', '/api/health/ready'}
+
+class ChatbotServer:
+    """Flask app and its ASGI wrapper serving one chatbot variant
+    
+    The chatbot is built in the background, so the worker answers liveness checks
+    (and fast 503s) at once instead of blocking its boot on Gemini and Pinecone.
+    """
+    
+    def __init__(self, import_name: str, chatbot_class: type = DGMSChatbot,
+                 index_name: str = Config.PINECONE_INDEX_NAME):
+        self.import_name = import_name
+        self.default_k = chatbot_class.DEFAULT_K
+        self.chatbot: Optional[DGMSChatbot] = None
+        
+        self.app = Flask(import_name)
+        # orjson behind jsonify/request.json; compression and MessagePack per request below
+        self.app.json = FastJSONProvider(self.app)
+        CORS(self.app)  # Enable CORS for frontend
+        
+        self.encoder = ResponseEncoder(
+            compression=Config.RESPONSE_COMPRESSION,
+            min_bytes=Config.COMPRESS_MIN_BYTES,
+            gzip_level=Config.GZIP_LEVEL,
+            brotli_quality=Config.BROTLI_QUALITY,
+            allow_msgpack=Config.RESPONSE_MSGPACK
+        )
+        self._register_routes()
+        
+        # `uvicorn <module>:asgi_app` serves /api/chat and /api/search as coroutines,
+        # so one process holds hundreds of slow chats; other routes run the Flask app
+        # on a thread pool
+        self.asgi_app = AsgiApp(
+            self.app,
+            {('POST', '/api/chat'): self.chat_async, ('POST', '/api/search'): self.search_async},
+            dumps=self.app.json.dumps,
+            encoder=self.encoder,
+            request_timeout=Config.ASYNC_REQUEST_TIMEOUT,
+            blocking_threads=Config.ASYNC_BLOCKING_THREADS,
+            wsgi_threads=Config.ASYNC_WSGI_THREADS
+        )
+        
+        print("Initializing DGMS Chatbot...")
+        self.startup = BackgroundStartup(
+            'DGMS Chatbot',
+            lambda: chatbot_class(
+                Config.GEMINI_API_KEY,
+                Config.PINECONE_API_KEY,
+                index_name
+            ),
+            warm_up=lambda bot: bot.warm_up(Config.WARMUP_QUERIES),
+            on_ready=self._publish,
+            retry_after=Config.STARTUP_RETRY_AFTER
+        ).start(background=Config.LAZY_STARTUP)
+    
+    def _publish(self, component: DGMSChatbot):
+        self.chatbot = component
+    
+    def _register_routes(self):
+        app = self.app
+        app.after_request(self.compress)
+        app.before_request(self.require_ready)
+        app.add_url_rule('/api/chat', view_func=self.chat, methods=['POST'])
+        app.add_url_rule('/api/chat/stream', view_func=self.chat_stream, methods=['POST'])
+        app.add_url_rule('/api/chat/history', view_func=self.get_history, methods=['GET'])
+        app.add_url_rule('/api/chat/clear', view_func=self.clear_history, methods=['POST'])
+        app.add_url_rule('/api/search', view_func=self.search, methods=['POST'])
+        app.add_url_rule('/api/search/batch', view_func=self.search_batch, methods=['POST'])
+        app.add_url_rule('/api/chat/batch', view_func=self.chat_batch, methods=['POST'])
+        app.add_url_rule('/api/stats', view_func=self.stats, methods=['GET', 'POST'])
+        app.add_url_rule('/api/heatmap', view_func=self.heatmap, methods=['GET'])
+        app.add_url_rule('/api/sources/<path:doc_id>', view_func=self.get_source, methods=['GET'])
+        app.add_url_rule('/api/metrics', view_func=self.prometheus_metrics, methods=['GET'])
+        app.add_url_rule('/api/health', view_func=self.health, methods=['GET'])
+        app.add_url_rule('/api/health/live', view_func=self.liveness, methods=['GET'])
+        app.add_url_rule('/api/health/ready', view_func=self.readiness, methods=['GET'])
+    
+    def not_ready(self) -> Tuple[Dict, Dict[str, str]]:
+        """503 body and Retry-After header while the chatbot is starting"""
+        return {
+            'success': False,
+            'error': 'Service is starting up',
+            'state': self.startup.state
+        }, {'Retry-After': str(self.startup.retry_after())}
+    
+    def respond(self, payload: Dict, status: int = 200,
+                headers: Optional[Dict[str, str]] = None) -> Response:
+        """Payload as JSON or MessagePack, whichever the Accept header prefers"""
+        body, content_type = self.encoder.serialize(payload, request.headers.get('Accept'))
+        response = Response(body, status=status, content_type=content_type, headers=headers)
+        response.vary.add('Accept')
+        return response
+    
+    def compress(self, response):
+        """gzip/brotli per Accept-Encoding (server-sent event streams pass through)"""
+        return self.encoder.compress_response(response, request.headers.get('Accept-Encoding'))
+    
+    def admit(self, name: str, deadline_seconds: float,
+              timings: Optional[RequestTimings] = None) -> Ticket:
+        """Admission slot for this request (raises Overloaded); queue time goes to `timings`"""
+        ticket = self.chatbot.admission.admit(name, request_deadline(request, deadline_seconds))
+        if timings is not None and ticket.waited:
+            timings.add('queue_wait', ticket.waited)
+        return ticket
+    
+    def shed(self, error: Overloaded) -> Tuple[Response, int, Dict[str, str]]:
+        """429/503 with Retry-After for a request turned away by admission control"""
+        body, headers = error.response()
+        return jsonify(body), error.status, headers
+    
+    def require_ready(self):
+        """Fast 503 with Retry-After until the chatbot is built and warmed up"""
+        if self.startup.ready or request.method == 'OPTIONS' or request.path in READINESS_EXEMPT:
+            return None
+        body, headers = self.not_ready()
+        return jsonify(body), 503, headers
+    
+    def chat(self):
+        """Main chat endpoint"""
+        try:
+            data = request.json
+            query = data.get('message', '').strip()
+            k = data.get('k', self.default_k)
+            use_history = data.get('use_history', True)
+            session_id, _ = session_id_from_request(request)
+            
+            if not query:
+                return jsonify({
+                    'success': False,
+                    'error': 'No message provided'
+                }), 400
+            try:
+                fields, include_sources = response_options(request, data)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            
+            # Generate response
+            timings = self.chatbot.metrics.timings()
+            with self.admit('chat', Config.CHAT_DEADLINE, timings) as ticket:
+                result = self.chatbot.generate_response(query, k=k, use_history=use_history,
+                                                        session_id=session_id, timings=timings,
+                                                        deadline=ticket.deadline)
+            if not timings_requested(request, Config.RESPONSE_TIMINGS):
+                result.pop('timings', None)
+            
+            result = self.chatbot.sources.shape(result, self.chatbot.RESULT_KEY, fields,
+                                                include_sources)
+            status = 200 if result['success'] else 500
+            with timings.span('serialize'):
+                body = self.respond(result, status, {SESSION_HEADER: session_id})
+            return body
+        
+        except Overloaded as e:
+            return self.shed(e)
+        except Exception as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    def chat_stream(self):
+        """Streaming chat endpoint (server-sent events)"""
+        data = request.json or {}
+        query = data.get('message', '').strip()
+        k = data.get('k', self.default_k)
+        use_history = data.get('use_history', True)
+        session_id, _ = session_id_from_request(request)
+        
+        if not query:
+            return jsonify({
+                'success': False,
+                'error': 'No message provided'
+            }), 400
+        try:
+            fields, include_sources = response_options(request, data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        try:
+            ticket = self.admit('chat', Config.CHAT_DEADLINE)
+        except Overloaded as e:
+            return self.shed(e)
+        
+        response = sse_response(self.chatbot.stream_response(query, k=k, use_history=use_history,
+                                                             session_id=session_id,
+                                                             deadline=ticket.deadline,
+                                                             fields=fields,
+                                                             include_sources=include_sources))
+        # The slot is held until the stream ends or the client goes away
+        response.call_on_close(ticket.release)
+        response.headers[SESSION_HEADER] = session_id
+        return response
+    
+    def get_history(self):
+        """Get conversation history of the caller's session, a page at a time
+        
+        ?limit= turns per page (newest first by page, oldest first within it);
+        ?before=<next_before> fetches the page before the previous one.
+        """
+        session_id, _ = session_id_from_request(request)
+        try:
+            limit = int(request.args.get('limit', Config.HISTORY_PAGE_SIZE))
+            before = request.args.get('before')
+            before = int(before) if before else None
+        except ValueError:
+            return jsonify({'success': False, 'error': "'limit' and 'before' must be integers"}), 400
+        if not 1 <= limit <= Config.HISTORY_MAX_PAGE_SIZE:
+            return jsonify({
+                'success': False,
+                'error': f"'limit' must be between 1 and {Config.HISTORY_MAX_PAGE_SIZE}"
+            }), 400
+        
+        page = self.chatbot.get_history(session_id, before=before, limit=limit)
+        return jsonify({'session_id': session_id, **page}), 200
+    
+    def clear_history(self):
+        """Clear conversation history of the caller's session"""
+        session_id, _ = session_id_from_request(request)
+        count = self.chatbot.clear_history(session_id)
+        return jsonify({
+            'success': True,
+            'message': 'Conversation history cleared',
+            'session_id': session_id,
+            'remaining': count
+        }), 200
+    
+    def search(self):
+        """Direct search without conversation context"""
+        try:
+            data = request.json
+            query = data.get('query', '').strip()
+            k = data.get('k', self.default_k)
+            
+            if not query:
+                return jsonify({
+                    'success': False,
+                    'error': 'No query provided'
+                }), 400
+            try:
+                fields, include_sources = response_options(request, data)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            
+            # Retrieve documents
+            timings = self.chatbot.metrics.timings()
+            with self.admit('search', Config.SEARCH_DEADLINE, timings):
+                results = self.chatbot.retrieve_context(query, k=k,
+                                                        weights=Config.SEARCH_RETRIEVAL_WEIGHTS,
+                                                        timings=timings)
+            self.chatbot.metrics.record_request('search', 'search')
+            
+            body = {
+                'success': True,
+                'results': results,
+                'query': query,
+                'count': len(results)
+            }
+            stage_timings = timings.finish()
+            if timings_requested(request, Config.RESPONSE_TIMINGS):
+                body['timings'] = stage_timings
+            return self.respond(self.chatbot.sources.shape(body, 'results', fields, include_sources))
+        
+        except Overloaded as e:
+            return self.shed(e)
+        except Exception as e:
+            self.chatbot.metrics.record_request('search', 'search', error=e)
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    def search_batch(self):
+        """Search many queries at once: one embedding call, concurrent index queries
+        
+        Documents shared between results are returned once under 'documents' and
+        referenced by ID; every item carries its own success flag.
+        """
+        timings = self.chatbot.metrics.timings()
+        try:
+            data = request.json or {}
+            fields, include_sources = response_options(request, data)
+            items = parse_batch(data.get('queries'), 'queries', 'query',
+                                data.get('k', self.default_k), Config.BATCH_MAX_ITEMS)
+        except ValueError as e:    # BatchRequestError, or bad 'fields'
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        try:
+            valid = [item for item in items if item['error'] is None]
+            with self.admit('batch', Config.BATCH_DEADLINE, timings):
+                found = self.chatbot.retrieve_batch([(item['query'], item['k']) for item in valid],
+                                                    weights=Config.SEARCH_RETRIEVAL_WEIGHTS,
+                                                    timings=timings)
+            outcomes = {item['index']: outcome for item, outcome in zip(valid, found)}
+            
+            results = []
+            for item in items:
+                outcome = outcomes.get(item['index'], item['error'])
+                if isinstance(outcome, list):
+                    results.append({
+                        'index': item['index'],
+                        'query': item['query'],
+                        'success': True,
+                        'results': outcome,
+                        'count': len(outcome)
+                    })
+                else:
+                    results.append(item_error(item, outcome))
+            self.chatbot.metrics.record_request('search_batch', 'search')
+            
+            body = {
+                'success': True,
+                'results': results,
+                'documents': dedupe_sources(results, 'results'),
+                'count': len(results),
+                'failed': sum(1 for result in results if not result['success'])
+            }
+            stage_timings = timings.finish()
+            if timings_requested(request, Config.RESPONSE_TIMINGS):
+                body['timings'] = stage_timings
+            return self.respond(self.chatbot.sources.shape(body, None, fields, include_sources))
+        
+        except Overloaded as e:
+            return self.shed(e)
+        except Exception as e:
+            self.chatbot.metrics.record_request('search_batch', 'search', error=e)
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    def chat_batch(self):
+        """Answer many independent questions at once (no conversation history)
+        
+        Questions are embedded in one call and answered with at most
+        BATCH_CHAT_CONCURRENCY generations in flight; sources are de-duplicated
+        as in /api/search/batch.
+        """
+        timings = self.chatbot.metrics.timings()
+        try:
+            data = request.json or {}
+            fields, include_sources = response_options(request, data)
+            items = parse_batch(data.get('messages'), 'messages', 'message',
+                                data.get('k', self.default_k), Config.BATCH_MAX_ITEMS)
+        except ValueError as e:    # BatchRequestError, or bad 'fields'
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        try:
+            include_timings = timings_requested(request, Config.RESPONSE_TIMINGS)
+            valid = [item for item in items if item['error'] is None]
+            with self.admit('batch', Config.BATCH_DEADLINE, timings) as ticket:
+                answers = self.chatbot.generate_batch([(item['query'], item['k']) for item in valid],
+                                                      timings=timings, deadline=ticket.deadline)
+            outcomes = {item['index']: answer for item, answer in zip(valid, answers)}
+            
+            results = []
+            for item in items:
+                if item['index'] not in outcomes:
+                    results.append(item_error(item, item['error']))
+                    continue
+                answer = outcomes[item['index']]
+                result = {'index': item['index'],
+                          **{key: value for key, value in answer.items() if key != 'session_id'}}
+                if not include_timings:
+                    result.pop('timings', None)
+                results.append(result)
+            self.chatbot.metrics.record_request('chat_batch', 'batch')
+            
+            body = {
+                'success': True,
+                'results': results,
+                'documents': dedupe_sources(results, self.chatbot.RESULT_KEY),
+                'count': len(results),
+                'failed': sum(1 for result in results if not result['success'])
+            }
+            stage_timings = timings.finish()
+            if include_timings:
+                body['timings'] = stage_timings
+            return self.respond(self.chatbot.sources.shape(body, None, fields, include_sources))
+        
+        except Overloaded as e:
+            return self.shed(e)
+        except Exception as e:
+            self.chatbot.metrics.record_request('chat_batch', 'batch', error=e)
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    def stats(self):
+        """Exact aggregates over the statement tables; GET without a table lists them"""
+        try:
+            if request.method == 'GET' and not request.args.get('table'):
+                return jsonify({
+                    'success': True,
+                    'tables': self.chatbot.stats.catalog(),
+                    'errors': self.chatbot.stats.errors
+                }), 200
+            
+            result = self.chatbot.stats.query(stats_query_from_request(request))
+            return jsonify({'success': True, **result}), 200
+        
+        except (StatsQueryError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+    
+    def heatmap(self):
+        """State/district accident severity for the heat map; honours If-None-Match"""
+        try:
+            etag, body = self.chatbot.heatmap.response(**heatmap_query_from_request(request))
+        except HeatmapQueryError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        headers = {'ETag': etag, 'Cache-Control': f"public, max-age={Config.HEATMAP_MAX_AGE}"}
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            self.chatbot.heatmap.not_modified()
+            return Response(status=304, headers=headers)
+        return Response(body, content_type='application/json', headers=headers)
+    
+    def get_source(self, doc_id):
+        """One source document by ID, as referenced when include_sources=false (cacheable)"""
+        document = self.chatbot.sources.get(doc_id)
+        if document is None:
+            return jsonify({
+                'success': False,
+                'error': f"Unknown source '{doc_id}'"
+            }), 404
+        
+        headers = {'ETag': content_etag(document),
+                   'Cache-Control': f"public, max-age={Config.SOURCE_MAX_AGE}"}
+        if etag_matches(request.headers.get('If-None-Match'), headers['ETag']):
+            return Response(status=304, headers=headers)
+        return self.respond({'success': True, 'id': doc_id, **document}, 200, headers)
+    
+    def prometheus_metrics(self):
+        """Stage timings, request/error counters and cache hit rates (Prometheus text format)"""
+        return Response(self.chatbot.metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+    
+    def health(self):
+        """Health check endpoint: startup state, plus component stats once ready"""
+        if not self.startup.ready:
+            return jsonify({
+                'status': self.startup.state,
+                'service': 'DGMS RAG Chatbot',
+                'startup': self.startup.status()
+            }), 200
+        return jsonify({
+            'status': 'healthy',
+            'service': 'DGMS RAG Chatbot',
+            'version': '1.0.0',
+            'embedding_cache': self.chatbot.embeddings.stats(),
+            'retrieval_cache': self.chatbot.retrieval_cache.stats(),
+            'sessions': self.chatbot.sessions.stats(),
+            'stats_snapshot': self.chatbot.stats.snapshot,
+            'heatmap': self.chatbot.heatmap.stats(),
+            'response_encoding': self.encoder.stats(),
+            'sources': self.chatbot.sources.stats(),
+            'lexical_index': (self.chatbot.lexical_index.stats()
+                              if self.chatbot.lexical_index is not None else None),
+            'coalescing': self.chatbot.coalescer.stats(),
+            'history_compaction': self.chatbot.compactor.stats(),
+            'async_serving': {**self.asgi_app.stats(), 'upstream': self.chatbot.upstream.stats()},
+            'admission': self.chatbot.admission.stats(),
+            'circuit_breaker': self.chatbot.breaker.stats(),
+            'startup': self.startup.status()
+        }), 200
+    
+    def liveness(self):
+        """Liveness: the process is up and serving requests (even while starting)"""
+        return jsonify({'status': 'alive'}), 200
+    
+    def readiness(self):
+        """Readiness: 200 once the chatbot is built and warmed up, else 503 with Retry-After"""
+        status = self.startup.status()
+        if self.startup.ready:
+            return jsonify(status), 200
+        return jsonify(status), 503, {'Retry-After': str(self.startup.retry_after())}
+    
+    # Async serving mode (asgi_app): /api/chat and /api/search as coroutines
+    
+    async def aadmit(self, request: AsgiRequest, name: str, deadline_seconds: float,
+                     timings: RequestTimings) -> Ticket:
+        """admit() for the async routes: queues on the event loop"""
+        ticket = await self.chatbot.admission.aadmit(name, request_deadline(request, deadline_seconds))
+        if ticket.waited:
+            timings.add('queue_wait', ticket.waited)
+        return ticket
+    
+    async def chat_async(self, request: AsgiRequest) -> Tuple[int, Dict, Dict[str, str]]:
+        """POST /api/chat in async serving mode (same request and response as chat())"""
+        if not self.startup.ready:
+            body, headers = self.not_ready()
+            return 503, body, headers
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return 400, {'success': False, 'error': 'Request body must be a JSON object'}, {}
+        query = str(data.get('message', '')).strip()
+        k = data.get('k', self.default_k)
+        use_history = data.get('use_history', True)
+        session_id, _ = session_id_from_request(request)
+        
+        if not query:
+            return 400, {'success': False, 'error': 'No message provided'}, {}
+        try:
+            fields, include_sources = response_options(request, data)
+        except ValueError as e:
+            return 400, {'success': False, 'error': str(e)}, {}
+        
+        timings = self.chatbot.metrics.timings()
+        try:
+            ticket = await self.aadmit(request, 'chat', Config.CHAT_DEADLINE, timings)
+        except Overloaded as e:
+            body, headers = e.response()
+            return e.status, body, headers
+        with ticket:
+            result = await self.chatbot.agenerate_response(query, k=k, use_history=use_history,
+                                                           session_id=session_id, timings=timings,
+                                                           deadline=ticket.deadline)
+        if not timings_requested(request, Config.RESPONSE_TIMINGS):
+            result.pop('timings', None)
+        result = self.chatbot.sources.shape(result, self.chatbot.RESULT_KEY, fields, include_sources)
+        return 200 if result['success'] else 500, result, {SESSION_HEADER: session_id}
+    
+    async def search_async(self, request: AsgiRequest) -> Tuple[int, Dict, Dict[str, str]]:
+        """POST /api/search in async serving mode (same request and response as search())"""
+        if not self.startup.ready:
+            body, headers = self.not_ready()
+            return 503, body, headers
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return 400, {'success': False, 'error': 'Request body must be a JSON object'}, {}
+        query = str(data.get('query', '')).strip()
+        k = data.get('k', self.default_k)
+        
+        if not query:
+            return 400, {'success': False, 'error': 'No query provided'}, {}
+        try:
+            fields, include_sources = response_options(request, data)
+        except ValueError as e:
+            return 400, {'success': False, 'error': str(e)}, {}
+        
+        timings = self.chatbot.metrics.timings()
+        try:
+            ticket = await self.aadmit(request, 'search', Config.SEARCH_DEADLINE, timings)
+        except Overloaded as e:
+            body, headers = e.response()
+            return e.status, body, headers
+        try:
+            with ticket:
+                results = await self.chatbot.aretrieve_context(query, k=k,
+                                                               weights=Config.SEARCH_RETRIEVAL_WEIGHTS,
+                                                               timings=timings)
+        except asyncio.CancelledError:
+            self.chatbot.metrics.record_request('search', 'search', cancelled=True)
+            raise
+        except Exception as e:
+            self.chatbot.metrics.record_request('search', 'search', error=e)
+            return 500, {'success': False, 'error': str(e)}, {}
+        self.chatbot.metrics.record_request('search', 'search')
+        
+        body = {
+            'success': True,
+            'results': results,
+            'query': query,
+            'count': len(results)
+        }
+        stage_timings = timings.finish()
+        if timings_requested(request, Config.RESPONSE_TIMINGS):
+            body['timings'] = stage_timings
+        return 200, self.chatbot.sources.shape(body, 'results', fields, include_sources), {}
+    
+    def run(self):
+        """Serve with the Flask development server"""
+        print("\n" + "=" * 60)
+        print("DGMS RAG Chatbot Server")
+        print("=" * 60)
+        print(f"Server running on http://localhost:{Config.PORT}")
+        print(f"API endpoints:")
+        print(f"  POST /api/chat - Send message")
+        print(f"  POST /api/chat/stream - Send message (server-sent events)")
+        print(f"  GET  /api/chat/history - Get history")
+        print(f"  POST /api/chat/clear - Clear history")
+        print(f"  POST /api/search - Direct search")
+        print(f"  POST /api/search/batch - Search many queries")
+        print(f"  POST /api/chat/batch - Answer many questions")
+        print(f"  GET|POST /api/stats - Exact statistics over statement tables")
+        print(f"  GET  /api/heatmap - State/district severity for the heat map")
+        print(f"  GET  /api/sources/<id> - Source document sent by reference")
+        print(f"  GET  /api/metrics - Prometheus metrics")
+        print(f"  GET  /api/health - Health check")
+        print(f"  GET  /api/health/live - Liveness probe")
+        print(f"  GET  /api/health/ready - Readiness probe (503 until warmed up)")
+        print(f"Async serving mode: uvicorn {self.import_name}:asgi_app --port {Config.PORT}")
+        print("=" * 60 + "\n")
+        
+        self.app.run(debug=True, port=Config.PORT, host='0.0.0.0')
@@ -0,0 +1,191 @@
+# coalescing.py - Single-flight collapsing of identical concurrent requests
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+def history_fingerprint(history: Optional[List[Dict]], turns: int,
+                        summary: Optional[Dict] = None) -> str:
+    """Hash of the last `turns` turns and the rolling summary, i.e. what reaches the prompt"""
+    recent = history[-turns:] if history and turns > 0 else []
+    summary_text = summary.get('text') if summary else None
+    if not recent and not summary_text:
+        return ''
+    return hashlib.sha256(
+        json.dumps([summary_text, recent], sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()[:16]
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'done_at')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.done_at: Optional[float] = None
+
+
+class _AsyncCall:
+    __slots__ = ('task', 'waiters', 'done_at')
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.done_at: Optional[float] = None
+
+
+class SingleFlight:
+    """Run one computation per key at a time and share its result
+
+    Callers arriving while the leader is computing wait for it; callers
+    arriving within `grace_seconds` after it finished reuse its result.
+    Failures are shared with the waiters but never reused afterwards. A
+    waiter gives up after `wait_timeout` and computes on its own. Shared
+    results must be treated as read-only.
+
+    `ado` is the same for coroutines on one event loop (async serving mode),
+    with its own table of calls but the same settings and counters. The
+    computation runs as its own task, cancelled once every caller waiting
+    on it has been cancelled.
+    """
+
+    def __init__(self, grace_seconds: float = 2.0, wait_timeout: float = 60.0,
+                 max_entries: int = 4096, enabled: bool = True):
+        self.grace_seconds = grace_seconds
+        self.wait_timeout = wait_timeout
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.calls: Dict[Hashable, _Call] = {}
+        self.async_calls: Dict[Hashable, _AsyncCall] = {}
+        self.lock = threading.Lock()
+        self.counters = {'leaders': 0, 'collapsed': 0, 'grace_hits': 0, 'timeouts': 0, 'errors': 0}
+
+    def _expired(self, call: _Call, now: float) -> bool:
+        return call.done_at is not None and now - call.done_at > self.grace_seconds
+
+    def _prune(self, now: float):
+        if len(self.calls) <= self.max_entries:
+            return
+        for key in [key for key, call in self.calls.items() if self._expired(call, now)]:
+            del self.calls[key]
+
+    def do(self, key: Hashable, compute: Callable) -> Tuple[object, bool]:
+        """(result, shared): `shared` is True when another caller's computation was reused"""
+        if not self.enabled:
+            return compute(), False
+
+        now = time.monotonic()
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None and self._expired(call, now):
+                del self.calls[key]
+                call = None
+            if call is None:
+                call = self.calls[key] = _Call()
+                self.counters['leaders'] += 1
+                self._prune(now)
+                leader = True
+            elif call.done_at is not None:
+                self.counters['grace_hits'] += 1
+                return call.result, True
+            else:
+                leader = False
+
+        if leader:
+            try:
+                call.result = compute()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self.lock:
+                    call.done_at = time.monotonic()
+                    if (call.error is not None or self.grace_seconds <= 0) and self.calls.get(key) is call:
+                        del self.calls[key]
+                    if call.error is not None:
+                        self.counters['errors'] += 1
+                call.event.set()
+            return call.result, False
+
+        if not call.event.wait(self.wait_timeout):
+            with self.lock:
+                self.counters['timeouts'] += 1
+            return compute(), False
+        if call.error is not None:
+            raise call.error
+        with self.lock:
+            self.counters['collapsed'] += 1
+        return call.result, True
+
+    async def ado(self, key: Hashable, compute: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """do() for a coroutine function; only call it from one event loop"""
+        if not self.enabled:
+            return await compute(), False
+
+        now = time.monotonic()
+        call = self.async_calls.get(key)
+        if call is not None and call.done_at is not None and now - call.done_at > self.grace_seconds:
+            del self.async_calls[key]
+            call = None
+        if call is None:
+            call = self.async_calls[key] = _AsyncCall(asyncio.ensure_future(compute()))
+            call.task.add_done_callback(lambda task: self._async_done(key, call))
+            with self.lock:
+                self.counters['leaders'] += 1
+            if len(self.async_calls) > self.max_entries:
+                for stale in [stale for stale, other in self.async_calls.items()
+                              if other.done_at is not None and now - other.done_at > self.grace_seconds]:
+                    del self.async_calls[stale]
+            leader = True
+        elif call.done_at is not None:
+            with self.lock:
+                self.counters['grace_hits'] += 1
+            return call.task.result(), True
+        else:
+            leader = False
+
+        call.waiters += 1
+        try:
+            if leader:
+                return await asyncio.shield(call.task), False
+            try:
+                result = await asyncio.wait_for(asyncio.shield(call.task), self.wait_timeout)
+            except asyncio.TimeoutError:
+                with self.lock:
+                    self.counters['timeouts'] += 1
+                return await compute(), False
+            with self.lock:
+                self.counters['collapsed'] += 1
+            return result, True
+        except asyncio.CancelledError:
+            # The last interested caller went away: stop the upstream work too
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _async_done(self, key: Hashable, call: _AsyncCall):
+        call.done_at = time.monotonic()
+        failed = call.task.cancelled() or call.task.exception() is not None
+        if (failed or self.grace_seconds <= 0) and self.async_calls.get(key) is call:
+            del self.async_calls[key]
+        if failed and not call.task.cancelled():
+            with self.lock:
+                self.counters['errors'] += 1
+
+    def stats(self) -> Dict:
+        with self.lock:
+            counters = dict(self.counters)
+            in_flight = sum(1 for call in self.calls.values() if call.done_at is None)
+        in_flight += sum(1 for call in list(self.async_calls.values()) if call.done_at is None)
+        return {
+            **counters,
+            'shared': counters['collapsed'] + counters['grace_hits'],
+            'in_flight': in_flight,
+            'enabled': self.enabled,
+        }
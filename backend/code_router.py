@@ -0,0 +1,243 @@
+# code_router.py - Deterministic answers for DGMS code lookups (no embedding, search or LLM)
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+CODE_SOURCE = "Statement4.0.json"
+
+CODE_WORDS = re.compile(r'\bcodes?\b')
+CODE_TOKEN = re.compile(r'(?<![\d.])(\d{3,4})(?![\d.])')
+LIST_WORDS = re.compile(r'\b(list|all|show|which|what|every|give|under|in)\b')
+REVERSE_PHRASE = re.compile(r'\bcodes?\s+(?:for|of|is used for|used for|meaning)\s+(.+)$')
+# Questions about the accidents themselves (counts, casualties, years), not the codes
+RECORD_WORDS = re.compile(r'\b(how many|number of|count|killed|deaths?|died|fatal\w*|injur\w*|'
+                          r'(?:19|20)\d{2})\b')
+WORD = re.compile(r'[a-z0-9]+')
+
+STOPWORDS = {
+    'a', 'an', 'the', 'of', 'for', 'to', 'in', 'on', 'by', 'and', 'or', 'is', 'are',
+    'what', 'which', 'whats', 'code', 'codes', 'dgms', 'accident', 'accidents', 'list',
+    'all', 'show', 'me', 'give', 'tell', 'about', 'please', 'used', 'etc', 'due',
+    'other', 'than', 'category', 'categories', 'under', 'does', 'mean', 'meaning',
+    'cover', 'covers', 'explain', 'describe', 'number', 'numbers', 'classification',
+}
+# Words a question that only asks what a code means may contain besides the code
+LOOKUP_WORDS = {
+    'a', 'an', 'the', 'of', 'for', 'is', 'are', 'what', 'whats', 'which', 'does', 'do',
+    'code', 'codes', 'dgms', 'mean', 'means', 'meaning', 'stand', 'stands', 'explain',
+    'describe', 'define', 'definition', 'tell', 'me', 'about', 'please', 'show', 'give',
+    'number', 'classification', 'category', 'and', 'list', 's',
+}
+
+
+def _terms(text: str) -> List[str]:
+    """Lowercased content words with a plural 's' stripped"""
+    terms = []
+    for word in WORD.findall(text.lower()):
+        if word in STOPWORDS or word.isdigit():
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+# ==========================================
+# PREFIX TREE
+# ==========================================
+
+class PrefixTree:
+    """Trie over token sequences; each node collects the entries stored beneath it"""
+
+    def __init__(self):
+        self.root: Dict = {}
+
+    def insert(self, tokens, value):
+        node = self.root
+        for token in tokens:
+            node = node.setdefault(token, {})
+            node.setdefault('$values', []).append(value)
+        node['$end'] = True
+
+    def prefix(self, tokens) -> List:
+        """Entries under the node reached by `tokens` (empty if there is none)"""
+        node = self.root
+        for token in tokens:
+            node = node.get(token)
+            if node is None:
+                return []
+        return node.get('$values', [])
+
+    def longest_match(self, tokens: List[str], start: int) -> Tuple[int, Optional[object]]:
+        """(length, values) of the longest complete key starting at tokens[start]"""
+        node, best = self.root, (0, None)
+        for position in range(start, len(tokens)):
+            node = node.get(tokens[position])
+            if node is None:
+                break
+            if node.get('$end'):
+                best = (position - start + 1, node['$values'])
+        return best
+
+# ==========================================
+# ROUTER
+# ==========================================
+
+class CodeLookupRouter:
+    """Answers "what is code 0222", "list ground movement codes" and "code for fall of roof"
+
+    Backed by an exact code -> entry map, a digit trie for code prefixes
+    ("01" = ground movement), a word trie over category names and an
+    inverted index from description words to codes. Anything else returns
+    None and falls through to retrieval + generation.
+    """
+
+    def __init__(self, entries: List[Dict]):
+        self.entries = entries
+        self.by_code: Dict[str, Dict] = {}
+        self.code_tree = PrefixTree()
+        self.category_tree = PrefixTree()
+        self.word_index: Dict[str, set] = {}
+        for entry in entries:
+            self.by_code[entry['code']] = entry
+            self.code_tree.insert(entry['code'], entry)
+            for name in {entry['category'], *entry['category'].split(' / ')}:
+                self.category_tree.insert(_terms(name), entry)
+            for term in set(_terms(entry['description'])):
+                self.word_index.setdefault(term, set()).add(entry['code'])
+
+    @classmethod
+    def from_stats(cls, engine) -> 'CodeLookupRouter':
+        """Build from the stats engine's `codes` table (statement 4.0)"""
+        table = engine.tables.get('codes')
+        if table is None:
+            return cls([])
+        columns = ('section', 'category', 'code', 'description')
+        return cls([
+            {column: table.value(column, row) for column in columns}
+            for row in range(table.num_rows)
+        ])
+
+    # ---------- lookups ----------
+
+    def lookup_codes(self, query: str) -> List[Dict]:
+        """Exact codes mentioned in the query; "0100"-style headings expand to their prefix"""
+        found = []
+        mentions_code = bool(CODE_WORDS.search(query))
+        for token in CODE_TOKEN.findall(query):
+            # Bare numbers only count as codes when they look like one ("0111")
+            if not (mentions_code or (len(token) == 4 and token.startswith('0'))):
+                continue
+            if token in self.by_code:
+                found.append(self.by_code[token])
+            elif token.endswith('0'):
+                found.extend(self.code_tree.prefix(token.rstrip('0')))
+        return found
+
+    def lookup_category(self, query: str) -> List[Dict]:
+        """Entries of the longest category name mentioned in the query"""
+        tokens = _terms(query)
+        best_length, best = 0, None
+        for start in range(len(tokens)):
+            length, values = self.category_tree.longest_match(tokens, start)
+            if length > best_length:
+                best_length, best = length, values
+        return list(best or [])
+
+    def lookup_description(self, phrase: str) -> List[Dict]:
+        """Codes whose description contains every content word of `phrase`"""
+        terms = _terms(phrase)
+        if not terms:
+            return []
+        codes = None
+        for term in terms:
+            matches = self.word_index.get(term, set())
+            codes = matches if codes is None else codes & matches
+            if not codes:
+                return []
+        entries = [self.by_code[code] for code in codes]
+        wanted = ' '.join(terms)
+        # Exact descriptions first, then the most specific (shortest) ones
+        entries.sort(key=lambda e: (' '.join(_terms(e['description'])) != wanted,
+                                    len(e['description']), e['code']))
+        return entries
+
+    # ---------- routing ----------
+
+    @staticmethod
+    def _lookup_only(q: str, kind: str) -> bool:
+        """True if `q` asks for the codes themselves rather than accidents under them
+
+        "what is code 0222" is answered from the table; "list accidents due to
+        0112" or "fatal accidents under code 0111 in 2015" still need retrieval.
+        """
+        if RECORD_WORDS.search(q):
+            return False
+        if kind != 'code':
+            return True
+        words = [word for word in WORD.findall(q) if not word.isdigit()]
+        return all(word in LOOKUP_WORDS for word in words)
+
+    def route(self, query: str) -> Optional[Dict]:
+        """Code/category entries the query names, or None to fall through
+
+        'direct' is True when the entries answer the query on their own;
+        otherwise they are context for retrieval + generation.
+        """
+        if not self.entries:
+            return None
+        started = time.perf_counter()
+        q = ' '.join(query.lower().split()).rstrip('?.! ')
+
+        kind, matches = None, self.lookup_codes(q)
+        if matches:
+            kind = 'code'
+        elif CODE_WORDS.search(q):
+            phrase = REVERSE_PHRASE.search(q)
+            text = phrase.group(1) if phrase else q
+            matches = self.lookup_description(text)
+            kind = 'description'
+            if not matches and (phrase or LIST_WORDS.search(q)):
+                matches = self.lookup_category(text)
+                kind = 'category'
+        if not matches:
+            return None
+
+        matches = list({entry['code']: entry for entry in matches}.values())
+        return {
+            'kind': kind,
+            'direct': self._lookup_only(q, kind),
+            'answer': format_entries(matches),
+            'matches': matches,
+            'sources': [
+                {
+                    'content': entry,
+                    'source': CODE_SOURCE,
+                    'metadata': {
+                        'source_file': CODE_SOURCE,
+                        'section': entry['section'],
+                        'category': entry['category'],
+                        'code': entry['code'],
+                    },
+                }
+                for entry in matches
+            ],
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+        }
+
+
+def format_entries(entries: List[Dict]) -> str:
+    """Markdown answer listing codes with their descriptions, grouped by category"""
+    if len(entries) == 1:
+        e = entries[0]
+        return (f"DGMS code **{e['code']}** – {e['description']} "
+                f"({e['section']} › {e['category']})\n\nSource: {CODE_SOURCE}")
+    groups: Dict[Tuple[str, str], List[Dict]] = {}
+    for entry in entries:
+        groups.setdefault((entry['section'], entry['category']), []).append(entry)
+    lines = []
+    for (section, category), members in groups.items():
+        if lines:
+            lines.append("")
+        lines.append(f"**{category}** ({section}):")
+        lines += [f"- **{e['code']}** – {e['description']}" for e in members]
+    return "\n".join(lines) + f"\n\nSource: {CODE_SOURCE}"
@@ -0,0 +1,309 @@
+# embedding_cache.py - Two-tier (memory LRU + SQLite) embedding cache
+import asyncio
+import hashlib
+import inspect
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:  # the wrapper only needs the duck-typed interface
+    Embeddings = object
+
+# Task type GoogleGenerativeAIEmbeddings.embed_query uses
+QUERY_TASK_TYPE = "RETRIEVAL_QUERY"
+
+# ==========================================
+# KEYS
+# ==========================================
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize and collapse whitespace so trivial variants share a key"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def cache_key(model: str, kind: str, text: str) -> str:
+    """Key on model, task kind (query vs document embed differently) and text hash"""
+    digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+    return f"{model}|{kind}|{digest}"
+
+# ==========================================
+# STORAGE TIERS
+# ==========================================
+
+class MemoryLRU:
+    """Bounded in-process LRU of key -> vector
+
+    Vectors are held as float32 arrays (4 bytes a component rather than a
+    boxed Python float each), the same precision the disk tier keeps.
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[array]:
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+            return vector
+
+    def put(self, key: str, vector):
+        if not isinstance(vector, array) or vector.typecode != 'f':
+            vector = array('f', vector)
+        with self.lock:
+            self.entries[key] = vector
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteEmbeddingStore:
+    """On-disk tier: float32 blobs in SQLite, shareable across processes
+
+    Reads do not write: last-used times of hits are buffered and written in
+    one transaction every `touch_batch` hits or `touch_interval` seconds
+    (and before any write or eviction), so eviction order is only that stale.
+    """
+
+    def __init__(self, path: str, max_entries: int = 200000,
+                 touch_batch: int = 256, touch_interval: float = 30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self.lock = threading.Lock()
+        self.writes_since_evict = 0
+        self.touched: Dict[str, float] = {}
+        self.touched_since = time.monotonic()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self.conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, array]:
+        if not keys:
+            return {}
+        found = {}
+        with self.lock:
+            rows = []
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows.extend(self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall())
+            for key, blob in rows:
+                vector = array('f')
+                vector.frombytes(blob)
+                found[key] = vector
+            if found:
+                now = time.time()
+                self.touched.update((key, now) for key in found)
+                if (len(self.touched) >= self.touch_batch
+                        or time.monotonic() - self.touched_since >= self.touch_interval):
+                    self._write_touches()
+                    self.conn.commit()
+        return found
+
+    def _write_touches(self):
+        """Write the buffered last-used times (caller holds the lock and commits)"""
+        if self.touched:
+            self.conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self.touched.items()]
+            )
+            self.touched = {}
+        self.touched_since = time.monotonic()
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        with self.lock:
+            self._write_touches()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array('f', vector).tobytes(), now) for key, vector in items.items()]
+            )
+            self.writes_since_evict += len(items)
+            # Counting rows is not free, so only check the bound periodically
+            if self.writes_since_evict >= max(1, self.max_entries // 100):
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        self.writes_since_evict = 0
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)", (excess,)
+            )
+
+    def flush(self):
+        """Write any buffered last-used times now"""
+        with self.lock:
+            if self.touched:
+                self._write_touches()
+                self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+# ==========================================
+# CACHE
+# ==========================================
+
+class EmbeddingCache:
+    """Memory LRU in front of an optional disk tier, with hit/miss counters"""
+
+    def __init__(self, memory_entries: int = 2048, disk_path: Optional[str] = None,
+                 disk_entries: int = 200000):
+        self.memory = MemoryLRU(memory_entries)
+        self.disk = SQLiteEmbeddingStore(disk_path, disk_entries) if disk_path else None
+        self.lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Cached vectors of `keys` (as lists, like an embeddings client returns)"""
+        found = {}
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is not None:
+                found[key] = vector
+        memory_hits = len(found)
+
+        missing = [key for key in keys if key not in found]
+        disk_found = self.disk.get_many(missing) if self.disk is not None and missing else {}
+        for key, vector in disk_found.items():
+            self.memory.put(key, vector)
+            found[key] = vector
+
+        with self.lock:
+            self.counters['memory_hits'] += memory_hits
+            self.counters['disk_hits'] += len(disk_found)
+            self.counters['misses'] += len(keys) - len(found)
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    def put_many(self, items: Dict[str, List[float]]):
+        for key, vector in items.items():
+            self.memory.put(key, vector)
+        if self.disk is not None:
+            self.disk.put_many(items)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            counters = dict(self.counters)
+        lookups = sum(counters.values())
+        hits = counters['memory_hits'] + counters['disk_hits']
+        return {
+            **counters,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'memory_entries': len(self.memory),
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Drop-in wrapper for an embeddings client that consults the cache first
+
+    Anything that takes a LangChain embeddings object (PineconeVectorStore,
+    PineconeUploader, the ingestion pipeline) can be handed this instead.
+    """
+
+    def __init__(self, embeddings, cache: EmbeddingCache, model: Optional[str] = None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model or getattr(embeddings, 'model', type(embeddings).__name__)
+
+    def _embed(self, texts: List[str], kind: str, compute) -> List[List[float]]:
+        keys = [cache_key(self.model, kind, text) for text in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        # Embed each distinct missing text once, in a single upstream call
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = compute(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, 'document', self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], 'query', lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """embed_query without blocking the event loop
+
+        The upstream's own aembed_query is awaited when it has one; otherwise
+        the blocking call runs on the loop's default executor. The disk tier
+        is read and written there too.
+        """
+        key = cache_key(self.model, 'query', text)
+        if self.cache.disk is None:
+            found = self.cache.get_many([key])
+        else:
+            found = await asyncio.to_thread(self.cache.get_many, [key])
+        if key in found:
+            return found[key]
+
+        upstream = getattr(self.embeddings, 'aembed_query', None)
+        if upstream is not None:
+            vector = await upstream(text)
+        else:
+            vector = await asyncio.to_thread(self.embeddings.embed_query, text)
+        if self.cache.disk is None:
+            self.cache.put_many({key: vector})
+        else:
+            await asyncio.to_thread(self.cache.put_many, {key: vector})
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Query embeddings for many texts; the misses go upstream in one embed_documents call"""
+        return self._embed(texts, 'query', self._embed_queries_upstream)
+
+    def _embed_queries_upstream(self, texts: List[str]) -> List[List[float]]:
+        # Gemini embeds queries and documents with different task types, so a
+        # batch of queries is only equivalent to embed_query with the query one
+        if 'task_type' in inspect.signature(self.embeddings.embed_documents).parameters:
+            return self.embeddings.embed_documents(texts, task_type=QUERY_TASK_TYPE)
+        return [self.embeddings.embed_query(text) for text in texts]
+
+    def stats(self) -> Dict:
+        return self.cache.stats()
+
+
+def build_cached_embeddings(embeddings, model: str, disk_path: Optional[str],
+                            memory_entries: int = 2048, disk_entries: int = 200000) -> CachedEmbeddings:
+    """Wrap `embeddings` with a cache whose disk tier lives at `disk_path`"""
+    if disk_path:
+        directory = os.path.dirname(os.path.abspath(disk_path))
+        os.makedirs(directory, exist_ok=True)
+    cache = EmbeddingCache(memory_entries, disk_path, disk_entries)
+    return CachedEmbeddings(embeddings, cache, model=model)
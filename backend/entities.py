@@ -0,0 +1,207 @@
+# entities.py - Canonical entity metadata for chunks and a gazetteer-backed query extractor
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+# Canonical metadata fields written at ingest and filtered on at query time.
+# Each is a list of strings (Pinecone's multi-value type); names are upper-case.
+ENTITY_FIELDS = ('mineral', 'state', 'district', 'year', 'statement', 'severity')
+
+MINERAL_KEYS = ('mineral', 'mineral_name', 'mineral_or_cause')
+STATE_KEYS = ('state', 'state_name')
+DISTRICT_KEYS = ('district', 'district_name')
+DATE_KEYS = ('date', 'accident_date', 'date_of_accident')
+TITLE_KEYS = ('title', 'report_title', 'description')
+
+YEAR_VALUE = re.compile(r'^(?:19|20)\d{2}$')
+YEAR_COLUMN = re.compile(r'^year_((?:19|20)\d{2})$')
+DATE_VALUE = re.compile(r'(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})')
+FATAL_KEY = re.compile(r'fatal|killed|death')
+SERIOUS_KEY = re.compile(r'serious|injur')
+
+# Aggregate labels that are not entities
+NON_ENTITIES = {'TOTAL', 'ALL', 'GRAND TOTAL', 'OTHERS', 'NONE', 'NULL', 'NA', 'N/A'}
+
+
+def canonical(value) -> Optional[str]:
+    """Upper-case, whitespace-collapsed form shared by metadata and query filters"""
+    if value is None or isinstance(value, bool):
+        return None
+    text = ' '.join(str(value).split()).upper()
+    return text if text and text not in NON_ENTITIES else None
+
+
+def _date_year(value) -> Optional[str]:
+    """Four-digit year of a dd/mm/yy date"""
+    match = DATE_VALUE.search(value) if isinstance(value, str) else None
+    if not match:
+        return None
+    year = int(match.group(3))
+    if year < 100:
+        year += 2000 if year <= 30 else 1900
+    return str(year)
+
+# ==========================================
+# INGEST: CHUNK METADATA
+# ==========================================
+
+def _walk(value, section: str, found: Dict[str, Set[str]]):
+    if isinstance(value, list):
+        for item in value:
+            _walk(item, section, found)
+        return
+    if not isinstance(value, dict):
+        return
+    for key, item in value.items():
+        if isinstance(item, (dict, list)):
+            _walk(item, section, found)
+            if FATAL_KEY.search(key):
+                found['severity'].add('fatal')
+            if SERIOUS_KEY.search(key):
+                found['severity'].add('serious')
+            continue
+
+        field = None
+        if key in MINERAL_KEYS or (key == 'name' and 'mineral' in section):
+            field = 'mineral'
+        elif key in STATE_KEYS:
+            field = 'state'
+        elif key in DISTRICT_KEYS:
+            field = 'district'
+        if field is not None:
+            entity = canonical(item)
+            if entity:
+                found[field].add(entity)
+            continue
+
+        year_column = YEAR_COLUMN.match(key)
+        if year_column:
+            found['year'].add(year_column.group(1))
+        elif key == 'year' and YEAR_VALUE.match(str(item).strip()):
+            found['year'].add(str(item).strip())
+        elif key in DATE_KEYS:
+            year = _date_year(item)
+            if year:
+                found['year'].add(year)
+
+        if FATAL_KEY.search(key):
+            found['severity'].add('fatal')
+        if SERIOUS_KEY.search(key):
+            found['severity'].add('serious')
+
+
+def entity_metadata(rows: List[Dict], context: Dict, section: str = '') -> Dict[str, List[str]]:
+    """Canonical mineral/state/district/year/severity of a row group (the chunker sets 'statement')
+
+    Severity comes from the measures the rows report (fatal_accidents,
+    persons_killed, serious_injury_rate, ...). A file title that names only
+    one kind ("Fatal accidents in ...") narrows it to that kind.
+    """
+    found: Dict[str, Set[str]] = {field: set() for field in ENTITY_FIELDS}
+    _walk(rows, section.lower(), found)
+    _walk({key: value for key, value in context.items() if key == 'year'}, '', found)
+
+    title = ' '.join(str(context[key]) for key in TITLE_KEYS if key in context).lower()
+    fatal_title, serious_title = bool(FATAL_KEY.search(title)), bool(SERIOUS_KEY.search(title))
+    if fatal_title != serious_title:
+        found['severity'] = {'fatal' if fatal_title else 'serious'}
+
+    return {field: sorted(values) for field, values in found.items() if values}
+
+# ==========================================
+# QUERY: GAZETTEER EXTRACTOR
+# ==========================================
+
+TOKEN = re.compile(r'[a-z0-9]+(?:\.[0-9]+[a-z]?)?')
+YEAR_MENTION = re.compile(r'\b((?:19|20)\d{2})\b')
+STATEMENT_MENTION = re.compile(r'\bstatement\s*(?:no\.?\s*)?(\d+\.\d+[a-z]?)\b', re.IGNORECASE)
+FATAL_MENTION = re.compile(r'\b(fatal\w*|killed|deaths?|died|dead)\b')
+SERIOUS_MENTION = re.compile(r'\b(serious\w*|injur\w*)\b')
+
+# A state and a district can share a name; the broader reading wins
+FIELD_PRIORITY = ('state', 'mineral', 'district')
+# Words that do not tell one mine name from a mineral or place mention
+GENERIC_TOKENS = {'mine', 'mines', 'quarry', 'colliery', 'project', 'opencast', 'open', 'cast',
+                  'underground', 'ore', 'ltd', 'co', 'no', 'of', 'the', 'and', 'mining'}
+
+
+def _tokens(text: str) -> tuple:
+    return tuple(TOKEN.findall(text.lower()))
+
+
+class EntityExtractor:
+    """Pull minerals, states, districts, years, statements and severity out of a question
+
+    Names come from a gazetteer (the distinct values in the statement
+    tables) matched as whole token sequences, longest first, in one pass
+    over the question. `filters()` turns the entities into a Pinecone-style
+    metadata filter on the fields `entity_metadata` writes at ingest.
+    Mine names (and their distinctive leading words) are matched too, so
+    "Champion Reef Gold" is a mine, not a gold filter; they add no filter.
+    """
+
+    def __init__(self, gazetteer: Dict[str, Iterable[str]], min_length: int = 3):
+        self.phrases: Dict[tuple, tuple] = {}
+        entity_tokens = {token for field in FIELD_PRIORITY
+                         for name in gazetteer.get(field, ()) for token in _tokens(name)}
+        # Mines first, so a mine prefix spelled like a mineral or place loses to it
+        for name in gazetteer.get('mine', ()):
+            value, tokens = canonical(name), _tokens(name)
+            for end in range(2, len(tokens) + 1):
+                prefix = tokens[:end]
+                if value and any(token not in entity_tokens and token not in GENERIC_TOKENS
+                                 and not token.isdigit() for token in prefix):
+                    self.phrases.setdefault(prefix, ('mine', value))
+        for field in reversed(FIELD_PRIORITY):
+            for name in gazetteer.get(field, ()):
+                value = canonical(name)
+                tokens = _tokens(name)
+                if value and tokens and len(' '.join(tokens)) >= min_length:
+                    self.phrases[tokens] = (field, value)
+        self.max_length = max((len(tokens) for tokens in self.phrases), default=0)
+
+    @classmethod
+    def from_stats(cls, engine) -> 'EntityExtractor':
+        """Gazetteer from the stats engine's mineral/state/district/mine name columns"""
+        gazetteer = {field: engine.vocabulary(field) for field in FIELD_PRIORITY}
+        gazetteer['mine'] = engine.vocabulary('mine_name')
+        return cls(gazetteer)
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def extract(self, query: str) -> Dict[str, List[str]]:
+        """{field: [canonical values]} for every entity mentioned in `query`"""
+        found: Dict[str, List[str]] = {}
+
+        def add(field, value):
+            values = found.setdefault(field, [])
+            if value not in values:
+                values.append(value)
+
+        tokens = _tokens(query)
+        position = 0
+        while position < len(tokens):
+            for length in range(min(self.max_length, len(tokens) - position), 0, -1):
+                match = self.phrases.get(tokens[position:position + length])
+                if match is not None:
+                    add(*match)
+                    position += length
+                    break
+            else:
+                position += 1
+
+        text = query.lower()
+        for year in YEAR_MENTION.findall(text):
+            add('year', year)
+        for statement in STATEMENT_MENTION.findall(text):
+            add('statement', statement.lower())
+        fatal, serious = bool(FATAL_MENTION.search(text)), bool(SERIOUS_MENTION.search(text))
+        if fatal != serious:
+            add('severity', 'fatal' if fatal else 'serious')
+        return found
+
+    def filters(self, query: str, fields: Iterable[str] = ENTITY_FIELDS) -> Optional[Dict]:
+        """Metadata filter for the entities in `query` (None when it names none)"""
+        entities = self.extract(query)
+        conditions = {field: {'$in': entities[field]} for field in fields if field in entities}
+        return conditions or None
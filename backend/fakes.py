@@ -0,0 +1,270 @@
+# fakes.py - Deterministic local stand-ins for Gemini (embeddings, generation) and Pinecone
+import asyncio
+import hashlib
+import math
+import random
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from local_vectorstore import matches_filter
+
+
+class FakeRateLimitError(Exception):
+    """Mimics the 429 / ResourceExhausted error raised by the Gemini API"""
+
+
+def _hash_vector(text: str, dimension: int) -> List[float]:
+    """Unit vector derived from the SHA-256 stream of the text"""
+    values = []
+    counter = 0
+    while len(values) < dimension:
+        block = hashlib.sha256(f"{counter}:{text}".encode('utf-8')).digest()
+        values.extend((b - 127.5) / 127.5 for b in block)
+        counter += 1
+    values = values[:dimension]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+class FakeEmbeddings:
+    """Offline replacement for GoogleGenerativeAIEmbeddings
+
+    Vectors are a pure function of the text, so runs are reproducible.
+    `latency` is added per call and `failure_rate` raises rate-limit
+    errors at random (seeded) to exercise retry paths.
+    """
+
+    def __init__(self, dimension: int = 768, latency: float = 0.0,
+                 failure_rate: float = 0.0, seed: int = 0,
+                 model: str = "fake/embedding-001"):
+        self.dimension = dimension
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.model = model
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def _maybe_fail(self):
+        with self._lock:
+            self.calls += 1
+            fail = self.failure_rate and self._random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+
+    def embed_documents(self, texts: List[str], task_type: Optional[str] = None) -> List[List[float]]:
+        self._maybe_fail()
+        with self._lock:
+            self.texts_embedded += len(texts)
+        return [_hash_vector(text, self.dimension) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class FakeIndex:
+    """In-memory stand-in for a Pinecone index (upsert/delete/fetch/stats)"""
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.vectors: Dict[str, Dict] = {}
+        self.upsert_calls = 0
+        self.query_calls = 0
+        self._matrix = None     # (ids, normalized matrix), rebuilt after writes
+
+    def _maybe_fail(self):
+        with self._lock:
+            fail = self.failure_rate and self._random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise FakeRateLimitError("429 Too Many Requests")
+
+    def upsert(self, vectors: List[Dict], namespace: Optional[str] = None):
+        self._maybe_fail()
+        with self._lock:
+            self.upsert_calls += 1
+            for vector in vectors:
+                self.vectors[vector['id']] = vector
+            self._matrix = None
+        return {'upserted_count': len(vectors)}
+
+    def delete(self, ids: List[str], namespace: Optional[str] = None):
+        self._maybe_fail()
+        with self._lock:
+            for vector_id in ids:
+                self.vectors.pop(vector_id, None)
+            self._matrix = None
+        return {}
+
+    def _snapshot(self) -> Tuple[List[str], np.ndarray]:
+        with self._lock:
+            if self._matrix is None:
+                ids = sorted(self.vectors)
+                matrix = np.asarray([self.vectors[i]['values'] for i in ids], dtype=np.float32)
+                if ids:
+                    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                    matrix /= np.where(norms == 0, 1.0, norms)
+                self._matrix = (ids, matrix)
+            return self._matrix
+
+    def query(self, vector: List[float], top_k: int = 10, filter: Optional[Dict] = None,
+              include_metadata: bool = True, namespace: Optional[str] = None) -> Dict:
+        """Cosine top-k, shaped like Pinecone's query response"""
+        self._maybe_fail()
+        with self._lock:
+            self.query_calls += 1
+        ids, matrix = self._snapshot()
+        if not ids:
+            return {'matches': []}
+        query = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ (query / (np.linalg.norm(query) or 1.0))
+        order = [int(i) for i in np.argsort(-scores, kind='stable')]
+        matches = []
+        for row in order:
+            metadata = self.vectors[ids[row]].get('metadata') or {}
+            if filter and not matches_filter(metadata, filter):
+                continue
+            matches.append({
+                'id': ids[row],
+                'score': float(scores[row]),
+                'metadata': dict(metadata) if include_metadata else None,
+            })
+            if len(matches) >= top_k:
+                break
+        return {'matches': matches}
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None) -> Dict:
+        with self._lock:
+            return {'vectors': {i: self.vectors[i] for i in ids if i in self.vectors}}
+
+    def describe_index_stats(self) -> Dict:
+        with self._lock:
+            return {'total_vector_count': len(self.vectors)}
+
+
+class FakeVectorStore:
+    """`similarity_search` contract over a FakeIndex, like PineconeVectorStore over an index"""
+
+    def __init__(self, index: FakeIndex, embedding, text_key: str = 'text'):
+        self.index = index
+        self.embeddings = embedding
+        self.text_key = text_key
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        results = []
+        for match in self.index.query(embedding, top_k=k, filter=filter)['matches']:
+            metadata = dict(match['metadata'])
+            text = metadata.pop(self.text_key, '')
+            results.append((Document(page_content=text, metadata=metadata), match['score']))
+        return results
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict] = None, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search(self, query: str, k: int = 4,
+                          filter: Optional[Dict] = None, **kwargs) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k, filter)
+
+_ANSWER_WORDS = (
+    "the accident data shows that in mines fatal serious injuries were reported under "
+    "code category for coal metal states districts during year according to DGMS "
+    "statement records causes ground movement transportation machinery explosives"
+).split()
+
+
+class _FakeUsage:
+    def __init__(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = completion_tokens
+        self.total_token_count = prompt_tokens + completion_tokens
+
+
+class _FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeResponse:
+    """Mimics a generate_content response, streamed or not"""
+
+    def __init__(self, words: List[str], prompt_tokens: int, token_latency: float,
+                 words_per_chunk: int = 4):
+        self.words = words
+        self.token_latency = token_latency
+        self.words_per_chunk = words_per_chunk
+        self.usage_metadata = _FakeUsage(prompt_tokens, len(words))
+        self.cancelled = False
+
+    @property
+    def text(self) -> str:
+        return ' '.join(self.words)
+
+    def __iter__(self) -> Iterator[_FakeChunk]:
+        for start in range(0, len(self.words), self.words_per_chunk):
+            if self.cancelled:
+                return
+            if self.token_latency:
+                time.sleep(self.token_latency * self.words_per_chunk)
+            prefix = '' if start == 0 else ' '
+            yield _FakeChunk(prefix + ' '.join(self.words[start:start + self.words_per_chunk]))
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeGenerativeModel:
+    """Offline replacement for genai.GenerativeModel
+
+    The answer is a pure function of the prompt. `latency` is the time to
+    the first token; a non-streamed call also waits `token_latency` per
+    answer token, a streamed one spreads it over the chunks.
+    """
+
+    def __init__(self, latency: float = 0.0, token_latency: float = 0.0,
+                 answer_tokens: int = 64, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _respond(self, prompt: str) -> Tuple[bool, FakeResponse]:
+        with self._lock:
+            self.calls += 1
+            fail = self.failure_rate and self._random.random() < self.failure_rate
+        words_random = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+        words = [words_random.choice(_ANSWER_WORDS) for _ in range(self.answer_tokens)]
+        return fail, FakeResponse(words, max(1, len(prompt) // 4), self.token_latency)
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs) -> FakeResponse:
+        fail, response = self._respond(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+        if not stream and self.token_latency:
+            time.sleep(self.token_latency * len(response.words))
+        return response
+
+    async def generate_content_async(self, prompt: str, **kwargs) -> FakeResponse:
+        """Non-streamed generate_content that waits on the event loop instead of a thread"""
+        fail, response = self._respond(prompt)
+        await asyncio.sleep(self.latency + self.token_latency * len(response.words))
+        if fail:
+            raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+        return response
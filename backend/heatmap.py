@@ -0,0 +1,293 @@
+# heatmap.py - Precomputed state/district accident severity for the location heat map
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from entities import canonical
+from statement_chunker import compact_json
+from stats_engine import DETAIL
+
+LEVELS = ('state', 'district')
+SEVERITIES = ('all', 'fatal', 'serious')
+MEASURES = ('fatal_accidents', 'serious_accidents', 'persons_killed', 'persons_seriously_injured')
+RATES = {
+    'death_rate': 'death_rate_per_thousand_persons_employed_overall',
+    'serious_injury_rate': 'serious_injury_rate_per_thousand_persons_employed_overall',
+}
+
+
+class HeatmapQueryError(ValueError):
+    """Raised for an unknown level, severity, mineral or state"""
+
+
+def _aliases(mineral: str) -> Set[str]:
+    """4.6a lists "CHINA CLAY, CLAY, WHITE-CLAY" where 4.6b has "CHINA CLAY"; match on any part"""
+    parts = {canonical(part) for part in mineral.split(',')}
+    return {alias for alias in parts | {canonical(mineral)} if alias}
+
+
+def _rate(value) -> Optional[float]:
+    return None if value is None or np.isnan(value) else round(float(value), 2)
+
+
+def _latest_rows(table) -> List[int]:
+    """Rows of the latest report year (all rows when no statement sits in a year folder)"""
+    if 'report_year' not in table.columns:
+        return list(range(table.num_rows))
+    years = np.asarray(table.columns['report_year'], dtype=np.float64)
+    if np.isnan(years).all():
+        return list(range(table.num_rows))
+    return np.flatnonzero(years == np.nanmax(years)).tolist()
+
+# ==========================================
+# INDEX
+# ==========================================
+
+class HeatmapIndex:
+    """State- and district-level severity aggregates over statements 4.6a/4.6b
+
+    Accident and casualty counts per (mineral, state, district) cell are
+    dictionary-encoded once into int32 code arrays and a float64 measure
+    matrix; a query masks the cells by mineral/state and sums them per
+    region with np.bincount. Rates per 1000 employed (4.6b) are attached
+    when the map is filtered to a single mineral, since they cannot be
+    summed across minerals. With statements in year folders, only the
+    latest report year is mapped, so years are not summed together.
+    Serialized responses are cached with their ETag; the unfiltered maps
+    and every per-mineral map are precomputed.
+    """
+
+    def __init__(self, cells: List[Dict], rates: List[Dict], version: str,
+                 cache_entries: int = 256):
+        self.states = sorted({cell['state'] for cell in cells})
+        self.districts = sorted({(cell['state'], cell['district']) for cell in cells})
+        self.minerals = sorted({cell['mineral'] for cell in cells})
+        state_codes = {state: code for code, state in enumerate(self.states)}
+        district_codes = {key: code for code, key in enumerate(self.districts)}
+        mineral_codes = {mineral: code for code, mineral in enumerate(self.minerals)}
+
+        self.cell_state = np.array([state_codes[c['state']] for c in cells], dtype=np.int32)
+        self.cell_district = np.array([district_codes[(c['state'], c['district'])] for c in cells],
+                                      dtype=np.int32)
+        self.cell_mineral = np.array([mineral_codes[c['mineral']] for c in cells], dtype=np.int32)
+        self.values = np.array([[c[m] for m in MEASURES] for c in cells],
+                               dtype=np.float64).reshape(-1, len(MEASURES))
+        self.district_state = np.array([state_codes[state] for state, _ in self.districts], dtype=np.int32)
+
+        # canonical alias -> mineral code, and (mineral, state, district|None) -> rates
+        self.mineral_aliases: Dict[str, int] = {}
+        for code, mineral in enumerate(self.minerals):
+            for alias in _aliases(mineral):
+                self.mineral_aliases.setdefault(alias, code)
+        self.state_lookup = {canonical(state): code for code, state in enumerate(self.states)}
+        self.rates: Dict[Tuple[int, str, Optional[str]], Dict] = {}
+        for row in rates:
+            code = next((self.mineral_aliases[alias] for alias in _aliases(row['mineral'])
+                         if alias in self.mineral_aliases), None)
+            if code is not None:
+                self.rates[(code, canonical(row['state']), canonical(row['district']))] = row['rates']
+
+        self.version = version
+        self.cache_entries = cache_entries
+        self.responses: 'OrderedDict[Tuple, Tuple[str, bytes]]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+    @classmethod
+    def from_stats(cls, engine, cache_entries: int = 256) -> 'HeatmapIndex':
+        """Index over the stats engine's district tables (the snapshot the chatbot answers from)"""
+        cells, rates = [], []
+        accidents = engine.tables.get('district_accidents')
+        if accidents is not None:
+            for row in _latest_rows(accidents):
+                mineral, state, district = (accidents.value(column, row)
+                                            for column in ('mineral', 'state', 'district'))
+                if not (mineral and state and district):
+                    continue
+                cells.append({
+                    'mineral': mineral, 'state': state, 'district': district,
+                    **{m: (accidents.value(m, row) or 0) if m in accidents.columns else 0
+                       for m in MEASURES},
+                })
+
+        table = engine.tables.get('district_rates')
+        if table is not None:
+            for row in _latest_rows(table):
+                level = table.value('level', row)
+                if level not in (DETAIL, 'state') or not table.value('mineral', row):
+                    continue
+                rates.append({
+                    'mineral': table.value('mineral', row),
+                    'state': table.value('state', row),
+                    'district': table.value('district', row) if level == DETAIL else None,
+                    'rates': {name: _rate(table.columns[column][row]) if column in table.columns else None
+                              for name, column in RATES.items()},
+                })
+
+        snapshot = getattr(engine, 'snapshot', None)
+        version = (snapshot or {}).get('source_hash') or hashlib.sha256(
+            compact_json([cells, rates]).encode('utf-8')
+        ).hexdigest()
+        index = cls(cells, rates, version[:16], cache_entries)
+        index.precompute()
+        return index
+
+    def __len__(self):
+        return len(self.values)
+
+    # ---------- queries ----------
+
+    def _mineral(self, mineral: Optional[str]) -> Optional[int]:
+        if not mineral:
+            return None
+        code = self.mineral_aliases.get(canonical(mineral))
+        if code is None:
+            raise HeatmapQueryError(f"Unknown mineral '{mineral}'; expected one of {self.minerals}")
+        return code
+
+    def _state(self, state: Optional[str]) -> Optional[int]:
+        if not state:
+            return None
+        code = self.state_lookup.get(canonical(state))
+        if code is None:
+            raise HeatmapQueryError(f"Unknown state '{state}'; expected one of {self.states}")
+        return code
+
+    def query(self, level: str = 'state', severity: str = 'all', mineral: Optional[str] = None,
+              state: Optional[str] = None) -> Dict:
+        """Regions with their counts, the severity `value` and its 0-1 `intensity`"""
+        if level not in LEVELS:
+            raise HeatmapQueryError(f"Unknown level '{level}'; expected one of {list(LEVELS)}")
+        if severity not in SEVERITIES:
+            raise HeatmapQueryError(f"Unknown severity '{severity}'; expected one of {list(SEVERITIES)}")
+        mineral_code, state_code = self._mineral(mineral), self._state(state)
+
+        mask = np.ones(len(self.values), dtype=bool)
+        if mineral_code is not None:
+            mask &= self.cell_mineral == mineral_code
+        if state_code is not None:
+            mask &= self.cell_state == state_code
+
+        groups = self.cell_state if level == 'state' else self.cell_district
+        size = len(self.states) if level == 'state' else len(self.districts)
+        sums = np.stack([np.bincount(groups[mask], weights=self.values[mask, i], minlength=size)
+                         for i in range(len(MEASURES))], axis=1) if size else np.zeros((0, len(MEASURES)))
+        districts = np.bincount(self.cell_district[mask], minlength=len(self.districts))
+        if severity == 'fatal':
+            value = sums[:, 0]
+        elif severity == 'serious':
+            value = sums[:, 1]
+        else:
+            value = sums[:, 0] + sums[:, 1]
+
+        peak = float(value.max()) if len(value) else 0.0
+        regions = []
+        for code in np.argsort(-value, kind='stable'):
+            if value[code] <= 0:
+                break
+            counts = {measure: int(sums[code, i]) for i, measure in enumerate(MEASURES)}
+            if level == 'state':
+                region = {'state': self.states[code],
+                          'districts': int(np.count_nonzero(districts[self.district_state == code]))}
+                rate_key = (canonical(self.states[code]), None)
+            else:
+                state_name, district = self.districts[code]
+                region = {'state': state_name, 'district': district}
+                rate_key = (canonical(state_name), canonical(district))
+            region.update(counts)
+            region['accidents'] = counts['fatal_accidents'] + counts['serious_accidents']
+            region['value'] = int(value[code])
+            region['intensity'] = round(float(value[code]) / peak, 4) if peak else 0.0
+            if mineral_code is not None:
+                region.update(self.rates.get((mineral_code, *rate_key))
+                              or {name: None for name in RATES})
+            regions.append(region)
+
+        return {
+            'level': level,
+            'severity': severity,
+            'mineral': self.minerals[mineral_code] if mineral_code is not None else None,
+            'state': self.states[state_code] if state_code is not None else None,
+            'version': self.version,
+            'max_value': int(peak),
+            'totals': {measure: sum(region[measure] for region in regions) for measure in MEASURES},
+            'regions': regions,
+            'minerals': self.minerals,
+            'states': self.states,
+            'sources': ['Statement 4.6a.json', 'Statement_4.6b.json'],
+        }
+
+    # ---------- serialized responses ----------
+
+    def _key(self, level: str, severity: str, mineral: Optional[str], state: Optional[str]) -> Tuple:
+        return (level, severity, canonical(mineral) if mineral else None,
+                canonical(state) if state else None)
+
+    def response(self, level: str = 'state', severity: str = 'all', mineral: Optional[str] = None,
+                 state: Optional[str] = None) -> Tuple[str, bytes]:
+        """(ETag, JSON body) of a query, serialized once and cached"""
+        key = self._key(level, severity, mineral, state)
+        with self.lock:
+            cached = self.responses.get(key)
+            if cached is not None:
+                self.responses.move_to_end(key)
+                self.counters['hits'] += 1
+                return cached
+        body = compact_json({'success': True, **self.query(level, severity, mineral, state)}).encode('utf-8')
+        etag = f'"{self.version}-{hashlib.sha256(body).hexdigest()[:16]}"'
+        with self.lock:
+            self.counters['misses'] += 1
+            self.responses[key] = (etag, body)
+            while len(self.responses) > self.cache_entries:
+                self.responses.popitem(last=False)
+        return etag, body
+
+    def precompute(self):
+        """Serialize the unfiltered and per-mineral maps ahead of the first request"""
+        for level in LEVELS:
+            for severity in SEVERITIES:
+                for mineral in [None] + self.minerals:
+                    self.response(level, severity, mineral)
+        with self.lock:
+            self.counters['misses'] = 0
+
+    def not_modified(self):
+        with self.lock:
+            self.counters['not_modified'] += 1
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                **self.counters,
+                'cells': len(self.values),
+                'states': len(self.states),
+                'districts': len(self.districts),
+                'minerals': len(self.minerals),
+                'cached_responses': len(self.responses),
+                'version': self.version,
+            }
+
+# ==========================================
+# REQUESTS
+# ==========================================
+
+def heatmap_query_from_request(request) -> Dict:
+    """level/severity/mineral/state from the query string"""
+    args = request.args
+    return {
+        'level': (args.get('level') or 'state').lower(),
+        'severity': (args.get('severity') or 'all').lower(),
+        'mineral': args.get('mineral') or None,
+        'state': args.get('state') or None,
+    }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header (weak comparison) covers `etag`"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
@@ -0,0 +1,126 @@
+# history_compactor.py - Rolling summaries of long conversations, built off the request path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from statement_chunker import estimate_tokens
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an assistant
+for the Directorate General of Mine Safety (DGMS) in India.
+
+Rewrite the summary so it also covers the new turns. Keep what later questions may refer back
+to: the minerals, states, districts, years, statement numbers, accident codes and figures
+discussed, the user's goal, and any conclusions reached. Drop pleasantries and repetition.
+Write plain prose in at most {words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+
+def truncate_tokens(text: str, tokens: int) -> str:
+    """Cut `text` to about `tokens` estimated tokens, at a word boundary"""
+    text = ' '.join(text.split())
+    if estimate_tokens(text) <= tokens:
+        return text
+    return text[:tokens * 4].rsplit(' ', 1)[0]
+
+
+def render_turns(turns: List[Dict]) -> str:
+    return '\n'.join(f"User: {turn['user']}\nAssistant: {turn['assistant']}" for turn in turns)
+
+
+class HistoryCompactor:
+    """Fold the older turns of a session into a bounded rolling summary
+
+    Once a session stores more than `trigger_turns` turns, everything but
+    the newest `keep_turns` is summarized together with the previous
+    summary on a background thread, and the store drops the folded turns.
+    A session is compacted by at most one job at a time; a failed job
+    leaves the turns in place (the store's ring buffer still bounds them).
+    """
+
+    def __init__(self, store, summarize: Callable[[str], str], trigger_turns: int = 8,
+                 keep_turns: int = 3, summary_tokens: int = 300, enabled: bool = True):
+        if keep_turns >= trigger_turns:
+            raise ValueError("keep_turns must be smaller than trigger_turns")
+        self.store = store
+        self.summarize = summarize
+        self.trigger_turns = trigger_turns
+        self.keep_turns = keep_turns
+        self.summary_tokens = summary_tokens
+        self.enabled = enabled
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-compactor')
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.counters = {'compactions': 0, 'turns_folded': 0, 'conflicts': 0, 'failures': 0}
+        self.seconds = 0.0
+
+    def maybe_compact(self, session_id: str, stored_turns: int) -> bool:
+        """Schedule a compaction if the session grew past the trigger; True if scheduled"""
+        if not self.enabled or stored_turns <= self.trigger_turns:
+            return False
+        with self.lock:
+            if session_id in self.pending:
+                return False
+            self.pending.add(session_id)
+        self.executor.submit(self._run, session_id)
+        return True
+
+    def _run(self, session_id: str):
+        try:
+            self.compact(session_id)
+        except Exception as e:
+            with self.lock:
+                self.counters['failures'] += 1
+            print(f"⚠️ History compaction failed for session {session_id}: {type(e).__name__}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(session_id)
+
+    def compact(self, session_id: str) -> bool:
+        """Summarize all but the newest turns of one session now; True if the store took it"""
+        started = time.perf_counter()
+        summary, _ = self.store.get_conversation(session_id)
+        turns, _ = self.store.get_page(session_id, limit=self.store.max_turns)
+        folded = turns[:-self.keep_turns] if self.keep_turns else turns
+        if not folded:
+            return False
+
+        previous = summary['text'] if summary else '(none yet)'
+        prompt = SUMMARY_PROMPT.format(
+            words=int(self.summary_tokens * 0.75), summary=previous, turns=render_turns(folded)
+        )
+        text = truncate_tokens(self.summarize(prompt), self.summary_tokens)
+        updated = {
+            'text': text,
+            'tokens': estimate_tokens(text),
+            'turns': (summary['turns'] if summary else 0) + len(folded),
+            'through_seq': folded[-1]['seq'],
+            'updated_at': time.time(),
+        }
+        applied = self.store.compact(session_id, updated, summary['through_seq'] if summary else 0)
+        with self.lock:
+            if applied:
+                self.counters['compactions'] += 1
+                self.counters['turns_folded'] += len(folded)
+            else:
+                self.counters['conflicts'] += 1
+            self.seconds += time.perf_counter() - started
+        return applied
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                **self.counters,
+                'pending': len(self.pending),
+                'seconds': round(self.seconds, 3),
+                'enabled': self.enabled,
+                'trigger_turns': self.trigger_turns,
+                'keep_turns': self.keep_turns,
+            }
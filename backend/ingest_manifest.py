@@ -0,0 +1,174 @@
+# ingest_manifest.py - Content-hashed manifest for incremental uploads
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+MANIFEST_FORMAT = 1
+
+
+def make_vector_id(source_file: str, chunk_index: int) -> str:
+    """Deterministic, ASCII-safe vector ID for a chunk of a statement file
+
+    The readable slug is followed by a short hash of the exact relative
+    path, so "Statement 4.1.json" and "statement-4.1.json" stay distinct.
+    """
+    path = source_file.replace(os.sep, '/')
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', os.path.splitext(path)[0]).strip('_').lower()
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]
+    return f"{slug}-{digest}-{chunk_index:04d}"
+
+
+def content_hash(page_content: str, metadata: Dict) -> str:
+    """Hash of the text and metadata of a document"""
+    digest = hashlib.sha256()
+    digest.update(page_content.encode('utf-8'))
+    digest.update(json.dumps(metadata, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class IngestPlan:
+    """What an incremental upload will do to the index"""
+
+    def __init__(self):
+        self.upsert: List = []        # (vector_id, document, hash) to embed and write
+        self.unchanged: List[str] = []
+        self.delete: List[str] = []
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.upsert or self.delete)
+
+    def summary(self) -> Dict:
+        return {
+            'upsert': len(self.upsert),
+            'unchanged': len(self.unchanged),
+            'delete': len(self.delete),
+        }
+
+    def report(self):
+        """Print the plan, e.g. for a dry run"""
+        summary = self.summary()
+        print(f"Plan: {summary['upsert']} to embed/upsert, "
+              f"{summary['unchanged']} unchanged, {summary['delete']} to delete")
+        for vector_id, document, _ in self.upsert:
+            print(f"  + {vector_id} ({document.metadata.get('source_file', 'Unknown')})")
+        for vector_id in self.delete:
+            print(f"  - {vector_id}")
+
+
+class IngestManifest:
+    """Persistent record of what has been embedded into the index"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.index_version = 0
+        self.vectors: Dict[str, Dict] = {}
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('format') != MANIFEST_FORMAT:
+            print(f"Ignoring manifest with unknown format: {self.path}")
+            return
+        self.index_version = data.get('index_version', 0)
+        self.vectors = data.get('vectors', {})
+
+    def save(self):
+        """Write atomically so an interrupted run never leaves a torn file"""
+        if not self.path:
+            return
+        data = {
+            'format': MANIFEST_FORMAT,
+            'index_version': self.index_version,
+            'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'vectors': self.vectors,
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def plan(self, documents: List, force: bool = False) -> IngestPlan:
+        """Diff documents (keyed by their doc_id) against the manifest"""
+        plan = IngestPlan()
+        seen = set()
+
+        for document in documents:
+            vector_id = document.metadata['doc_id']
+            if vector_id in seen:
+                raise ValueError(f"Duplicate vector ID {vector_id} "
+                                 f"({document.metadata.get('source_file', 'Unknown')})")
+            digest = content_hash(document.page_content, document.metadata)
+            seen.add(vector_id)
+
+            entry = self.vectors.get(vector_id)
+            if not force and entry and entry.get('hash') == digest:
+                plan.unchanged.append(vector_id)
+            else:
+                plan.upsert.append((vector_id, document, digest))
+
+        plan.delete = sorted(vid for vid in self.vectors if vid not in seen)
+        return plan
+
+    def record_upserts(self, items: List):
+        self.record_upserts_raw([
+            (vector_id, digest, document.metadata.get('source_file'))
+            for vector_id, document, digest in items
+        ])
+
+    def record_upserts_raw(self, items: List[Tuple[str, str, Optional[str]]]):
+        """Record (vector_id, hash, source_file) triples"""
+        for vector_id, digest, source_file in items:
+            self.vectors[vector_id] = {'hash': digest, 'source_file': source_file}
+
+    def record_deletes(self, vector_ids: List[str]):
+        for vector_id in vector_ids:
+            self.vectors.pop(vector_id, None)
+
+    def bump_version(self) -> int:
+        self.index_version += 1
+        return self.index_version
+
+
+class IndexVersionWatcher:
+    """Cheaply track the manifest's index_version from another process
+
+    The file is only re-read when its mtime changes, and stat() is called at
+    most once per `check_interval` seconds.
+    """
+
+    def __init__(self, path: Optional[str], check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.version = 0
+        self.mtime = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def current(self) -> int:
+        if not self.path:
+            return self.version
+        now = time.monotonic()
+        with self.lock:
+            if now - self.checked_at < self.check_interval:
+                return self.version
+            self.checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return self.version
+            if mtime != self.mtime:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self.version = json.load(f).get('index_version', 0)
+                    self.mtime = mtime
+                except (OSError, ValueError):
+                    pass    # mid-write; retry on the next check
+            return self.version
@@ -0,0 +1,487 @@
+# ingest_pipeline.py - Staged, concurrent embedding and upsert pipeline
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from ingest_manifest import IngestManifest, content_hash
+from statement_chunker import StatementChunker
+from statement_loader import normalize_chunk
+
+# ==========================================
+# RATE LIMITING & RETRIES
+# ==========================================
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens/second, bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until `tokens` are available"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Rate limits, quota exhaustion and transient server/network errors"""
+    text = f"{type(error).__name__} {error}".lower()
+    markers = ('429', 'rate limit', 'resourceexhausted', 'resource has been exhausted',
+               'quota', '500', '502', '503', '504', 'unavailable', 'deadline',
+               'timeout', 'timed out', 'connection')
+    return any(marker in text for marker in markers)
+
+
+def retry_with_backoff(func: Callable, max_retries: int = 6, base_delay: float = 1.0,
+                       max_delay: float = 60.0, on_retry: Optional[Callable] = None,
+                       is_retryable: Callable[[Exception], bool] = is_retryable_error):
+    """Call `func`, retrying retryable errors with full-jitter exponential backoff"""
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            attempt += 1
+            if on_retry:
+                on_retry(e, attempt, delay)
+            time.sleep(delay)
+
+# ==========================================
+# CHECKPOINT
+# ==========================================
+
+class Checkpoint:
+    """Append-only log of chunks upserted by an unfinished run"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.done: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue    # torn final line from a crash
+                    self.done[entry['id']] = entry['hash']
+
+    def is_done(self, vector_id: str, digest: str) -> bool:
+        return self.done.get(vector_id) == digest
+
+    def record(self, items: List[Tuple[str, str]]):
+        with self.lock:
+            for vector_id, digest in items:
+                self.done[vector_id] = digest
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    for vector_id, digest in items:
+                        f.write(json.dumps({'id': vector_id, 'hash': digest}) + '\n')
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.done = {}
+
+# ==========================================
+# PIPELINE
+# ==========================================
+
+_DONE = object()
+
+
+class PipelineStats:
+    """Counters shared by all stages"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.finished = None
+        self.counts = {
+            'files_loaded': 0, 'files_failed': 0, 'chunks': 0, 'skipped': 0,
+            'embedded': 0, 'upserted': 0, 'failed': 0, 'deleted': 0,
+            'embed_calls': 0, 'upsert_calls': 0, 'retries': 0,
+        }
+        self.errors: List[str] = []
+
+    def add(self, key: str, amount: int = 1):
+        with self.lock:
+            self.counts[key] += amount
+
+    def error(self, message: str):
+        with self.lock:
+            self.errors.append(message)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self) -> Dict:
+        elapsed = self.elapsed
+        return {
+            **self.counts,
+            'elapsed_seconds': round(elapsed, 3),
+            'chunks_per_second': round(self.counts['upserted'] / elapsed, 2) if elapsed else 0.0,
+            'errors': list(self.errors),
+        }
+
+    def report(self):
+        s = self.summary()
+        print("Ingestion report:")
+        print(f"  Files:      {s['files_loaded']} loaded, {s['files_failed']} failed")
+        print(f"  Chunks:     {s['chunks']} total, {s['skipped']} unchanged/resumed")
+        print(f"  Embedded:   {s['embedded']} in {s['embed_calls']} calls")
+        print(f"  Upserted:   {s['upserted']} in {s['upsert_calls']} calls, {s['deleted']} deleted")
+        print(f"  Failed:     {s['failed']} chunks, {s['retries']} retries")
+        print(f"  Throughput: {s['chunks_per_second']} chunks/s over {s['elapsed_seconds']}s")
+        for message in s['errors']:
+            print(f"  ❌ {message}")
+
+
+class IngestionPipeline:
+    """load -> chunk -> embed (worker pool) -> upsert, joined by bounded queues
+
+    `embeddings` needs `embed_documents(texts)`; `index` needs Pinecone's
+    `upsert(vectors=[...])` and `delete(ids=[...])`. Chunks already in the
+    manifest (or in the checkpoint of an interrupted run) are skipped.
+    Every chunk, embedded or not, is also fed to `lexical_index` (if given)
+    so the BM25 index always covers exactly what the vector index holds.
+    `run_stream` replaces the load and chunk stages with chunks parsed by a
+    process pool (statement_loader.StreamingLoader). A stage that crashes
+    still signals the stages after it, and `run` re-raises its error.
+    """
+
+    def __init__(self, embeddings, index, chunker: StatementChunker,
+                 manifest: IngestManifest, checkpoint_path: Optional[str] = None,
+                 embed_batch_size: int = 32, embed_workers: int = 4,
+                 upsert_batch_size: int = 100, queue_size: int = 8,
+                 requests_per_second: float = 5.0, max_retries: int = 6,
+                 base_delay: float = 1.0, max_delay: float = 60.0,
+                 force: bool = False, text_key: str = 'text',
+                 lexical_index=None):
+        self.embeddings = embeddings
+        self.index = index
+        self.lexical_index = lexical_index
+        self.chunker = chunker
+        self.manifest = manifest
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.embed_batch_size = embed_batch_size
+        self.embed_workers = embed_workers
+        self.upsert_batch_size = upsert_batch_size
+        self.queue_size = queue_size
+        self.bucket = TokenBucket(requests_per_second)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.force = force
+        self.text_key = text_key
+        self.stats = PipelineStats()
+        self.seen = set()
+        self.completed: List[Tuple[str, str, str]] = []   # (id, hash, source_file)
+        # Buffered backends (LocalVectorIndex) only persist on flush()
+        self.buffered = hasattr(index, 'flush')
+        self.unflushed: List[Tuple[str, str]] = []
+        self.failure: Optional[Tuple[str, Exception]] = None
+
+    def _retry(self, func: Callable, label: str):
+        def on_retry(error, attempt, delay):
+            self.stats.add('retries')
+            print(f"  ⚠ {label} failed ({error}); retry {attempt} in {delay:.1f}s")
+
+        return retry_with_backoff(func, self.max_retries, self.base_delay,
+                                  self.max_delay, on_retry=on_retry)
+
+    def _fail(self, stage: str, error: Exception):
+        """Record an unexpected stage crash; the first one is re-raised by `_run`"""
+        self.stats.error(f"{stage} stage crashed: {type(error).__name__}: {error}")
+        with self.stats.lock:
+            if self.failure is None:
+                self.failure = (stage, error)
+
+    @staticmethod
+    def _drain(inp: queue.Queue, producers: int):
+        """Discard input until `producers` end markers arrive, so upstream never blocks"""
+        while producers:
+            if inp.get() is _DONE:
+                producers -= 1
+
+    # ---------- stages ----------
+
+    def _load_stage(self, files: Iterable[Tuple[str, str]], out: queue.Queue):
+        try:
+            for file_path, source in files:
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError) as e:
+                    self.stats.add('files_failed')
+                    self.stats.error(f"{source}: {e}")
+                    continue
+                self.stats.add('files_loaded')
+                out.put((source, data))
+        except Exception as e:
+            self._fail('load', e)
+        finally:
+            out.put(_DONE)
+
+    def _route(self, content: str, metadata: Dict, batch: List, out: queue.Queue) -> List:
+        """Skip an unchanged chunk or add it to the embed batch; returns the open batch"""
+        vector_id = metadata['doc_id']
+        digest = content_hash(content, metadata)
+        self.seen.add(vector_id)
+        self.stats.add('chunks')
+        if self.lexical_index is not None:
+            self.lexical_index.add(vector_id, content, metadata)
+
+        entry = self.manifest.vectors.get(vector_id)
+        if not self.force and entry and entry.get('hash') == digest:
+            self.stats.add('skipped')
+            return batch
+        if self.checkpoint.is_done(vector_id, digest):
+            # Upserted by the interrupted run but not yet in the manifest
+            with self.stats.lock:
+                self.completed.append((vector_id, digest, metadata.get('source_file')))
+            self.stats.add('skipped')
+            return batch
+
+        batch.append((vector_id, digest, content, metadata))
+        if len(batch) >= self.embed_batch_size:
+            out.put(batch)
+            return []
+        return batch
+
+    def _end_batches(self, batch: List, out: queue.Queue):
+        if batch:
+            out.put(batch)
+        for _ in range(self.embed_workers):
+            out.put(_DONE)
+
+    def _chunk_stage(self, inp: queue.Queue, out: queue.Queue):
+        batch = []
+        try:
+            while True:
+                item = inp.get()
+                if item is _DONE:
+                    break
+                source, data = item
+                try:
+                    chunks = self.chunker.chunk(source, data)
+                except Exception as e:
+                    self.stats.add('files_failed')
+                    self.stats.error(f"{source}: chunking failed: {e}")
+                    continue
+                for chunk in chunks:
+                    content, metadata = normalize_chunk(source, chunk)
+                    batch = self._route(content, metadata, batch, out)
+        except Exception as e:
+            self._fail('chunk', e)
+            self._drain(inp, 1)
+        finally:
+            self._end_batches(batch, out)
+
+    def _stream_stage(self, loaded_files: Iterable, out: queue.Queue):
+        """Route chunks of files parsed elsewhere (statement_loader.LoadedFile) as they arrive"""
+        batch = []
+        try:
+            for loaded in loaded_files:
+                if loaded.error:
+                    self.stats.add('files_failed')
+                    self.stats.error(loaded.error)
+                    continue
+                self.stats.add('files_loaded')
+                for content, metadata in loaded.chunks:
+                    batch = self._route(content, metadata, batch, out)
+        except Exception as e:
+            # The loader itself broke (e.g. a dead worker pool); keep what was routed
+            self.stats.add('files_failed')
+            self.stats.error(f"loader failed: {type(e).__name__}: {e}")
+        finally:
+            self._end_batches(batch, out)
+
+    def _embed_stage(self, inp: queue.Queue, out: queue.Queue):
+        try:
+            while True:
+                batch = inp.get()
+                if batch is _DONE:
+                    return
+                texts = [content for _, _, content, _ in batch]
+
+                def embed():
+                    self.bucket.acquire()
+                    self.stats.add('embed_calls')
+                    return self.embeddings.embed_documents(texts)
+
+                try:
+                    vectors = self._retry(embed, f"embed batch of {len(batch)}")
+                except Exception as e:
+                    self.stats.add('failed', len(batch))
+                    self.stats.error(f"embedding {batch[0][0]}..: {e}")
+                    continue
+                if len(vectors) != len(batch):
+                    raise ValueError(f"{len(vectors)} embeddings for a batch of {len(batch)}")
+                self.stats.add('embedded', len(batch))
+                out.put([(item, vector) for item, vector in zip(batch, vectors)])
+        except Exception as e:
+            self._fail('embed', e)
+            self._drain(inp, 1)
+        finally:
+            out.put(_DONE)
+
+    def _upsert_stage(self, inp: queue.Queue):
+        workers_left = self.embed_workers
+        try:
+            pending = []
+            while workers_left:
+                items = inp.get()
+                if items is _DONE:
+                    workers_left -= 1
+                    continue
+                pending.extend(items)
+                while len(pending) >= self.upsert_batch_size:
+                    self._upsert(pending[:self.upsert_batch_size])
+                    pending = pending[self.upsert_batch_size:]
+            if pending:
+                self._upsert(pending)
+        except Exception as e:
+            self._fail('upsert', e)
+            self._drain(inp, workers_left)
+
+    def _upsert(self, items: List):
+        vectors = [
+            {
+                'id': vector_id,
+                'values': vector,
+                'metadata': {**metadata, self.text_key: content},
+            }
+            for (vector_id, _, content, metadata), vector in items
+        ]
+
+        def upsert():
+            self.stats.add('upsert_calls')
+            return self.index.upsert(vectors=vectors)
+
+        try:
+            self._retry(upsert, f"upsert of {len(vectors)}")
+        except Exception as e:
+            self.stats.add('failed', len(items))
+            self.stats.error(f"upserting {items[0][0][0]}..: {e}")
+            return
+
+        done = [(vector_id, digest) for (vector_id, digest, _, _), _ in items]
+        if self.buffered:
+            # Checkpoint only what the backend has made durable; see _finish
+            with self.stats.lock:
+                self.unflushed.extend(done)
+        else:
+            self.checkpoint.record(done)
+        with self.stats.lock:
+            self.completed.extend(
+                (vector_id, digest, metadata.get('source_file'))
+                for (vector_id, digest, _, metadata), _ in items
+            )
+        self.stats.add('upserted', len(items))
+        print(f"  ↑ {self.stats.counts['upserted']} upserted "
+              f"({self.stats.counts['skipped']} skipped, {self.stats.counts['failed']} failed)")
+
+    # ---------- driver ----------
+
+    def run(self, files: List[Tuple[str, str]]) -> PipelineStats:
+        """Run every stage to completion and fold results into the manifest
+
+        `files` are (path, source name) pairs as returned by
+        statement_loader.discover_json_files; the source name keys the vector IDs.
+        """
+        loaded = queue.Queue(maxsize=self.queue_size)
+        chunked = queue.Queue(maxsize=self.queue_size)
+        return self._run(chunked, [
+            threading.Thread(target=self._load_stage, args=(files, loaded), name='load'),
+            threading.Thread(target=self._chunk_stage, args=(loaded, chunked), name='chunk'),
+        ])
+
+    def run_stream(self, loaded_files: Iterable) -> PipelineStats:
+        """Like `run`, fed by an iterator of already-chunked files (see statement_loader)"""
+        chunked = queue.Queue(maxsize=self.queue_size)
+        return self._run(chunked, [
+            threading.Thread(target=self._stream_stage, args=(loaded_files, chunked), name='stream'),
+        ])
+
+    def _run(self, chunked: queue.Queue, sources: List[threading.Thread]) -> PipelineStats:
+        embedded = queue.Queue(maxsize=self.queue_size)
+
+        threads = sources + [
+            threading.Thread(target=self._upsert_stage, args=(embedded,), name='upsert'),
+        ] + [
+            threading.Thread(target=self._embed_stage, args=(chunked, embedded), name=f'embed-{i}')
+            for i in range(self.embed_workers)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.failure is not None:
+            # Leave the manifest alone; the checkpoint lets the next run resume
+            self.stats.finished = time.monotonic()
+            stage, error = self.failure
+            raise RuntimeError(f"Ingestion {stage} stage failed: {error}") from error
+
+        self._finish()
+        self.stats.finished = time.monotonic()
+        return self.stats
+
+    def _finish(self):
+        """Apply deletions and commit the run to the manifest"""
+        self.manifest.record_upserts_raw(self.completed)
+
+        clean_run = not self.stats.counts['failed'] and not self.stats.counts['files_failed']
+        stale = sorted(vid for vid in self.manifest.vectors if vid not in self.seen)
+        if stale and clean_run:
+            try:
+                self._retry(lambda: self.index.delete(ids=stale), f"delete of {len(stale)}")
+                self.manifest.record_deletes(stale)
+                self.stats.add('deleted', len(stale))
+            except Exception as e:
+                self.stats.error(f"deleting stale vectors: {e}")
+        elif stale:
+            # A file that failed to load would look deleted; keep its vectors
+            print(f"  Skipping deletion of {len(stale)} vectors because the run had failures")
+
+        # Local stores buffer writes; publish them before the manifest claims them
+        if self.buffered:
+            self.index.flush()
+            if self.unflushed:
+                self.checkpoint.record(self.unflushed)
+                self.unflushed = []
+        if self.lexical_index is not None:
+            if clean_run:
+                self.lexical_index.retain(self.seen)
+            self.lexical_index.flush()
+
+        if self.completed or self.stats.counts['deleted']:
+            self.manifest.bump_version()
+        self.manifest.save()
+        # Unreadable files leave nothing to resume; only failed batches do
+        if not self.stats.counts['failed']:
+            self.checkpoint.clear()
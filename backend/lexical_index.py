@@ -0,0 +1,482 @@
+# lexical_index.py - BM25 inverted index over the uploader's chunks, and hybrid rank fusion
+import asyncio
+import json
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from local_vectorstore import matches_filter
+
+META_FILE = "lexical.json"
+INDEX_FORMAT = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+TOKEN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)*')
+STOPWORDS = {
+    'a', 'an', 'the', 'of', 'for', 'to', 'in', 'on', 'by', 'and', 'or', 'is', 'are',
+    'was', 'were', 'what', 'which', 'how', 'many', 'much', 'me', 'tell', 'about',
+    'show', 'list', 'give', 'with', 'from', 'at', 'as', 'it', 'its', 'do', 'does',
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words, numbers, codes ("0222") and statement numbers ("4.11")"""
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+# ==========================================
+# WRITER (used by the uploader)
+# ==========================================
+
+class LexicalIndexWriter:
+    """Collects chunks during ingestion and publishes a BM25 index on `flush()`
+
+    Postings are stored term-major as two arrays (document row, weight)
+    with a per-term offset table. The weight already folds in BM25's IDF
+    and length normalization, so a query only sums weights.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.documents: Dict[str, Tuple[str, Dict]] = {}
+        self.dirty = False
+        os.makedirs(path, exist_ok=True)
+        opened = LexicalIndex.open_arrays(path)
+        if opened is not None:
+            meta = opened[0]
+            for doc_id, text, metadata in zip(meta['ids'], meta['texts'], meta['metadatas']):
+                self.documents[doc_id] = (text, metadata)
+
+    def add(self, doc_id: str, text: str, metadata: Dict):
+        with self.lock:
+            if self.documents.get(doc_id) != (text, metadata):
+                self.documents[doc_id] = (text, metadata)
+                self.dirty = True
+
+    def retain(self, doc_ids: Iterable[str]):
+        """Drop every document not in `doc_ids` (chunks that disappeared from the statements)"""
+        keep = set(doc_ids)
+        with self.lock:
+            for doc_id in [d for d in self.documents if d not in keep]:
+                del self.documents[doc_id]
+                self.dirty = True
+
+    def flush(self):
+        """Atomically publish the index; lexical.json is the commit point"""
+        with self.lock:
+            if not self.dirty:
+                return
+            ids = sorted(self.documents)
+            texts = [self.documents[doc_id][0] for doc_id in ids]
+            metadatas = [self.documents[doc_id][1] for doc_id in ids]
+
+            term_counts: Dict[str, Dict[int, int]] = {}
+            lengths = np.zeros(len(ids), dtype=np.float32)
+            for row, text in enumerate(texts):
+                tokens = tokenize(text)
+                lengths[row] = len(tokens)
+                for token in tokens:
+                    postings = term_counts.setdefault(token, {})
+                    postings[row] = postings.get(row, 0) + 1
+            average_length = float(lengths.mean()) if ids else 0.0
+
+            vocabulary = sorted(term_counts)
+            offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+            rows, weights = [], []
+            for position, term in enumerate(vocabulary):
+                postings = term_counts[term]
+                idf = math.log(1 + (len(ids) - len(postings) + 0.5) / (len(postings) + 0.5))
+                for row, count in sorted(postings.items()):
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[row] / average_length)
+                    rows.append(row)
+                    weights.append(idf * count * (BM25_K1 + 1) / (count + norm))
+                offsets[position + 1] = len(rows)
+
+            # Never reuse a name: a reader may still have the old file mapped
+            stamp = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+            files = {
+                'offsets_file': (f"offsets-{stamp}.npy", offsets),
+                'rows_file': (f"rows-{stamp}.npy", np.asarray(rows, dtype=np.int32)),
+                'weights_file': (f"weights-{stamp}.npy", np.asarray(weights, dtype=np.float32)),
+            }
+            for name, array in files.values():
+                np.save(os.path.join(self.path, name), array)
+
+            meta = {
+                'format': INDEX_FORMAT,
+                'k1': BM25_K1,
+                'b': BM25_B,
+                'average_length': average_length,
+                'vocabulary': vocabulary,
+                'ids': ids,
+                'texts': texts,
+                'metadatas': metadatas,
+                **{key: name for key, (name, _) in files.items()},
+            }
+            meta_path = os.path.join(self.path, META_FILE)
+            previous = self._published_files(meta_path)
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.tmp', meta_path)
+
+            # A reader may have loaded the previous lexical.json but not yet
+            # opened its arrays; those files go one publish later
+            keep = {name for name, _ in files.values()} | previous
+            for name in os.listdir(self.path):
+                if name.endswith('.npy') and name not in keep:
+                    os.remove(os.path.join(self.path, name))
+            self.dirty = False
+
+    @staticmethod
+    def _published_files(meta_path: str) -> set:
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        return {meta.get(key) for key in ('offsets_file', 'rows_file', 'weights_file')} - {None}
+
+# ==========================================
+# READER (used by the chatbots)
+# ==========================================
+
+class LexicalIndex:
+    """Memory-mapped BM25 index, re-opened when the uploader publishes a new one"""
+
+    def __init__(self, path: str, reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.meta_mtime = None
+        self.checked_at = 0.0
+        self.terms: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict] = []
+        self.positions: Dict[str, int] = {}
+        self.offsets = self.rows = self.weights = None
+        self._maybe_reload(force=True)
+
+    @staticmethod
+    def open_arrays(path: str):
+        """(meta, offsets, rows, weights) for the published index, or None if absent"""
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') != INDEX_FORMAT:
+            return None
+        arrays = [np.load(os.path.join(path, meta[key]), mmap_mode='r')
+                  for key in ('offsets_file', 'rows_file', 'weights_file')]
+        return (meta, *arrays)
+
+    def _maybe_reload(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.reload_interval:
+            return
+        self.checked_at = now
+        try:
+            mtime = os.stat(os.path.join(self.path, META_FILE)).st_mtime
+        except OSError:
+            return
+        if mtime == self.meta_mtime:
+            return
+        with self.lock:
+            try:
+                opened = self.open_arrays(self.path)
+            except FileNotFoundError:
+                # Raced a publish that removed the arrays; keep serving the
+                # previous ones and pick the new index up on the next check
+                return
+            if opened is None:
+                return
+            meta, self.offsets, self.rows, self.weights = opened
+            self.terms = {term: position for position, term in enumerate(meta['vocabulary'])}
+            self.ids = meta['ids']
+            self.texts = meta['texts']
+            self.metadatas = meta['metadatas']
+            self.positions = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            self.meta_mtime = mtime
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search_with_score(self, query: str, k: int = 4,
+                          filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        """Top-k documents by BM25 score (documents matching no query term are left out)"""
+        self._maybe_reload()
+        with self.lock:
+            terms, offsets, rows, weights = self.terms, self.offsets, self.rows, self.weights
+            texts, metadatas = self.texts, self.metadatas
+        if not texts:
+            return []
+
+        scores = np.zeros(len(texts), dtype=np.float32)
+        for token in set(tokenize(query)):
+            position = terms.get(token)
+            if position is None:
+                continue
+            start, end = int(offsets[position]), int(offsets[position + 1])
+            np.add.at(scores, rows[start:end], weights[start:end])
+
+        candidates = np.flatnonzero(scores)
+        if filter and candidates.size:
+            candidates = candidates[[matches_filter(metadatas[row], filter) for row in candidates]]
+        if candidates.size == 0:
+            return []
+
+        k = min(k, candidates.size)
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [
+            (Document(page_content=texts[row], metadata=dict(metadatas[row])), float(scores[row]))
+            for row in top
+        ]
+
+    def search(self, query: str, k: int = 4, filter: Optional[Dict] = None) -> List[Document]:
+        return [doc for doc, _ in self.search_with_score(query, k, filter)]
+
+    def get(self, doc_id: str) -> Optional[Document]:
+        """The indexed chunk with this vector ID, or None"""
+        self._maybe_reload()
+        with self.lock:
+            row = self.positions.get(doc_id)
+            if row is None:
+                return None
+            return Document(page_content=self.texts[row], metadata=dict(self.metadatas[row]))
+
+    def stats(self) -> Dict:
+        return {
+            'documents': len(self.ids),
+            'terms': len(self.terms),
+            'postings': int(self.rows.shape[0]) if self.rows is not None else 0,
+        }
+
+# ==========================================
+# HYBRID RETRIEVAL
+# ==========================================
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """"vector=1,lexical=0.5" -> {'vector': 1.0, 'lexical': 0.5}"""
+    weights = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        name, _, value = part.partition('=')
+        name = name.strip()
+        if name not in ('vector', 'lexical'):
+            raise ValueError(f"Unknown retrieval weight: {name}")
+        weights[name] = float(value)
+    return weights
+
+
+def weights_key(weights: Dict[str, float]) -> str:
+    """Canonical string form of fusion weights, used in cache and coalescing keys"""
+    return ','.join(f"{name}={weight}" for name, weight in sorted(weights.items()))
+
+
+def _identity(doc: Document) -> str:
+    return doc.metadata.get('doc_id') or doc.page_content
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[Document]], weights: Dict[str, float],
+                           k: int, rrf_k: int = RRF_K) -> List[Tuple[Document, Dict]]:
+    """Merge ranked lists: score(d) = sum of weight / (rrf_k + rank) over the lists holding d
+
+    Returns the top-k (document, {'score', 'ranks'}) pairs; ties keep the
+    order in which documents were first seen.
+    """
+    fused: Dict[str, List] = {}
+    for name, docs in rankings.items():
+        weight = weights.get(name, 0.0)
+        for rank, doc in enumerate(docs, start=1):
+            entry = fused.setdefault(_identity(doc), [doc, 0.0, {}])
+            entry[1] += weight / (rrf_k + rank)
+            entry[2][name] = rank
+    ranked = sorted(fused.values(), key=lambda entry: -entry[1])[:k]
+    return [(doc, {'score': round(score, 6), 'ranks': ranks}) for doc, score, ranks in ranked]
+
+
+class HybridRetriever:
+    """Runs vector and BM25 search in parallel and fuses them with weighted RRF
+
+    A side with weight 0, or a missing/empty lexical index, is skipped, so
+    {'vector': 1} is plain embedding search and {'lexical': 1} never embeds.
+    Each side returns `fetch_k` candidates so documents ranked just below k
+    by one retriever can still be lifted by the other.
+    """
+
+    def __init__(self, vectorstore, lexical: Optional[LexicalIndex], fetch_k: int = 20,
+                 rrf_k: int = RRF_K, max_workers: int = 4):
+        self.vectorstore = vectorstore
+        self.lexical = lexical
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hybrid')
+
+    def uses_lexical(self, weights: Dict[str, float]) -> bool:
+        return bool(weights.get('lexical', 0) > 0 and self.lexical is not None and len(self.lexical))
+
+    def uses_vector(self, weights: Dict[str, float]) -> bool:
+        """Whether a search with these weights needs the query embedding"""
+        return weights.get('vector', 0) > 0 or not self.uses_lexical(weights)
+
+    def search(self, query: str, k: int, weights: Dict[str, float],
+               embedding: Optional[List[float]] = None,
+               filter: Optional[Dict] = None, timings=None,
+               filter_lexical: bool = True) -> List[Tuple[Document, Dict]]:
+        """Top-k (document, {'score', 'ranks'}); stages are timed into `timings` if given
+
+        With `filter_lexical` off, `filter` narrows only the vector side.
+        """
+        def span(stage):
+            return timings.span(stage) if timings is not None else nullcontext()
+
+        use_lexical, use_vector, fetch_k = self._plan(k, weights)
+
+        def vector_search(vector):
+            if vector is None:
+                with span('embed'):
+                    vector = self.vectorstore.embeddings.embed_query(query)
+            with span('vector_search'):
+                return self.vectorstore.similarity_search_by_vector(vector, k=fetch_k, filter=filter)
+
+        rankings = {}
+        pending = self.executor.submit(vector_search, embedding) if use_vector else None
+        if use_lexical:
+            with span('lexical_search'):
+                rankings['lexical'] = self.lexical.search(
+                    query, k=fetch_k, filter=filter if filter_lexical else None
+                )
+        if pending is not None:
+            rankings['vector'] = pending.result()
+        return self._fuse(rankings, weights, k, span)
+
+    def _plan(self, k: int, weights: Dict[str, float]) -> Tuple[bool, bool, int]:
+        """(use lexical, use vector, candidates per side)"""
+        use_lexical = self.uses_lexical(weights)
+        use_vector = weights.get('vector', 0) > 0 or not use_lexical
+        return use_lexical, use_vector, max(k, self.fetch_k) if use_lexical and use_vector else k
+
+    def _fuse(self, rankings: Dict[str, List[Document]], weights: Dict[str, float], k: int,
+              span) -> List[Tuple[Document, Dict]]:
+        if len(rankings) == 1:
+            (name, docs), = rankings.items()
+            return [(doc, {'score': None, 'ranks': {name: rank}})
+                    for rank, doc in enumerate(docs[:k], start=1)]
+        with span('fusion'):
+            return reciprocal_rank_fusion(rankings, weights, k, self.rrf_k)
+
+    async def asearch(self, query: str, k: int, weights: Dict[str, float],
+                      embedding: Optional[List[float]] = None,
+                      filter: Optional[Dict] = None, timings=None,
+                      limits=None, filter_lexical: bool = True) -> List[Tuple[Document, Dict]]:
+        """search() on an event loop: BM25 runs on a worker thread while the vector side awaits
+
+        The vector store's own asimilarity_search_by_vector is used when it
+        has one. `limits` (async_serving.UpstreamLimits) caps concurrent
+        embed and search calls across requests.
+        """
+        def span(stage):
+            return timings.span(stage) if timings is not None else nullcontext()
+
+        def slot(name):
+            return limits.slot(name) if limits is not None else nullcontext()
+
+        use_lexical, use_vector, fetch_k = self._plan(k, weights)
+
+        async def vector_search(vector):
+            if vector is None:
+                with span('embed'):
+                    async with slot('embed'):
+                        vector = await self.vectorstore.embeddings.aembed_query(query)
+            with span('vector_search'):
+                async with slot('search'):
+                    search = getattr(self.vectorstore, 'asimilarity_search_by_vector', None)
+                    if search is not None:
+                        return await search(vector, k=fetch_k, filter=filter)
+                    return await asyncio.to_thread(
+                        self.vectorstore.similarity_search_by_vector, vector, k=fetch_k, filter=filter
+                    )
+
+        async def lexical_search():
+            with span('lexical_search'):
+                return await asyncio.to_thread(self.lexical.search, query, k=fetch_k,
+                                               filter=filter if filter_lexical else None)
+
+        sides = {}
+        if use_vector:
+            sides['vector'] = vector_search(embedding)
+        if use_lexical:
+            sides['lexical'] = lexical_search()
+        rankings = dict(zip(sides, await asyncio.gather(*sides.values())))
+        return self._fuse(rankings, weights, k, span)
+
+    def filtered_search(self, query: str, k: int, weights: Dict[str, float],
+                        filter: Optional[Dict], min_hits: int,
+                        embedding: Optional[List[float]] = None,
+                        timings=None) -> List[Tuple[Document, Dict]]:
+        """search() narrowed by a metadata `filter`, topped up unfiltered when it is too narrow
+
+        The filter applies to the vector side only: BM25 hits are always fused
+        unfiltered, so an exact name match on a chunk without the entity tag
+        (e.g. a mine in 4.11/4.13) is not lost. With fewer than `min_hits`
+        hits matching the filter, the rest of the top-k comes from an
+        unfiltered search. Each hit's info says whether it matched the
+        filter ('filtered') and marks top-up hits ('fallback').
+        """
+        if not filter:
+            return self.search(query, k, weights, embedding=embedding, timings=timings)
+        if embedding is None and self.uses_vector(weights):
+            # Embed once for both the filtered and a possible unfiltered search
+            with timings.span('embed') if timings is not None else nullcontext():
+                embedding = self.vectorstore.embeddings.embed_query(query)
+
+        hits = [(doc, {**info, 'filtered': matches_filter(doc.metadata, filter)})
+                for doc, info in self.search(query, k, weights, embedding=embedding,
+                                             filter=filter, timings=timings, filter_lexical=False)]
+        if sum(info['filtered'] for _, info in hits) >= min_hits:
+            return hits
+        seen = {_identity(doc) for doc, _ in hits}
+        extra = [(doc, {**info, 'filtered': False, 'fallback': True})
+                 for doc, info in self.search(query, k, weights, embedding=embedding, timings=timings)
+                 if _identity(doc) not in seen]
+        return hits + extra[:k - len(hits)]
+
+    async def afiltered_search(self, query: str, k: int, weights: Dict[str, float],
+                               filter: Optional[Dict], min_hits: int,
+                               embedding: Optional[List[float]] = None,
+                               timings=None, limits=None) -> List[Tuple[Document, Dict]]:
+        """filtered_search() on an event loop (see asearch)"""
+        if not filter:
+            return await self.asearch(query, k, weights, embedding=embedding, timings=timings,
+                                      limits=limits)
+        if embedding is None and self.uses_vector(weights):
+            with timings.span('embed') if timings is not None else nullcontext():
+                async with limits.slot('embed') if limits is not None else nullcontext():
+                    embedding = await self.vectorstore.embeddings.aembed_query(query)
+
+        hits = [(doc, {**info, 'filtered': matches_filter(doc.metadata, filter)})
+                for doc, info in await self.asearch(query, k, weights, embedding=embedding,
+                                                    filter=filter, timings=timings, limits=limits,
+                                                    filter_lexical=False)]
+        if sum(info['filtered'] for _, info in hits) >= min_hits:
+            return hits
+        seen = {_identity(doc) for doc, _ in hits}
+        extra = [(doc, {**info, 'filtered': False, 'fallback': True})
+                 for doc, info in await self.asearch(query, k, weights, embedding=embedding,
+                                                     timings=timings, limits=limits)
+                 if _identity(doc) not in seen]
+        return hits + extra[:k - len(hits)]
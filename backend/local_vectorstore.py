@@ -0,0 +1,390 @@
+# local_vectorstore.py - In-process, memory-mapped vector backend
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+META_FILE = "meta.json"
+STORE_FORMAT = 1
+# Rows scored per matrix product, bounding the float32 copy of an int8 store
+SCORE_BLOCK_ROWS = 4096
+
+# ==========================================
+# METADATA FILTERS (Pinecone syntax)
+# ==========================================
+
+def _compare(value, op: str, operand) -> bool:
+    # Pinecone treats list-valued metadata as "any element matches"
+    if isinstance(value, list) and op in ('$eq', '$in'):
+        return any(_compare(v, op, operand) for v in value)
+    if isinstance(value, list) and op in ('$ne', '$nin'):
+        return all(_compare(v, op, operand) for v in value)
+    try:
+        if op == '$eq':
+            return value == operand
+        if op == '$ne':
+            return value != operand
+        if op == '$in':
+            return value in operand
+        if op == '$nin':
+            return value not in operand
+        if op == '$gt':
+            return value is not None and value > operand
+        if op == '$gte':
+            return value is not None and value >= operand
+        if op == '$lt':
+            return value is not None and value < operand
+        if op == '$lte':
+            return value is not None and value <= operand
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def matches_filter(metadata: Dict, filter: Optional[Dict]) -> bool:
+    """Evaluate a Pinecone-style metadata filter against one record"""
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == '$and':
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            if not all(_compare(value, op, operand) for op, operand in condition.items()):
+                return False
+        elif not _compare(metadata.get(key), '$eq', condition):
+            return False
+    return True
+
+# ==========================================
+# WRITER (used by the uploader)
+# ==========================================
+
+class _StoredRow(NamedTuple):
+    """A published row: normalized float32 values, or int8 codes and their scale"""
+    values: np.ndarray
+    scale: Optional[float]
+
+
+def _normalize_rows(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def _quantize_rows(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(int8 codes, float32 per-row scales) of normalized rows"""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class LocalVectorIndex:
+    """Pinecone-index-shaped writer for a local store directory
+
+    Accepts the same `upsert(vectors=[{'id', 'values', 'metadata'}])` and
+    `delete(ids=[...])` calls as a Pinecone index; `flush()` writes the
+    normalized matrix (float32, or int8 with per-row scales) and metadata.
+    Rows loaded from the published store keep their stored codes and
+    scales, so republishing them never re-quantizes (and drifts) them.
+    """
+
+    def __init__(self, path: str, quantize: bool = False, text_key: str = 'text'):
+        self.path = path
+        self.quantize = quantize
+        self.text_key = text_key
+        self.lock = threading.Lock()
+        self.records: Dict[str, Tuple[object, Dict]] = {}   # (values or _StoredRow, metadata)
+        self.dirty = False
+        self.generation = 0
+        os.makedirs(path, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        store = LocalVectorStore.open_arrays(self.path)
+        if store is None:
+            return
+        meta, matrix, scales = store
+        self.generation = meta.get('generation', 0)
+        for row, vector_id in enumerate(meta['ids']):
+            stored = _StoredRow(np.array(matrix[row]), float(scales[row]) if scales is not None else None)
+            metadata = {**meta['metadatas'][row], self.text_key: meta['texts'][row]}
+            self.records[vector_id] = (stored, metadata)
+
+    def upsert(self, vectors: List[Dict], namespace: Optional[str] = None):
+        with self.lock:
+            for vector in vectors:
+                self.records[vector['id']] = (vector['values'], vector.get('metadata') or {})
+            self.dirty = True
+        return {'upserted_count': len(vectors)}
+
+    def delete(self, ids: List[str], namespace: Optional[str] = None):
+        with self.lock:
+            for vector_id in ids:
+                self.records.pop(vector_id, None)
+            self.dirty = True
+        return {}
+
+    def describe_index_stats(self) -> Dict:
+        return {'total_vector_count': len(self.records)}
+
+    def _matrix(self, ids: List[str]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """(rows, scales) to publish: normalized float32 and None, or int8 codes and scales
+
+        Only rows upserted since the load (or stored in the other format)
+        are normalized and quantized; the rest are copied as stored.
+        """
+        first = self.records[ids[0]][0]
+        dimension = len(first.values) if isinstance(first, _StoredRow) else len(first)
+        matrix = np.empty((len(ids), dimension), dtype=np.int8 if self.quantize else np.float32)
+        scales = np.ones(len(ids), dtype=np.float32) if self.quantize else None
+
+        fresh_rows, fresh = [], []
+        for row, vector_id in enumerate(ids):
+            vector = self.records[vector_id][0]
+            if isinstance(vector, _StoredRow) and (vector.scale is not None) == self.quantize:
+                matrix[row] = vector.values
+                if self.quantize:
+                    scales[row] = vector.scale
+                continue
+            if isinstance(vector, _StoredRow):
+                # The store is switching between float32 and int8
+                vector = vector.values * vector.scale if vector.scale is not None else vector.values
+            fresh_rows.append(row)
+            fresh.append(vector)
+
+        if fresh:
+            values = _normalize_rows(fresh)
+            if self.quantize:
+                matrix[fresh_rows], scales[fresh_rows] = _quantize_rows(values)
+            else:
+                matrix[fresh_rows] = values
+            for row in fresh_rows:
+                vector_id = ids[row]
+                stored = _StoredRow(matrix[row].copy(), float(scales[row]) if self.quantize else None)
+                self.records[vector_id] = (stored, self.records[vector_id][1])
+        return matrix, scales
+
+    def flush(self):
+        """Atomically publish the current records; meta.json is the commit point"""
+        with self.lock:
+            if not self.dirty:
+                return
+            ids = sorted(self.records)
+            texts, metadatas = [], []
+            for vector_id in ids:
+                metadata = dict(self.records[vector_id][1])
+                texts.append(metadata.pop(self.text_key, ''))
+                metadatas.append(metadata)
+
+            if ids:
+                matrix, scales = self._matrix(ids)
+            else:
+                matrix, scales = np.zeros((0, 0), dtype=np.float32), None
+
+            # Never reuse a name: a reader may still have the old file mapped
+            self.generation += 1
+            stamp = f"{self.generation:06d}-{uuid.uuid4().hex[:8]}"
+            vectors_file = f"vectors-{stamp}.npy"
+            scales_file = None
+            np.save(os.path.join(self.path, vectors_file), matrix)
+            if scales is not None:
+                scales_file = f"scales-{stamp}.npy"
+                np.save(os.path.join(self.path, scales_file), scales)
+
+            meta = {
+                'format': STORE_FORMAT,
+                'generation': self.generation,
+                'dimension': int(matrix.shape[1]) if ids else 0,
+                'dtype': 'int8' if scales_file else 'float32',
+                'vectors_file': vectors_file,
+                'scales_file': scales_file,
+                'ids': ids,
+                'texts': texts,
+                'metadatas': metadatas,
+            }
+            meta_path = os.path.join(self.path, META_FILE)
+            previous = self._published_files(meta_path)
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.tmp', meta_path)
+
+            # A reader may have loaded the previous meta.json but not yet
+            # opened its arrays; those files go one publish later
+            keep = {META_FILE, vectors_file, scales_file} | previous
+            for name in os.listdir(self.path):
+                if name.endswith('.npy') and name not in keep:
+                    os.remove(os.path.join(self.path, name))
+            self.dirty = False
+
+    @staticmethod
+    def _published_files(meta_path: str) -> set:
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        return {meta.get('vectors_file'), meta.get('scales_file')} - {None}
+
+# ==========================================
+# READER (used by the chatbots)
+# ==========================================
+
+def _scores(matrix: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray,
+            rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """Cosine scores of `query` against `rows` of the matrix (all rows if None)
+
+    Rows are scored SCORE_BLOCK_ROWS at a time, so an int8 store is only
+    ever upcast one block at once instead of the whole memmapped matrix.
+    """
+    count = matrix.shape[0] if rows is None else rows.shape[0]
+    scores = np.empty(count, dtype=np.float32)
+    for start in range(0, count, SCORE_BLOCK_ROWS):
+        stop = min(start + SCORE_BLOCK_ROWS, count)
+        block = matrix[start:stop] if rows is None else matrix[rows[start:stop]]
+        scores[start:stop] = block.astype(np.float32, copy=False) @ query
+    if scales is not None:
+        scores *= scales if rows is None else scales[rows]
+    return scores
+
+
+class LocalVectorStore:
+    """Memory-mapped store with the `similarity_search(query, k)` contract
+
+    Scores are cosine similarities computed with blockwise matrix products
+    (see _scores); top-k uses argpartition. The files are re-opened when the
+    uploader publishes a new version.
+    """
+
+    def __init__(self, path: str, embedding, reload_interval: float = 5.0):
+        self.path = path
+        self.embeddings = embedding
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.meta_mtime = None
+        self.checked_at = 0.0
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict] = []
+        self.matrix = None
+        self.scales = None
+        self._maybe_reload(force=True)
+
+    @staticmethod
+    def open_arrays(path: str):
+        """(meta, matrix, scales) for the published store, or None if absent"""
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if not meta['ids']:
+            return meta, np.zeros((0, 0), dtype=np.float32), None
+        matrix = np.load(os.path.join(path, meta['vectors_file']), mmap_mode='r')
+        scales = None
+        if meta.get('scales_file'):
+            scales = np.load(os.path.join(path, meta['scales_file']), mmap_mode='r')
+        return meta, matrix, scales
+
+    def _maybe_reload(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.reload_interval:
+            return
+        self.checked_at = now
+        meta_path = os.path.join(self.path, META_FILE)
+        try:
+            mtime = os.stat(meta_path).st_mtime
+        except OSError:
+            return
+        if mtime == self.meta_mtime:
+            return
+        with self.lock:
+            opened = self.open_arrays(self.path)
+            if opened is None:
+                return
+            meta, self.matrix, self.scales = opened
+            self.ids = meta['ids']
+            self.texts = meta['texts']
+            self.metadatas = meta['metadatas']
+            self.meta_mtime = mtime
+
+    def __len__(self):
+        return len(self.ids)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        self._maybe_reload()
+        with self.lock:
+            matrix, scales = self.matrix, self.scales
+            ids, texts, metadatas = self.ids, self.texts, self.metadatas
+        if not ids:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        rows = None
+        if filter:
+            rows = np.fromiter(
+                (i for i, metadata in enumerate(metadatas) if matches_filter(metadata, filter)),
+                dtype=np.int64
+            )
+            if rows.size == 0:
+                return []
+        scores = _scores(matrix, scales, query, rows)
+
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for position in top:
+            row = int(rows[position]) if rows is not None else int(position)
+            document = Document(page_content=texts[row], metadata=dict(metadatas[row]))
+            results.append((document, float(scores[position])))
+        return results
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict] = None, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[Dict] = None, **kwargs) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4,
+                          filter: Optional[Dict] = None, **kwargs) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k, filter)
+
+# ==========================================
+# BACKEND SELECTION
+# ==========================================
+
+def build_vectorstore(backend: str, embedding, index_name: Optional[str] = None,
+                      pinecone_api_key: Optional[str] = None,
+                      local_path: Optional[str] = None, pool_threads: int = 1):
+    """Vector store for `backend` ('pinecone' or 'local'); both share one search contract"""
+    if backend == 'local':
+        return LocalVectorStore(local_path, embedding)
+    if backend == 'pinecone':
+        from pinecone import Pinecone
+        from langchain_pinecone import PineconeVectorStore
+        # One client and index handle per process; its connection pool is
+        # reused by every request instead of reconnecting per query
+        client = Pinecone(api_key=pinecone_api_key, pool_threads=pool_threads)
+        return PineconeVectorStore(
+            index=client.Index(index_name, pool_threads=pool_threads),
+            embedding=embedding
+        )
+    raise ValueError(f"Unknown vector backend: {backend}")
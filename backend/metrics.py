@@ -0,0 +1,337 @@
+# metrics.py - Per-request timing spans, counters and Prometheus text exposition
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; spans range from sub-millisecond lookups to multi-second generations
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+DOCUMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 10, 20)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# ==========================================
+# METRIC TYPES
+# ==========================================
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.values: Dict[Tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple, List] = {}     # labels -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][position] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count)
+                            in self.values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Collected:
+    """Values read from `collect()` at scrape time, e.g. cache or session stats"""
+
+    def __init__(self, name: str, help: str, kind: str, collect: Callable[[], Dict[Tuple, float]],
+                 labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.label_names = labels
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception:
+            return []
+        return [
+            f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+            for key, value in sorted(values.items()) if value is not None
+        ]
+
+# ==========================================
+# REGISTRY
+# ==========================================
+
+class MetricsRegistry:
+    """Named metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self, prefix: str = 'dgms_'):
+        self.prefix = prefix
+        self.metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(self.prefix + name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DURATION_BUCKETS) -> Histogram:
+        return self._add(Histogram(self.prefix + name, help, labels, buckets))
+
+    def collected(self, name: str, help: str, kind: str, collect: Callable[[], Dict[Tuple, float]],
+                  labels: Tuple[str, ...] = ()) -> Collected:
+        return self._add(Collected(self.prefix + name, help, kind, collect, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+# ==========================================
+# CHATBOT METRICS
+# ==========================================
+
+class ChatbotMetrics:
+    """The metrics both chatbots record, plus scrape-time views of their caches"""
+
+    def __init__(self, chatbot):
+        self.registry = MetricsRegistry()
+        r = self.registry
+        self.stage_seconds = r.histogram(
+            'stage_duration_seconds', "Time spent in each stage of answering a request", ('stage',))
+        self.requests = r.counter(
+            'requests_total', "Requests answered, by endpoint, route and outcome",
+            ('endpoint', 'route', 'outcome'))
+        self.errors = r.counter(
+            'errors_total', "Failed requests by exception class", ('endpoint', 'error'))
+        self.prompt_tokens = r.histogram(
+            'prompt_tokens', "Estimated prompt tokens per generation", buckets=TOKEN_BUCKETS)
+        self.prompt_chars = r.counter('prompt_characters_total', "Prompt characters sent to the model")
+        self.documents = r.histogram(
+            'documents_retrieved', "Documents returned per retrieval", buckets=DOCUMENT_BUCKETS)
+        self.tokens_dropped = r.counter(
+            'prompt_tokens_dropped_total', "Context tokens left out to fit the prompt budget")
+        self.filtered_searches = r.counter(
+            'filtered_searches_total', "Searches narrowed by entities in the query, by outcome "
+            "(filtered, or fallback when the filter matched too few documents)", ('outcome',))
+
+        def retrieval_cache():
+            stats = chatbot.retrieval_cache.stats()
+            return {(key,): stats[key] for key in ('hits', 'near_hits', 'misses', 'evictions',
+                                                   'expirations', 'invalidations')}
+
+        def embedding_cache():
+            stats = chatbot.embeddings.stats()
+            return {(key,): stats[key] for key in ('memory_hits', 'disk_hits', 'misses')}
+
+        r.collected('retrieval_cache_events_total', "Retrieval cache lookups and evictions",
+                    'counter', retrieval_cache, ('event',))
+        r.collected('retrieval_cache_hit_ratio', "Share of retrieval lookups served from cache",
+                    'gauge', lambda: {(): chatbot.retrieval_cache.stats()['hit_rate']})
+        r.collected('embedding_cache_events_total', "Embedding cache lookups by tier",
+                    'counter', embedding_cache, ('event',))
+        r.collected('embedding_cache_hit_ratio', "Share of embedding lookups served from cache",
+                    'gauge', lambda: {(): chatbot.embeddings.stats()['hit_rate']})
+        r.collected('sessions', "Conversation sessions held", 'gauge',
+                    lambda: {(): chatbot.sessions.stats()['sessions']})
+
+        def coalescing():
+            stats = chatbot.coalescer.stats()
+            return {(key,): stats[key] for key in ('leaders', 'collapsed', 'grace_hits', 'timeouts', 'errors')}
+
+        r.collected('coalesced_requests_total',
+                    "Single-flight outcomes: leaders computed, collapsed onto an in-flight call, "
+                    "grace-window reuses", 'counter', coalescing, ('event',))
+        r.collected('coalescing_in_flight', "Distinct computations currently in flight", 'gauge',
+                    lambda: {(): chatbot.coalescer.stats()['in_flight']})
+
+        def compaction():
+            stats = chatbot.compactor.stats()
+            return {(key,): stats[key] for key in ('compactions', 'conflicts', 'failures')}
+
+        r.collected('history_compactions_total',
+                    "Rolling-summary jobs: compactions applied, conflicts (superseded by a newer "
+                    "summary) and failures", 'counter', compaction, ('outcome',))
+        r.collected('history_turns_folded_total', "Conversation turns folded into summaries",
+                    'counter', lambda: {(): chatbot.compactor.stats()['turns_folded']})
+
+        def admission(key):
+            classes = chatbot.admission.stats()['classes']
+            return {(name,): stats[key] for name, stats in classes.items()}
+
+        def shed():
+            classes = chatbot.admission.stats()['classes']
+            return {(name, reason): count for name, stats in classes.items()
+                    for reason, count in stats['shed'].items()}
+
+        r.collected('admission_queue_depth', "Requests waiting for an admission slot, by class",
+                    'gauge', lambda: admission('queued'), ('class',))
+        r.collected('admission_in_flight', "Admitted requests being served, by class",
+                    'gauge', lambda: admission('in_flight'), ('class',))
+        r.collected('admission_admitted_total', "Requests admitted, by class",
+                    'counter', lambda: admission('admitted'), ('class',))
+        r.collected('requests_shed_total',
+                    "Requests turned away by admission control: queue_full (429), "
+                    "queue_timeout or deadline (503)", 'counter', shed, ('class', 'reason'))
+
+        def breaker():
+            stats = chatbot.breaker.stats()
+            return {(key,): stats[key] for key in ('successes', 'failures', 'rejected', 'opened')}
+
+        r.collected('circuit_breaker_events_total',
+                    "Generation circuit breaker: calls succeeded/failed, calls rejected while "
+                    "open, times opened", 'counter', breaker, ('event',))
+        r.collected('circuit_breaker_state', "1 for the generation circuit's current state",
+                    'gauge', lambda: {(state,): int(chatbot.breaker.stats()['state'] == state)
+                                      for state in ('closed', 'open', 'half_open')}, ('state',))
+        self.degraded = r.counter(
+            'degraded_answers_total', "Chat answers built from retrieval only, by reason "
+            "(circuit_open, deadline, upstream_error)", ('reason',))
+
+    def timings(self) -> 'RequestTimings':
+        return RequestTimings(self.stage_seconds)
+
+    def record_request(self, endpoint: str, route: Optional[str],
+                       error: Optional[BaseException] = None, cancelled: bool = False):
+        """Count a finished request by outcome and, if it failed, by exception class"""
+        outcome = 'error' if error is not None else 'cancelled' if cancelled else 'success'
+        self.requests.inc(endpoint, route or 'unknown', outcome)
+        if error is not None:
+            self.errors.inc(endpoint, type(error).__name__)
+
+    def record_degraded(self, reason: str):
+        self.degraded.inc(reason)
+
+    def record_prompt(self, prompt: str, prompt_usage: Optional[Dict]):
+        self.prompt_chars.inc(amount=len(prompt))
+        if prompt_usage:
+            self.prompt_tokens.observe(prompt_usage['tokens_used'])
+            self.tokens_dropped.inc(amount=prompt_usage['tokens_dropped'])
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+def timings_requested(request, default: bool = False) -> bool:
+    """Whether the client asked for the per-request timings block (body or ?timings=1)"""
+    body = request.get_json(silent=True)
+    value = body.get('timings') if isinstance(body, dict) else None
+    if value is None:
+        value = request.args.get('timings')
+    if value is None:
+        return default
+    return value is True or str(value).lower() in ('1', 'true', 'yes')
+
+# ==========================================
+# REQUEST TIMINGS
+# ==========================================
+
+class _Span:
+    __slots__ = ('timings', 'stage', 'started')
+
+    def __init__(self, timings: 'RequestTimings', stage: str):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class RequestTimings:
+    """Stage durations of one request, also fed to the stage histogram
+
+    Spans may close on other threads (e.g. the parallel vector search);
+    each stage key is written by one thread, so no lock is needed.
+    """
+
+    def __init__(self, histogram: Optional[Histogram] = None):
+        self.histogram = histogram
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def span(self, stage: str) -> _Span:
+        return _Span(self, stage)
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        if self.histogram is not None:
+            self.histogram.observe(seconds, stage)
+
+    def finish(self) -> Dict[str, float]:
+        """Close the request: record 'total' and return all stages in milliseconds"""
+        if 'total' not in self.stages:
+            self.add('total', time.perf_counter() - self.started)
+        return self.as_dict()
+
+    def as_dict(self) -> Dict[str, float]:
+        return {f"{stage}_ms": round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
@@ -1,13 +1,21 @@
 # data_uploader.py
 import os
 import json
-import glob
-from typing import List, Dict
+import argparse
+from typing import Iterator, List, Dict, Optional
 from pinecone import Pinecone, ServerlessSpec
 import google.generativeai as genai
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_pinecone import PineconeVectorStore
 from langchain.docstore.document import Document
+from statement_chunker import StatementChunker, DEFAULT_TOKEN_BUDGET
+from statement_loader import LoadedFile, StreamingLoader, discover_json_files, normalize_chunk
+from ingest_manifest import IngestManifest
+from ingest_pipeline import IngestionPipeline, PipelineStats
+from fakes import FakeEmbeddings, FakeIndex
+from embedding_cache import build_cached_embeddings
+from local_vectorstore import LocalVectorIndex
+from lexical_index import LexicalIndexWriter
 
 # ==========================================
 # CONFIGURATION
@@ -19,61 +27,155 @@ class Config:
     PINECONE_INDEX_NAME = "accident-datasets"
     PINECONE_ENVIRONMENT = "us-east-1"
     DATASETS_FOLDER = "./datasets"
+    CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+    # Processes parsing/chunking files ahead of the embedder (1 parses in-process)
+    LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", min(4, os.cpu_count() or 1)))
+    # Files parsed ahead of the embedder at most; bounds loader memory (0 = 2 per worker)
+    LOAD_MAX_IN_FLIGHT = int(os.getenv("LOAD_MAX_IN_FLIGHT", 0))
+    # "pinecone" or "local" (memory-mapped NumPy store read by the chatbots)
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+    LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "./local_index")
+    LOCAL_VECTOR_QUANTIZE = os.getenv("LOCAL_VECTOR_QUANTIZE", "false").lower() == "true"
+    CHECKPOINT_PATH = os.getenv("INGEST_CHECKPOINT_PATH", "./ingest_checkpoint.jsonl")
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 32))
+    EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", 4))
+    UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", 100))
+    EMBED_REQUESTS_PER_SECOND = float(os.getenv("EMBED_REQUESTS_PER_SECOND", 5))
+    MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", 6))
+    EMBEDDING_MODEL = "models/embedding-001"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3")
+    EMBEDDING_CACHE_DISK_ENTRIES = int(os.getenv("EMBEDDING_CACHE_DISK_ENTRIES", 200000))
+    # BM25 index over the same chunks, read by the chatbots for hybrid search ("" disables)
+    LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "./lexical_index")
+
+
+def manifest_path(backend: str) -> str:
+    """Each backend tracks its own contents; the local manifest lives beside the store"""
+    if backend == "local":
+        return os.getenv("INGEST_MANIFEST_PATH", os.path.join(Config.LOCAL_VECTOR_STORE_PATH, "manifest.json"))
+    return os.getenv("INGEST_MANIFEST_PATH", "./ingest_manifest.json")
+
+
+def build_embeddings(gemini_key: str):
+    """Gemini embeddings behind the on-disk cache shared with the chatbot"""
+    return build_cached_embeddings(
+        GoogleGenerativeAIEmbeddings(
+            model=Config.EMBEDDING_MODEL,
+            google_api_key=gemini_key
+        ),
+        model=Config.EMBEDDING_MODEL,
+        disk_path=Config.EMBEDDING_CACHE_PATH,
+        disk_entries=Config.EMBEDDING_CACHE_DISK_ENTRIES
+    )
+
+
+def build_pipeline(embeddings, index, chunker: StatementChunker, manifest: IngestManifest,
+                   force: bool = False, checkpoint_path: Optional[str] = None,
+                   requests_per_second: Optional[float] = None,
+                   lexical_index: Optional[LexicalIndexWriter] = None) -> IngestionPipeline:
+    """Batched, rate-limited load/chunk/embed/upsert pipeline into `index`"""
+    return IngestionPipeline(
+        embeddings=embeddings,
+        index=index,
+        chunker=chunker,
+        manifest=manifest,
+        checkpoint_path=checkpoint_path,
+        embed_batch_size=Config.EMBED_BATCH_SIZE,
+        embed_workers=Config.EMBED_WORKERS,
+        upsert_batch_size=Config.UPSERT_BATCH_SIZE,
+        requests_per_second=(Config.EMBED_REQUESTS_PER_SECOND
+                             if requests_per_second is None else requests_per_second),
+        max_retries=Config.MAX_RETRIES,
+        force=force,
+        lexical_index=lexical_index
+    )
 
 # ==========================================
 # SIMPLE JSON UPLOADER
 # ==========================================
 
 class SimpleJsonUploader:
-    """Upload raw JSON to Pinecone without processing"""
+    """Upload DGMS statement JSON to Pinecone as compact row-level chunks
+    
+    Files are discovered recursively (one folder per year is fine) and named
+    by their path relative to the datasets folder. `iter_loaded_files` and
+    `iter_documents` stream chunks from a process pool; a file that cannot
+    be parsed or chunked is reported in `errors` and skipped.
+    """
     
-    def __init__(self, datasets_folder: str = "~/hazard-indicator/datasets"):
+    def __init__(self, datasets_folder: str = "~/hazard-indicator/datasets",
+                 token_budget: int = DEFAULT_TOKEN_BUDGET, workers: int = 1,
+                 max_in_flight: Optional[int] = None):
         self.datasets_folder = datasets_folder
+        self.chunker = StatementChunker(token_budget=token_budget)
+        self.loader = StreamingLoader(token_budget, workers=workers, max_in_flight=max_in_flight)
+        self.errors: List[str] = []
+    
+    def list_json_files(self) -> List[str]:
+        """Paths of all statement files, in a stable order"""
+        return [path for path, _ in discover_json_files(self.datasets_folder)]
+    
+    def iter_loaded_files(self) -> Iterator[LoadedFile]:
+        """Chunks of each file as its worker finishes, in file order"""
+        for loaded in self.loader.iter_files(discover_json_files(self.datasets_folder)):
+            if loaded.error:
+                self.errors.append(loaded.error)
+            yield loaded
+    
+    def iter_documents(self) -> Iterator[Document]:
+        """One Document per row group, streamed without holding the corpus in memory"""
+        for loaded in self.iter_loaded_files():
+            if loaded.error:
+                print(f"  ❌ {loaded.error}")
+                continue
+            for content, metadata in loaded.chunks:
+                yield Document(page_content=content, metadata=metadata)
+            print(f"  Created {len(loaded.chunks)} chunks for {loaded.source}")
     
     def load_all_json_files(self) -> List[Dict]:
-        """Load all JSON files as-is"""
+        """Load all JSON files as-is, skipping (and reporting) unreadable ones"""
         all_jsons = []
         
-        json_files = glob.glob(os.path.join(self.datasets_folder, "*.json"))
+        json_files = discover_json_files(self.datasets_folder)
         
         print(f"Found {len(json_files)} JSON files\n")
         
-        for file_path in json_files:
-            filename = os.path.basename(file_path)
+        for file_path, filename in json_files:
             print(f"Loading: {filename}")
             
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                all_jsons.append({
-                    'filename': filename,
-                    'data': data
-                })
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                self.errors.append(f"{filename}: {e}")
+                print(f"  ❌ {filename}: {e}")
+                continue
+            all_jsons.append({
+                'filename': filename,
+                'data': data
+            })
         
         return all_jsons
     
     def convert_to_documents(self, json_files: List[Dict]) -> List[Document]:
-        """Convert raw JSON to Document objects for Pinecone"""
+        """Convert each statement into one Document per row group"""
         documents = []
-        doc_id = 0
         
         for item in json_files:
             filename = item['filename']
-            data = item['data']
-            
-            # Convert entire JSON to string
-            json_str = json.dumps(data, indent=2)
-            
-            metadata = {
-                'source_file': filename,
-                'doc_id': doc_id,
-                'raw_json': True
-            }
+            try:
+                chunks = self.chunker.chunk(filename, item['data'])
+            except Exception as e:
+                self.errors.append(f"{filename}: chunking failed: {e}")
+                print(f"  ❌ {filename}: chunking failed: {e}")
+                continue
             
-            # Create a single document per JSON file
-            documents.append(Document(page_content=json_str, metadata=metadata))
-            doc_id += 1
+            for chunk in chunks:
+                # Stable ID so re-uploads replace vectors instead of duplicating them
+                content, metadata = normalize_chunk(filename, chunk)
+                documents.append(Document(page_content=content, metadata=metadata))
             
-            print(f"  Created document for {filename}")
+            print(f"  Created {len(chunks)} chunks for {filename}")
         
         return documents
 
@@ -86,11 +188,10 @@ class PineconeUploader:
     
     def __init__(self, api_key: str, index_name: str, gemini_key: str):
         self.pc = Pinecone(api_key=api_key)
+        self.api_key = api_key
         self.index_name = index_name
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            google_api_key=gemini_key
-        )
+        # Shares its on-disk cache with the chatbot, so unchanged text is never re-embedded
+        self.embeddings = build_embeddings(gemini_key)
     
     def create_index(self, dimension=768):
         """Create Pinecone index if it doesn't exist"""
@@ -112,58 +213,119 @@ class PineconeUploader:
             print(f"✓ Index {self.index_name} already exists\n")
     
     def upload_documents(self, documents: List[Document]):
-        """Upload documents to Pinecone"""
+        """Upload documents to Pinecone under their doc_id"""
         print(f"Uploading {len(documents)} documents to Pinecone...\n")
         
         vectorstore = PineconeVectorStore.from_documents(
             documents=documents,
             embedding=self.embeddings,
-            index_name=self.index_name
+            index_name=self.index_name,
+            ids=[doc.metadata['doc_id'] for doc in documents]
         )
         
         print(f"✓ Successfully uploaded {len(documents)} documents!\n")
         return vectorstore
+    
+    def build_pipeline(self, chunker: StatementChunker, manifest: IngestManifest,
+                       force: bool = False,
+                       lexical_index: Optional[LexicalIndexWriter] = None) -> IngestionPipeline:
+        """Ingestion pipeline into this Pinecone index"""
+        return build_pipeline(
+            self.embeddings,
+            self.pc.Index(self.index_name),
+            chunker,
+            manifest,
+            force=force,
+            checkpoint_path=Config.CHECKPOINT_PATH,
+            lexical_index=lexical_index
+        )
 
 # ==========================================
 # MAIN UPLOAD SCRIPT
 # ==========================================
 
-def upload_raw_json():
-    """Upload raw JSON files to Pinecone"""
+def upload_raw_json(dry_run: bool = False, force: bool = False, fake: bool = False,
+                    backend: Optional[str] = None,
+                    workers: Optional[int] = None) -> Optional[PipelineStats]:
+    """Incrementally sync raw JSON chunks to Pinecone or the local store"""
+    backend = backend or Config.VECTOR_BACKEND
+    workers = Config.LOAD_WORKERS if workers is None else workers
     
     print("=" * 60)
-    print("Simple JSON Upload to Pinecone")
+    print(f"Simple JSON Upload ({'fake' if fake else backend})")
     print("=" * 60 + "\n")
     
-    # Load JSON files
-    uploader = SimpleJsonUploader(Config.DATASETS_FOLDER)
-    json_files = uploader.load_all_json_files()
-    print()
+    uploader = SimpleJsonUploader(Config.DATASETS_FOLDER, Config.CHUNK_TOKEN_BUDGET,
+                                  workers=workers, max_in_flight=Config.LOAD_MAX_IN_FLIGHT or None)
+    json_paths = uploader.list_json_files()
+    print(f"Found {len(json_paths)} JSON files ({workers} loader process{'es' if workers != 1 else ''})\n")
     
-    if not json_files:
+    if not json_paths:
         print("❌ No JSON files found in datasets folder!")
         return None
     
-    # Convert to documents
-    documents = uploader.convert_to_documents(json_files)
-    print()
+    # Offline runs use in-memory stand-ins and never touch the real manifest
+    manifest = IngestManifest(None if fake else manifest_path(backend))
     
-    # Upload to Pinecone
-    pinecone_uploader = PineconeUploader(
-        Config.PINECONE_API_KEY,
-        Config.PINECONE_INDEX_NAME,
-        Config.GEMINI_API_KEY
-    )
-    pinecone_uploader.create_index()
-    vectorstore = pinecone_uploader.upload_documents(documents)
+    if dry_run:
+        plan = manifest.plan(uploader.iter_documents(), force=force)
+        print()
+        plan.report()
+        if uploader.errors:
+            # A real run keeps the vectors of files it could not read
+            print(f"\n❌ {len(uploader.errors)} file(s) failed; deletions would be skipped")
+        print("\nDry run: no changes applied")
+        return None
+    
+    # The BM25 index is rebuilt from every chunk of a real run, whatever the vector backend
+    lexical_index = None
+    if Config.LEXICAL_INDEX_PATH and not fake:
+        lexical_index = LexicalIndexWriter(Config.LEXICAL_INDEX_PATH)
+    
+    if fake:
+        pipeline = build_pipeline(FakeEmbeddings(), FakeIndex(), uploader.chunker, manifest,
+                                  force=force, requests_per_second=0)
+    elif backend == "local":
+        index = LocalVectorIndex(Config.LOCAL_VECTOR_STORE_PATH, quantize=Config.LOCAL_VECTOR_QUANTIZE)
+        pipeline = build_pipeline(build_embeddings(Config.GEMINI_API_KEY), index, uploader.chunker,
+                                  manifest, force=force, checkpoint_path=Config.CHECKPOINT_PATH,
+                                  lexical_index=lexical_index)
+    else:
+        pinecone_uploader = PineconeUploader(
+            Config.PINECONE_API_KEY,
+            Config.PINECONE_INDEX_NAME,
+            Config.GEMINI_API_KEY
+        )
+        pinecone_uploader.create_index()
+        pipeline = pinecone_uploader.build_pipeline(uploader.chunker, manifest, force=force,
+                                                    lexical_index=lexical_index)
+    
+    # Files are parsed and chunked in worker processes while earlier ones embed
+    stats = pipeline.run_stream(uploader.iter_loaded_files())
+    print()
+    stats.report()
     
     print("=" * 60)
-    print("✓ Upload Complete!")
+    print(f"✓ Upload Complete! (index version {manifest.index_version})")
     print("=" * 60)
-    return vectorstore
+    return stats
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload DGMS statements to Pinecone")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report what would be embedded/deleted without touching the index")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-embed every chunk even if its content hash is unchanged")
+    parser.add_argument("--fake", action="store_true",
+                        help="Run the pipeline offline against a fake embedder and index")
+    parser.add_argument("--backend", choices=["pinecone", "local"], default=None,
+                        help="Vector backend to write (default: VECTOR_BACKEND)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes parsing and chunking files (default: LOAD_WORKERS)")
+    args = parser.parse_args()
+    
     # Configure Gemini
     genai.configure(api_key=Config.GEMINI_API_KEY)
     # Run upload
-    upload_raw_json()
+    upload_raw_json(dry_run=args.dry_run, force=args.force, fake=args.fake, backend=args.backend,
+                    workers=args.workers)
@@ -0,0 +1,294 @@
+# prompt_assembler.py - Token-budgeted, compact rendering of retrieved context
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+from statement_chunker import KEY_FIELDS, compact_json, estimate_tokens
+
+ENCODINGS = ('auto', 'table', 'json')
+
+TABLE_LEGEND = (
+    "Tables list their columns once, then one row per line with values "
+    "separated by ' | '; nested fields use dotted column names."
+)
+
+# ==========================================
+# ENCODINGS
+# ==========================================
+
+def flatten_row(row: Dict, prefix: str = '') -> Dict:
+    """Nested dicts become dotted columns; lists stay as compact JSON cells"""
+    flat = {}
+    for key, value in row.items():
+        column = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            flat.update(flatten_row(value, column + '.'))
+        else:
+            flat[column] = value
+    return flat
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        value = compact_json(value)
+    return str(value).replace('|', '/')
+
+
+def encode_table(rows: List[Dict]) -> Tuple[str, List[str]]:
+    """Key-factored encoding: (header line, one line per row)"""
+    flat_rows = [flatten_row(row) for row in rows]
+    columns = list(dict.fromkeys(column for flat in flat_rows for column in flat))
+    header = "columns: " + ' | '.join(columns)
+    lines = [' | '.join(_cell(flat.get(column)) for column in columns) for flat in flat_rows]
+    return header, lines
+
+
+def encode_json(rows: List[Dict]) -> Tuple[str, List[str]]:
+    """Minified encoding: one JSON object per line"""
+    return '', [compact_json(row) for row in rows]
+
+# ==========================================
+# QUERY-AWARE ROW PRUNING
+# ==========================================
+
+def _row_terms(row: Dict) -> List[str]:
+    terms = []
+    for key in KEY_FIELDS:
+        value = row.get(key)
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            continue
+        value = ' '.join(str(value).lower().split())
+        if len(value) >= 3:
+            terms.append(value)
+    return terms
+
+
+def row_match_score(row: Dict, query: str) -> int:
+    """How many identifying values of a row (mineral, state, year, ...) the query mentions"""
+    score = 0
+    for term in _row_terms(row):
+        if re.search(r'(?<!\w)' + re.escape(term) + r'(?!\w)', query):
+            score += 1
+    return score
+
+
+def prune_rows(rows: List[Dict], query: str) -> Tuple[List[Dict], List[Dict]]:
+    """Keep the rows that best match the query; (kept rows, pruned rows)
+
+    Rows are only pruned when at least one of them matches, so documents
+    retrieved for unrelated reasons (e.g. a code lookup) pass through whole.
+    """
+    normalized = ' '.join(query.lower().split())
+    scores = [row_match_score(row, normalized) for row in rows if isinstance(row, dict)]
+    if len(scores) != len(rows) or not scores or max(scores) == 0:
+        return rows, []
+    best = max(scores)
+    kept = [row for row, score in zip(rows, scores) if score == best]
+    pruned = [row for row, score in zip(rows, scores) if score != best]
+    return kept, pruned
+
+# ==========================================
+# ASSEMBLER
+# ==========================================
+
+class PromptAssembler:
+    """Fit retrieved documents and history into a fixed token budget
+
+    Documents are rendered in rank order. Duplicate chunks and rows are
+    skipped, rows not about the asked mineral/state/year are pruned, and
+    rows that no longer fit the budget are dropped. A rolling summary of
+    older turns gets its own budget ahead of the recent turns. `assemble`
+    returns the context and history text plus an accounting of tokens used
+    and dropped.
+    """
+
+    def __init__(self, context_budget: int = 3000, history_budget: int = 600,
+                 history_turns: int = 3, encoding: str = 'auto', summary_budget: int = 300):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown prompt encoding: {encoding}")
+        self.context_budget = context_budget
+        self.history_budget = history_budget
+        self.history_turns = history_turns
+        self.encoding = encoding
+        self.summary_budget = summary_budget
+
+    @staticmethod
+    def _parse(content):
+        if isinstance(content, str):
+            try:
+                return json.loads(content)
+            except ValueError:
+                return content
+        return content
+
+    def _encode(self, rows: List[Dict]) -> Tuple[str, List[str]]:
+        if self.encoding == 'json':
+            return encode_json(rows)
+        table = encode_table(rows)
+        if self.encoding == 'table':
+            return table
+        minified = encode_json(rows)
+        table_tokens = estimate_tokens(table[0] + '\n'.join(table[1]))
+        json_tokens = estimate_tokens('\n'.join(minified[1]))
+        return table if table_tokens < json_tokens else minified
+
+    def _render_document(self, label: str, content, query: str, remaining: int,
+                         seen_rows: set, stats: Dict) -> Optional[str]:
+        """Render one document within `remaining` tokens, or None if nothing fits"""
+        header_lines = [label]
+
+        if not (isinstance(content, dict) and isinstance(content.get('rows'), list)):
+            # Free text, or JSON without a row table: truncate to the budget
+            text = content if isinstance(content, str) else compact_json(content)
+            tokens = estimate_tokens(text)
+            budget = remaining - estimate_tokens(label)
+            if budget <= 0:
+                stats['tokens_dropped'] += tokens
+                return None
+            if tokens > budget:
+                stats['tokens_dropped'] += tokens - budget
+                text = text[:budget * 4]
+            return label + '\n' + text
+
+        rows = []
+        for row in content['rows']:
+            key = compact_json(row)
+            if key in seen_rows:
+                stats['rows_deduplicated'] += 1
+                stats['tokens_dropped'] += estimate_tokens(key)
+                continue
+            rows.append(row)
+        if not rows:
+            return None
+
+        kept, pruned = prune_rows(rows, query)
+        stats['rows_pruned'] += len(pruned)
+        stats['tokens_dropped'] += sum(estimate_tokens(compact_json(row)) for row in pruned)
+
+        context = content.get('context')
+        if context:
+            header_lines.append("context: " + compact_json(context))
+        table_header, lines = self._encode(kept)
+        if table_header:
+            header_lines.append(table_header)
+
+        used = estimate_tokens('\n'.join(header_lines))
+        if used >= remaining:
+            stats['rows_dropped'] += len(kept)
+            stats['tokens_dropped'] += sum(estimate_tokens(line) for line in lines)
+            return None
+
+        included = []
+        for row, line in zip(kept, lines):
+            cost = estimate_tokens(line) + 1   # + newline
+            if used + cost > remaining:
+                stats['rows_dropped'] += 1
+                stats['tokens_dropped'] += cost
+                continue
+            used += cost
+            included.append(line)
+            seen_rows.add(compact_json(row))
+        if not included:
+            return None
+
+        stats['rows_included'] += len(included)
+        if table_header:
+            stats['tables'] += 1
+        return '\n'.join(header_lines + included)
+
+    def _render_summary(self, summary: Optional[Dict], stats: Dict) -> str:
+        if not summary or not summary.get('text'):
+            return ''
+        text = summary['text']
+        tokens = estimate_tokens(text)
+        if tokens > self.summary_budget:
+            stats['tokens_dropped'] += tokens - self.summary_budget
+            text = text[:self.summary_budget * 4]
+        stats['summary_tokens'] = estimate_tokens(text)
+        return f"Summary of the {summary.get('turns', 0)} earlier turns: {text}"
+
+    def _render_history(self, history: Optional[List[Dict]], stats: Dict) -> str:
+        if not history:
+            return ''
+        turns = []
+        used = 0
+        for position, turn in enumerate(reversed(history)):
+            text = f"User: {turn['user']}\nAssistant: {turn['assistant']}"
+            tokens = estimate_tokens(text)
+            if position >= self.history_turns or used + tokens > self.history_budget:
+                if position < self.history_turns:
+                    stats['tokens_dropped'] += tokens
+                continue
+            used += tokens
+            turns.append(text)
+        stats['history_tokens'] = used
+        stats['history_turns'] = len(turns)
+        return "\n".join(reversed(turns))
+
+    def assemble(self, query: str, documents: List[Dict],
+                 history: Optional[List[Dict]] = None,
+                 label: str = "[Data from {source}]",
+                 summary: Optional[Dict] = None) -> Tuple[str, str, Dict]:
+        """(context text, history text, accounting) for one request
+
+        `documents` are retrieval results with 'content' (parsed JSON or a
+        string) and optional 'source'/'metadata'; `label` is formatted with
+        `n` (1-based rank) and `source`. `summary` is the session's rolling
+        summary ('text', 'turns'), rendered before the recent turns.
+        """
+        stats = {
+            'budget': self.context_budget + self.history_budget + self.summary_budget,
+            'context_tokens': 0,
+            'history_tokens': 0,
+            'history_turns': 0,
+            'summary_tokens': 0,
+            'tokens_used': 0,
+            'tokens_dropped': 0,
+            'documents': len(documents),
+            'documents_included': 0,
+            'documents_deduplicated': 0,
+            'rows_included': 0,
+            'rows_pruned': 0,
+            'rows_deduplicated': 0,
+            'rows_dropped': 0,
+            'tables': 0,
+        }
+
+        blocks = []
+        seen_documents = set()
+        seen_rows = set()
+        remaining = self.context_budget - estimate_tokens(TABLE_LEGEND)
+        for doc in documents:
+            content = self._parse(doc.get('content'))
+            metadata = doc.get('metadata') or {}
+            identity = metadata.get('doc_id') or hashlib.sha256(
+                (content if isinstance(content, str) else compact_json(content)).encode('utf-8')
+            ).hexdigest()
+            if identity in seen_documents:
+                stats['documents_deduplicated'] += 1
+                continue
+            seen_documents.add(identity)
+
+            source = doc.get('source') or metadata.get('source_file', 'Unknown')
+            block = self._render_document(
+                label.format(n=len(blocks) + 1, source=source),
+                content, query, remaining, seen_rows, stats
+            )
+            if block is None:
+                continue
+            blocks.append(block)
+            remaining -= estimate_tokens(block) + 1
+
+        if stats['tables']:
+            blocks.insert(0, TABLE_LEGEND)
+        context_text = "\n\n".join(blocks)
+        history_text = '\n'.join(filter(None, (self._render_summary(summary, stats),
+                                                self._render_history(history, stats))))
+
+        stats['documents_included'] = len(blocks) - (1 if stats['tables'] else 0)
+        stats['context_tokens'] = estimate_tokens(context_text) if context_text else 0
+        stats['tokens_used'] = stats['context_tokens'] + stats['history_tokens'] + stats['summary_tokens']
+        return context_text, history_text, stats
@@ -0,0 +1,321 @@
+# response_encoding.py - Fast JSON / MessagePack serialization, compression and payload shaping
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from flask.json.provider import DefaultJSONProvider
+
+from batching import document_id
+
+try:
+    import orjson
+except ImportError:  # the standard library encoder is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # JSON only
+    msgpack = None
+
+JSON_TYPE = 'application/json'
+MSGPACK_TYPE = 'application/msgpack'
+MSGPACK_TYPES = (MSGPACK_TYPE, 'application/x-msgpack', 'application/vnd.msgpack')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+# Top-level keys kept whatever `fields` asks for
+ALWAYS_FIELDS = ('success', 'error')
+
+# ==========================================
+# SERIALIZATION
+# ==========================================
+
+def _default(value):
+    """numpy values, sets, and whatever Flask's encoder handles (dates, decimals, dataclasses)"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return DefaultJSONProvider.default(value)
+
+
+def dumps(value, indent: bool = False) -> bytes:
+    """Compact UTF-8 JSON, via orjson when installed"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(value, default=_default, option=option)
+    return json.dumps(value, ensure_ascii=False, default=_default,
+                      indent=2 if indent else None,
+                      separators=None if indent else (',', ':')).encode('utf-8')
+
+
+def packb(value) -> bytes:
+    return msgpack.packb(value, default=_default, use_bin_type=True)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider (jsonify, request.json) backed by orjson when installed"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        if orjson is None or set(kwargs) - {'separators', 'indent'}:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, indent=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+# ==========================================
+# NEGOTIATION
+# ==========================================
+
+def parse_quality(header: Optional[str]) -> Dict[str, float]:
+    """{token: q} from an Accept or Accept-Encoding header"""
+    accepted = {}
+    for part in (header or '').split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[token] = max(quality, accepted.get(token, 0.0))
+    return accepted
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """'msgpack' when the client asks for it at least as strongly as JSON, else 'json'"""
+    if msgpack is None or not accept:
+        return 'json'
+    accepted = parse_quality(accept)
+    wanted = max((accepted.get(media, 0.0) for media in MSGPACK_TYPES), default=0.0)
+    if wanted <= 0:
+        return 'json'
+    json_quality = accepted.get(JSON_TYPE, accepted.get('application/*', 0.0))
+    return 'msgpack' if wanted >= json_quality else 'json'
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """'br', 'gzip' or None (identity), preferring brotli at equal quality"""
+    if not accept_encoding:
+        return None
+    accepted = parse_quality(accept_encoding)
+    wildcard = accepted.get('*', 0.0)
+    choices = (['br'] if brotli is not None else []) + ['gzip']
+    best, best_quality = None, 0.0
+    for encoding in choices:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+# ==========================================
+# ENCODER
+# ==========================================
+
+class ResponseEncoder:
+    """Serialize a payload for one request and compress bodies worth compressing
+
+    The format follows Accept (MessagePack or JSON) and the compression
+    Accept-Encoding (brotli or gzip). Bodies under `min_bytes` go out
+    as-is: the framing costs more than it saves.
+    """
+
+    def __init__(self, compression: bool = True, min_bytes: int = 1024, gzip_level: int = 6,
+                 brotli_quality: int = 4, allow_msgpack: bool = True):
+        self.compression = compression
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.allow_msgpack = allow_msgpack and msgpack is not None
+        self.lock = threading.Lock()
+        self.counters = {'json': 0, 'msgpack': 0, 'br': 0, 'gzip': 0, 'identity': 0,
+                         'bytes_in': 0, 'bytes_out': 0}
+        self.seconds = {'serialize': 0.0, 'compress': 0.0}
+
+    def serialize(self, payload, accept: Optional[str] = None) -> Tuple[bytes, str]:
+        """(body, content type)"""
+        started = time.perf_counter()
+        fmt = negotiate_format(accept) if self.allow_msgpack else 'json'
+        body = packb(payload) if fmt == 'msgpack' else dumps(payload)
+        with self.lock:
+            self.counters[fmt] += 1
+            self.seconds['serialize'] += time.perf_counter() - started
+        return body, MSGPACK_TYPE if fmt == 'msgpack' else JSON_TYPE
+
+    def compress(self, body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """(body, Content-Encoding or None)"""
+        encoding = negotiate_encoding(accept_encoding) if self.compression else None
+        if encoding is None or len(body) < self.min_bytes:
+            encoding, compressed = None, body
+        else:
+            started = time.perf_counter()
+            if encoding == 'br':
+                compressed = brotli.compress(body, quality=self.brotli_quality)
+            else:
+                compressed = gzip.compress(body, compresslevel=self.gzip_level)
+            with self.lock:
+                self.seconds['compress'] += time.perf_counter() - started
+        with self.lock:
+            self.counters[encoding or 'identity'] += 1
+            self.counters['bytes_in'] += len(body)
+            self.counters['bytes_out'] += len(compressed)
+        return compressed, encoding
+
+    def encode(self, payload, accept: Optional[str] = None,
+               accept_encoding: Optional[str] = None) -> Tuple[bytes, Dict[str, str]]:
+        """(body, headers) for a payload: serialized, then compressed if asked for"""
+        body, content_type = self.serialize(payload, accept)
+        headers = {'Content-Type': content_type, 'Vary': 'Accept, Accept-Encoding'}
+        body, encoding = self.compress(body, accept_encoding)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return body, headers
+
+    def compress_response(self, response, accept_encoding: Optional[str]):
+        """Compress a finished Flask response in place (after_request); streams are left alone"""
+        if (not self.compression or response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype == 'text/event-stream'):
+            return response
+        response.vary.add('Accept-Encoding')
+        body, encoding = self.compress(response.get_data(), accept_encoding)
+        if encoding:
+            response.set_data(body)
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    def stats(self) -> Dict:
+        with self.lock:
+            saved = self.counters['bytes_in'] - self.counters['bytes_out']
+            return {
+                **self.counters,
+                'bytes_saved': saved,
+                'serialize_seconds': round(self.seconds['serialize'], 3),
+                'compress_seconds': round(self.seconds['compress'], 3),
+                'orjson_enabled': orjson is not None,
+                'brotli_enabled': brotli is not None,
+                'msgpack_enabled': self.allow_msgpack,
+            }
+
+# ==========================================
+# PAYLOAD SHAPING
+# ==========================================
+
+def _is_false(value) -> bool:
+    return value is False or (isinstance(value, str) and value.strip().lower() in FALSE_VALUES)
+
+
+def response_options(request, data: Optional[Dict] = None) -> Tuple[Optional[Set[str]], bool]:
+    """(top-level fields to keep or None for all, whether to inline sources)
+
+    Read from the query string (?fields=answer,session_id&include_sources=false)
+    or the JSON body ("fields": [...], "include_sources": false).
+    """
+    data = data if isinstance(data, dict) else {}
+    fields = request.args.get('fields') or data.get('fields')
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',')]
+    if fields is not None and not (isinstance(fields, list)
+                                   and all(isinstance(field, str) for field in fields)):
+        raise ValueError("'fields' must be a comma-separated string or a list of strings")
+    include = request.args.get('include_sources', data.get('include_sources', True))
+    return ({field for field in fields if field} or None) if fields else None, not _is_false(include)
+
+
+def select_fields(payload: Dict, fields: Optional[Set[str]]) -> Dict:
+    if not fields:
+        return payload
+    return {key: value for key, value in payload.items() if key in fields or key in ALWAYS_FIELDS}
+
+
+class SourceRegistry:
+    """Source documents sent by reference, resolvable by ID (GET /api/sources/<id>)
+
+    Documents referenced by recent responses are kept in a bounded LRU;
+    other IDs fall back to `resolve` (e.g. the BM25 index, which holds
+    every ingested chunk), so a reference outlives the LRU entry.
+    """
+
+    def __init__(self, entries: int = 4096, resolve: Optional[Callable[[str], Optional[Dict]]] = None):
+        self.entries = entries
+        self.resolve = resolve
+        self.documents: 'OrderedDict[str, Dict]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'registered': 0, 'hits': 0, 'resolved': 0, 'misses': 0}
+
+    def register(self, documents: Dict[str, Dict]):
+        with self.lock:
+            for doc_id, document in documents.items():
+                self.documents[doc_id] = document
+                self.documents.move_to_end(doc_id)
+                self.counters['registered'] += 1
+            while len(self.documents) > self.entries:
+                self.documents.popitem(last=False)
+
+    def references(self, sources: Iterable[Dict]) -> List[Dict]:
+        """ID references (with source name and per-query retrieval info) for `sources`"""
+        references, documents = [], {}
+        for source in sources:
+            doc_id = document_id(source)
+            documents[doc_id] = {key: value for key, value in source.items() if key != 'retrieval'}
+            reference = {'id': doc_id,
+                         'source': source.get('source') or (source.get('metadata') or {}).get('source_file')}
+            if 'retrieval' in source:
+                reference['retrieval'] = source['retrieval']
+            references.append(reference)
+        self.register(documents)
+        return references
+
+    def get(self, doc_id: str) -> Optional[Dict]:
+        with self.lock:
+            document = self.documents.get(doc_id)
+            if document is not None:
+                self.documents.move_to_end(doc_id)
+                self.counters['hits'] += 1
+                return document
+        document = self.resolve(doc_id) if self.resolve is not None else None
+        with self.lock:
+            self.counters['resolved' if document is not None else 'misses'] += 1
+        return document
+
+    def shape(self, payload: Dict, field: Optional[str], fields: Optional[Set[str]] = None,
+              include_sources: bool = True) -> Dict:
+        """Apply `fields` and `include_sources` to a response holding sources under `field`
+
+        Without sources, the `field` list becomes ID references and a batch's
+        shared 'documents' map is dropped (its items already hold references).
+        """
+        if not include_sources:
+            payload = dict(payload)
+            if field and isinstance(payload.get(field), list):
+                payload[field] = self.references(payload[field])
+            if isinstance(payload.get('documents'), dict):
+                self.register(payload.pop('documents'))
+        return select_fields(payload, fields)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {**self.counters, 'cached': len(self.documents), 'capacity': self.entries}
+
+
+def content_etag(document: Dict) -> str:
+    """Strong ETag of a document's content, independent of the negotiated format"""
+    return f'"{hashlib.sha256(dumps(document)).hexdigest()[:24]}"'
@@ -0,0 +1,254 @@
+# retrieval_cache.py - TTL + LRU cache of vector-search results
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query"""
+    return ' '.join(query.lower().split())
+
+
+def _unit(embedding: List[float]) -> Optional[np.ndarray]:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+class _Entry:
+    __slots__ = ('results', 'row', 'expires_at', 'scope')
+
+    def __init__(self, results, row, expires_at, scope):
+        self.results = results
+        self.row = row              # row in RetrievalCache.matrix, or None
+        self.expires_at = expires_at
+        self.scope = scope
+
+
+class RetrievalCache:
+    """Bounded TTL + LRU cache keyed by (normalized query, k, filters, mode, index version)
+
+    With `similarity_threshold` set, an exact miss falls back to the cached
+    entry whose query embedding is closest (cosine >= threshold) within the
+    same k/filters/mode. `mode` distinguishes result sets computed
+    differently for the same query, e.g. different hybrid weights.
+
+    Everything is dropped when `version_source()` changes, i.e. when the
+    uploader has bumped the index version, and a result computed against an
+    older version than the current one is not stored. Cached results are
+    shared between callers and must be treated as read-only.
+
+    Query embeddings live normalized in one preallocated matrix (a row per
+    entry), so a near-duplicate lookup is a single matrix-vector product.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0,
+                 similarity_threshold: Optional[float] = None,
+                 version_source: Optional[Callable[[], int]] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version_source = version_source or (lambda: 0)
+        self.version = None
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        # Allocated on the first embedding, once the dimension is known
+        self.matrix: Optional[np.ndarray] = None
+        self.row_keys: List = [None] * max_entries
+        self.row_scopes = np.zeros(max_entries, dtype=np.int64)
+        self.row_expires = np.full(max_entries, -np.inf)
+        self.free_rows = list(range(max_entries - 1, -1, -1))
+        self.counters = {
+            'hits': 0, 'near_hits': 0, 'misses': 0,
+            'evictions': 0, 'expirations': 0, 'invalidations': 0, 'stale_puts': 0,
+        }
+
+    def _scope(self, k: int, filters: Optional[Dict], mode: str = '') -> str:
+        return f"{mode}|{k}|{json.dumps(filters, sort_keys=True, default=str) if filters else ''}"
+
+    def _check_version(self):
+        """Drop everything if the index changed since the entries were cached"""
+        version = self.version_source()
+        if version != self.version:
+            if self.entries:
+                self.counters['invalidations'] += 1
+            self._clear()
+            self.version = version
+
+    def _clear(self):
+        self.entries.clear()
+        self.row_keys = [None] * self.max_entries
+        self.row_expires.fill(-np.inf)
+        self.free_rows = list(range(self.max_entries - 1, -1, -1))
+
+    def _store_row(self, key, scope: str, embedding: Optional[List[float]],
+                   expires_at: float) -> Optional[int]:
+        if embedding is None or not self.free_rows:
+            return None
+        vector = _unit(embedding)
+        if vector is None:
+            return None
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+        elif vector.shape[0] != self.matrix.shape[1]:
+            return None
+        row = self.free_rows.pop()
+        self.matrix[row] = vector
+        self.row_keys[row] = key
+        self.row_scopes[row] = hash(scope)
+        self.row_expires[row] = expires_at
+        return row
+
+    def _release(self, entry: _Entry):
+        if entry.row is not None:
+            self.row_keys[entry.row] = None
+            self.row_expires[entry.row] = -np.inf
+            self.free_rows.append(entry.row)
+
+    def _get_exact(self, key, now: float):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < now:
+            del self.entries[key]
+            self._release(entry)
+            self.counters['expirations'] += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _get_similar(self, scope: str, embedding: List[float], now: float):
+        if self.matrix is None or not self.entries:
+            return None
+        query = _unit(embedding)
+        if query is None or query.shape[0] != self.matrix.shape[1]:
+            return None
+        scores = self.matrix @ query
+        # Free rows carry -inf expiry, so this also masks them out
+        scores[(self.row_scopes != hash(scope)) | (self.row_expires < now)] = -np.inf
+        row = int(np.argmax(scores))
+        if scores[row] < self.similarity_threshold:
+            return None
+        key = self.row_keys[row]
+        entry = self.entries.get(key)
+        if entry is None or entry.scope != scope:
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, query: str, k: int, results, filters: Optional[Dict] = None,
+            embedding: Optional[List[float]] = None, mode: str = '',
+            version: Optional[int] = None):
+        """Cache `results`; with `version` (read before the search), only if the index is unchanged"""
+        scope = self._scope(k, filters, mode)
+        key = (normalize_query(query), scope)
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self.lock:
+            self._check_version()
+            if version is not None and version != self.version:
+                # The index changed mid-search; the results may predate it
+                self.counters['stale_puts'] += 1
+                return
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self._release(previous)
+            if self.max_entries <= 0:
+                return
+            while len(self.entries) >= self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                self._release(evicted)
+                self.counters['evictions'] += 1
+            row = self._store_row(key, scope, embedding, expires_at)
+            self.entries[key] = _Entry(results, row, expires_at, scope)
+
+    def get_or_compute(self, query: str, k: int, compute: Callable,
+                       filters: Optional[Dict] = None,
+                       embed: Optional[Callable[[str], List[float]]] = None,
+                       mode: str = ''):
+        """Return cached results, or `compute(embedding)` and cache them
+
+        `embed` is only called (and its result passed to `compute`, so the
+        search need not embed again) when near-duplicate matching is on.
+        """
+        scope = self._scope(k, filters, mode)
+        key = (normalize_query(query), scope)
+        now = time.monotonic()
+
+        entry, version = self._lookup(key, now)
+        if entry is not None:
+            return entry.results
+
+        embedding = None
+        if self.similarity_threshold and embed is not None:
+            embedding = embed(query)
+            entry = self._lookup_similar(scope, embedding, now)
+            if entry is not None:
+                return entry.results
+
+        with self.lock:
+            self.counters['misses'] += 1
+        results = compute(embedding)
+        self.put(query, k, results, filters=filters, embedding=embedding, mode=mode, version=version)
+        return results
+
+    async def aget_or_compute(self, query: str, k: int, compute: Callable[..., Awaitable],
+                              filters: Optional[Dict] = None,
+                              embed: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+                              mode: str = ''):
+        """get_or_compute with coroutine functions for `compute` and `embed`"""
+        scope = self._scope(k, filters, mode)
+        key = (normalize_query(query), scope)
+        now = time.monotonic()
+
+        entry, version = self._lookup(key, now)
+        if entry is not None:
+            return entry.results
+
+        embedding = None
+        if self.similarity_threshold and embed is not None:
+            embedding = await embed(query)
+            entry = self._lookup_similar(scope, embedding, now)
+            if entry is not None:
+                return entry.results
+
+        with self.lock:
+            self.counters['misses'] += 1
+        results = await compute(embedding)
+        self.put(query, k, results, filters=filters, embedding=embedding, mode=mode, version=version)
+        return results
+
+    def _lookup(self, key, now: float) -> Tuple[Optional[_Entry], int]:
+        """(exact entry or None, index version the lookup saw)"""
+        with self.lock:
+            self._check_version()
+            entry = self._get_exact(key, now)
+            if entry is not None:
+                self.counters['hits'] += 1
+            return entry, self.version
+
+    def _lookup_similar(self, scope: str, embedding: List[float], now: float) -> Optional[_Entry]:
+        with self.lock:
+            entry = self._get_similar(scope, embedding, now)
+            if entry is not None:
+                self.counters['near_hits'] += 1
+            return entry
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            counters = dict(self.counters)
+            entries = len(self.entries)
+        lookups = counters['hits'] + counters['near_hits'] + counters['misses']
+        return {
+            **counters,
+            'hit_rate': round((counters['hits'] + counters['near_hits']) / lookups, 4) if lookups else 0.0,
+            'entries': entries,
+            'index_version': self.version,
+        }
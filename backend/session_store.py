@@ -0,0 +1,365 @@
+# session_store.py - Per-session, bounded conversation history
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+SESSION_HEADER = 'X-Session-ID'
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.:-]{1,128}$')
+
+
+def session_id_from_request(request) -> Tuple[str, bool]:
+    """Session ID from the X-Session-ID header, JSON body or query string
+
+    Returns (session_id, is_new); a fresh ID is minted when the client sent
+    none (or an invalid one), and should be echoed back to the client.
+    """
+    body = request.get_json(silent=True) or {}
+    candidate = (
+        request.headers.get(SESSION_HEADER)
+        or (body.get('session_id') if isinstance(body, dict) else None)
+        or request.args.get('session_id')
+    )
+    if isinstance(candidate, str) and SESSION_ID_PATTERN.match(candidate):
+        return candidate, False
+    return uuid.uuid4().hex, True
+
+
+class SessionStore(ABC):
+    """Interface: a ring buffer of turns per session, with LRU + idle-TTL eviction
+
+    Turns carry a per-session increasing sequence number. Older turns can be
+    folded into a rolling summary with `compact`, which stores the summary
+    and drops the turns it covers.
+    """
+
+    @abstractmethod
+    def get_history(self, session_id: str) -> List[Dict]:
+        """Stored turns of one session, oldest first"""
+
+    @abstractmethod
+    def get_conversation(self, session_id: str) -> Tuple[Optional[Dict], List[Dict]]:
+        """(rolling summary or None, stored turns) of one session"""
+
+    @abstractmethod
+    def get_page(self, session_id: str, before: Optional[int] = None,
+                 limit: int = 50) -> Tuple[List[Dict], int]:
+        """(up to `limit` turns older than seq `before`, oldest first, each with its 'seq';
+        number of turns stored)"""
+
+    @abstractmethod
+    def append(self, session_id: str, turn: Dict) -> int:
+        """Add a turn; returns the number of turns now stored for the session"""
+
+    @abstractmethod
+    def compact(self, session_id: str, summary: Dict, base_seq: int) -> bool:
+        """Store `summary` and drop the turns up to summary['through_seq']
+
+        Only applied if the session still exists and its current summary ends
+        at `base_seq` (0 for none), so a stale compaction never overwrites a
+        newer one.
+        """
+
+    @abstractmethod
+    def clear(self, session_id: str) -> int:
+        """Forget a session; returns the number of turns left (0)"""
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        """Session, turn and eviction counts for the health endpoint"""
+
+# ==========================================
+# IN-PROCESS BACKEND
+# ==========================================
+
+class MemorySessionStore(SessionStore):
+    """Sessions in a dict; only suitable for a single worker process"""
+
+    def __init__(self, max_turns: int = 20, max_sessions: int = 10000,
+                 idle_ttl: float = 3600.0):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        # id -> [deque of (seq, turn), last_seen, summary, last seq]
+        self.sessions: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.evicted = 0
+
+    def _evict(self, now: float):
+        # Oldest-touched sessions sit at the front
+        while self.sessions:
+            session_id, entry = next(iter(self.sessions.items()))
+            if len(self.sessions) > self.max_sessions or now - entry[1] > self.idle_ttl:
+                del self.sessions[session_id]
+                self.evicted += 1
+            else:
+                break
+
+    def _touch(self, session_id: str, now: float, create: bool):
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            if not create:
+                return None
+            entry = [deque(maxlen=self.max_turns), now, None, 0]
+            self.sessions[session_id] = entry
+        entry[1] = now
+        self.sessions.move_to_end(session_id)
+        return entry
+
+    def get_history(self, session_id: str) -> List[Dict]:
+        now = time.time()
+        with self.lock:
+            self._evict(now)
+            entry = self._touch(session_id, now, create=False)
+            return [turn for _, turn in entry[0]] if entry else []
+
+    def get_conversation(self, session_id: str) -> Tuple[Optional[Dict], List[Dict]]:
+        now = time.time()
+        with self.lock:
+            self._evict(now)
+            entry = self._touch(session_id, now, create=False)
+            if entry is None:
+                return None, []
+            return entry[2], [turn for _, turn in entry[0]]
+
+    def get_page(self, session_id: str, before: Optional[int] = None,
+                 limit: int = 50) -> Tuple[List[Dict], int]:
+        now = time.time()
+        with self.lock:
+            self._evict(now)
+            entry = self._touch(session_id, now, create=False)
+            if entry is None:
+                return [], 0
+            older = [(seq, turn) for seq, turn in entry[0] if before is None or seq < before]
+            return [{'seq': seq, **turn} for seq, turn in older[-limit:]], len(entry[0])
+
+    def append(self, session_id: str, turn: Dict) -> int:
+        now = time.time()
+        with self.lock:
+            # Drop an idle-expired session first rather than reviving it
+            self._evict(now)
+            entry = self._touch(session_id, now, create=True)
+            entry[3] += 1
+            entry[0].append((entry[3], turn))
+            self._evict(now)
+            return len(entry[0])
+
+    def compact(self, session_id: str, summary: Dict, base_seq: int) -> bool:
+        with self.lock:
+            self._evict(time.time())
+            entry = self.sessions.get(session_id)
+            current = (entry[2] or {}).get('through_seq', 0) if entry else None
+            if current != base_seq:
+                return False
+            through = summary['through_seq']
+            entry[0] = deque(((seq, turn) for seq, turn in entry[0] if seq > through),
+                             maxlen=self.max_turns)
+            entry[2] = summary
+            return True
+
+    def clear(self, session_id: str) -> int:
+        with self.lock:
+            self.sessions.pop(session_id, None)
+        return 0
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'backend': 'memory',
+                'sessions': len(self.sessions),
+                'turns': sum(len(entry[0]) for entry in self.sessions.values()),
+                'summaries': sum(1 for entry in self.sessions.values() if entry[2] is not None),
+                'evicted': self.evicted,
+            }
+
+# ==========================================
+# SQLITE BACKEND (shared by several workers)
+# ==========================================
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a local SQLite file so every gunicorn worker sees them"""
+
+    def __init__(self, path: str, max_turns: int = 20, max_sessions: int = 10000,
+                 idle_ttl: float = 3600.0, evict_interval: float = 60.0):
+        self.path = path
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.evict_interval = evict_interval
+        self.evicted_at = 0.0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, last_seen REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_sessions_last_seen ON sessions(last_seen);"
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " session_id TEXT NOT NULL, seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " turn TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_turns_session ON turns(session_id, seq);"
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " session_id TEXT PRIMARY KEY, through_seq INTEGER NOT NULL, summary TEXT NOT NULL);"
+        )
+        self.conn.commit()
+
+    def _maybe_evict(self, now: float):
+        if now - self.evicted_at < self.evict_interval:
+            return
+        self.evicted_at = now
+        stale = [row[0] for row in self.conn.execute(
+            "SELECT id FROM sessions WHERE last_seen < ?", (now - self.idle_ttl,)
+        )]
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        overflow = count - len(stale) - self.max_sessions
+        if overflow > 0:
+            stale += [row[0] for row in self.conn.execute(
+                "SELECT id FROM sessions WHERE last_seen >= ? ORDER BY last_seen ASC LIMIT ?",
+                (now - self.idle_ttl, overflow)
+            )]
+        for session_id in stale:
+            self._delete(session_id)
+        self.evicted += len(stale)
+
+    def _delete(self, session_id: str):
+        self.conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+        self.conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+        self.conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _expire(self, session_id: str, now: float) -> bool:
+        """Delete the session if it is idle-expired but not evicted yet; True if it was"""
+        row = self.conn.execute(
+            "SELECT last_seen FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None or now - row[0] <= self.idle_ttl:
+            return False
+        self._delete(session_id)
+        self.evicted += 1
+        return True
+
+    def _touch(self, session_id: str, now: float) -> bool:
+        """Refresh last_seen of a live session; False if it is unknown or idle-expired"""
+        row = self.conn.execute(
+            "SELECT last_seen FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None or now - row[0] > self.idle_ttl:
+            return False
+        self.conn.execute("UPDATE sessions SET last_seen = ? WHERE id = ?", (now, session_id))
+        self.conn.commit()
+        return True
+
+    def get_history(self, session_id: str) -> List[Dict]:
+        return self.get_conversation(session_id)[1]
+
+    def get_conversation(self, session_id: str) -> Tuple[Optional[Dict], List[Dict]]:
+        now = time.time()
+        with self.lock:
+            if not self._touch(session_id, now):
+                return None, []
+            summary = self.conn.execute(
+                "SELECT summary FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            rows = self.conn.execute(
+                "SELECT turn FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+        return (json.loads(summary[0]) if summary else None,
+                [json.loads(turn) for (turn,) in rows])
+
+    def get_page(self, session_id: str, before: Optional[int] = None,
+                 limit: int = 50) -> Tuple[List[Dict], int]:
+        now = time.time()
+        with self.lock:
+            if not self._touch(session_id, now):
+                return [], 0
+            rows = self.conn.execute(
+                "SELECT seq, turn FROM turns WHERE session_id = ? AND seq < ?"
+                " ORDER BY seq DESC LIMIT ?",
+                (session_id, before if before is not None else 2 ** 63 - 1, limit)
+            ).fetchall()
+            (total,) = self.conn.execute(
+                "SELECT COUNT(*) FROM turns WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return [{'seq': seq, **json.loads(turn)} for seq, turn in reversed(rows)], total
+
+    def append(self, session_id: str, turn: Dict) -> int:
+        now = time.time()
+        with self.lock:
+            # An expired session starts over instead of being revived by the upsert
+            self._expire(session_id, now)
+            self.conn.execute(
+                "INSERT INTO sessions (id, last_seen) VALUES (?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET last_seen = excluded.last_seen",
+                (session_id, now)
+            )
+            self.conn.execute(
+                "INSERT INTO turns (session_id, turn) VALUES (?, ?)",
+                (session_id, json.dumps(turn))
+            )
+            # Ring buffer: keep only the newest max_turns
+            self.conn.execute(
+                "DELETE FROM turns WHERE session_id = ? AND seq NOT IN ("
+                " SELECT seq FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?)",
+                (session_id, session_id, self.max_turns)
+            )
+            (stored,) = self.conn.execute(
+                "SELECT COUNT(*) FROM turns WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            self._maybe_evict(now)
+            self.conn.commit()
+        return stored
+
+    def compact(self, session_id: str, summary: Dict, base_seq: int) -> bool:
+        with self.lock:
+            if self._expire(session_id, time.time()):
+                self.conn.commit()
+                return False
+            if self.conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is None:
+                return False
+            row = self.conn.execute(
+                "SELECT through_seq FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if (row[0] if row else 0) != base_seq:
+                return False
+            self.conn.execute(
+                "INSERT INTO summaries (session_id, through_seq, summary) VALUES (?, ?, ?)"
+                " ON CONFLICT(session_id) DO UPDATE SET"
+                " through_seq = excluded.through_seq, summary = excluded.summary",
+                (session_id, summary['through_seq'], json.dumps(summary))
+            )
+            self.conn.execute(
+                "DELETE FROM turns WHERE session_id = ? AND seq <= ?",
+                (session_id, summary['through_seq'])
+            )
+            self.conn.commit()
+        return True
+
+    def clear(self, session_id: str) -> int:
+        with self.lock:
+            self._delete(session_id)
+            self.conn.commit()
+        return 0
+
+    def stats(self) -> Dict:
+        with self.lock:
+            (sessions,) = self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()
+            (turns,) = self.conn.execute("SELECT COUNT(*) FROM turns").fetchone()
+            (summaries,) = self.conn.execute("SELECT COUNT(*) FROM summaries").fetchone()
+        return {'backend': 'sqlite', 'sessions': sessions, 'turns': turns,
+                'summaries': summaries, 'evicted': self.evicted}
+
+
+def build_session_store(backend: str, path: Optional[str] = None, max_turns: int = 20,
+                        max_sessions: int = 10000, idle_ttl: float = 3600.0) -> SessionStore:
+    """Session store for `backend` ('memory' or 'sqlite')"""
+    if backend == 'sqlite':
+        return SQLiteSessionStore(path, max_turns, max_sessions, idle_ttl)
+    if backend == 'memory':
+        return MemorySessionStore(max_turns, max_sessions, idle_ttl)
+    raise ValueError(f"Unknown session backend: {backend}")
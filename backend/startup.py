@@ -0,0 +1,120 @@
+# startup.py - Background initialization, warm-up and readiness for the chatbot apps
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+STARTING = 'starting'
+WARMING = 'warming'
+READY = 'ready'
+FAILED = 'failed'
+
+
+def parse_queries(spec: str) -> List[str]:
+    """"roof fall|gas explosion" -> ['roof fall', 'gas explosion']"""
+    return [query.strip() for query in spec.split('|') if query.strip()]
+
+
+class BackgroundStartup:
+    """Build a component off the import path, warm it up, and report readiness
+
+    States go starting -> warming -> ready. A build that raises is retried
+    with exponential backoff (state 'failed' until an attempt succeeds), so
+    an unreachable upstream delays readiness instead of crashing the worker.
+    A failed warm-up is reported but does not hold readiness back.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], object],
+                 warm_up: Optional[Callable[[object], Dict]] = None,
+                 on_ready: Optional[Callable[[object], None]] = None,
+                 retry_seconds: float = 2.0, max_retry_seconds: float = 60.0,
+                 retry_after: int = 5):
+        self.name = name
+        self.factory = factory
+        self.warm_up = warm_up
+        self.on_ready = on_ready
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.retry_after_seconds = retry_after
+        self.component = None
+        self.state = STARTING
+        self.attempts = 0
+        self.error: Optional[str] = None
+        self.next_attempt_at: Optional[float] = None
+        self.warmup_report: Optional[Dict] = None
+        self.timings: Dict[str, float] = {}
+        self.started = time.monotonic()
+        self.ready_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self, background: bool = True) -> 'BackgroundStartup':
+        """Initialize on a daemon thread, or inline (blocking) when `background` is False"""
+        if background:
+            self.thread = threading.Thread(target=self._run, name=f'{self.name}-startup', daemon=True)
+            self.thread.start()
+        else:
+            self._run()
+        return self
+
+    def _run(self):
+        delay = self.retry_seconds
+        while True:
+            self.state = STARTING
+            self.next_attempt_at = None
+            self.attempts += 1
+            started = time.perf_counter()
+            try:
+                component = self.factory()
+                break
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                self.state = FAILED
+                self.next_attempt_at = time.monotonic() + delay
+                print(f"⚠️ {self.name} initialization failed (attempt {self.attempts}): {self.error}; "
+                      f"retrying in {delay:g}s")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_seconds)
+        self.timings['init_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        self.error = None
+
+        if self.warm_up is not None:
+            self.state = WARMING
+            started = time.perf_counter()
+            try:
+                self.warmup_report = self.warm_up(component)
+            except Exception as e:
+                self.warmup_report = {'error': f"{type(e).__name__}: {e}"}
+                print(f"⚠️ {self.name} warm-up failed: {self.warmup_report['error']}")
+            self.timings['warmup_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+        self.component = component
+        if self.on_ready is not None:
+            self.on_ready(component)
+        self.timings['ready_after_ms'] = round((time.monotonic() - self.started) * 1000, 1)
+        self.state = READY
+        self.ready_event.set()
+        print(f"✓ {self.name} ready in {self.timings['ready_after_ms'] / 1000:.1f}s")
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.ready_event.wait(timeout)
+
+    def retry_after(self) -> int:
+        """Seconds a client should wait before retrying (Retry-After header)"""
+        if self.next_attempt_at is not None:
+            return max(1, math.ceil(self.next_attempt_at - time.monotonic()))
+        return self.retry_after_seconds
+
+    def status(self) -> Dict:
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'attempts': self.attempts,
+            'error': self.error,
+            'uptime_seconds': round(time.monotonic() - self.started, 1),
+            'timings': dict(self.timings),
+            'warmup': self.warmup_report,
+        }
@@ -0,0 +1,381 @@
+# statement_chunker.py - Schema-aware chunking of DGMS statement files
+import json
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from entities import entity_metadata
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+DEFAULT_TOKEN_BUDGET = 400
+CHARS_PER_TOKEN = 4
+
+# Fields that identify a row and are carried as chunk metadata
+KEY_FIELDS = (
+    'mineral', 'mineral_name', 'name', 'label', 'year', 'cause',
+    'cause_of_accident', 'category', 'subcategory', 'code', 'state',
+    'state_name', 'district', 'district_name', 'region_zone', 'mine_name',
+    'accident_date', 'date', 'date_of_accident', 'location', 'section',
+    'responsibility_major_cause_group', 'mineral_or_cause',
+)
+
+# File-level scalar fields that give every chunk its context
+CONTEXT_FIELDS = ('title', 'report_title', 'description', 'mine_type', 'year')
+
+# Extraction artifacts that carry no accident data
+IGNORED_FIELDS = ('run_id', 'extraction_agent_id', 'extraction_metadata')
+
+STATEMENT_PATTERN = re.compile(r'statement[\s_]*(?:no\.?\s*)?(\d+)[._](\d+[a-z]?)', re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token)"""
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def compact_json(data) -> str:
+    """Serialize without indentation or separator whitespace"""
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+def statement_number(filename: str) -> Optional[str]:
+    """Extract the statement number ("4.6a") from a dataset filename"""
+    match = STATEMENT_PATTERN.search(filename)
+    if not match:
+        return None
+    return f"{match.group(1)}.{match.group(2).lower()}"
+
+
+def _clean(value):
+    """Drop nulls and collapse whitespace so rows serialize compactly"""
+    if isinstance(value, dict):
+        cleaned = {k: _clean(v) for k, v in value.items() if v is not None}
+        return {k: v for k, v in cleaned.items() if v not in ({}, [])}
+    if isinstance(value, list):
+        return [_clean(v) for v in value if v is not None]
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    return value
+
+
+def _truncate(value, room: int) -> str:
+    """`value` as text cut to at most `room` characters once JSON-encoded, ending in '…'"""
+    text = value if isinstance(value, str) else compact_json(value)
+    keep = max(room - 3, 0)
+    while keep > 0 and len(compact_json(text[:keep] + '…')) > room:
+        keep -= max(1, len(compact_json(text[:keep] + '…')) - room)
+    return text[:keep] + '…' if keep > 0 else ''
+
+
+def _row_keys(row: Dict) -> Dict:
+    """Scalar identifying fields of a row"""
+    return {
+        key: row[key] for key in KEY_FIELDS
+        if key in row and isinstance(row[key], (str, int, float)) and not isinstance(row[key], bool)
+    }
+
+# ==========================================
+# STATEMENT ADAPTERS
+# ==========================================
+# Each adapter recognises one statement shape and yields (section, row)
+# pairs, one per logical row of the table.
+
+Rows = Iterator[Tuple[str, Dict]]
+
+
+def _payload(data) -> Dict:
+    """Statement body: most files wrap their tables in a 'data' object"""
+    if isinstance(data, dict) and isinstance(data.get('data'), dict):
+        return data['data']
+    return data if isinstance(data, dict) else {}
+
+
+def _summary_rows(payload: Dict, skip: Tuple[str, ...]) -> Rows:
+    """Totals and summaries that sit beside the main table"""
+    for key, value in payload.items():
+        if key in skip or key in IGNORED_FIELDS or key in CONTEXT_FIELDS:
+            continue
+        if isinstance(value, dict):
+            yield key, {'section': key, **value}
+        elif isinstance(value, list) and value and all(isinstance(v, dict) for v in value):
+            for item in value:
+                yield key, item
+
+
+class StatementAdapter:
+    """Base adapter: a named table inside the statement payload"""
+
+    name = ''
+    table = ''
+
+    def matches(self, data) -> bool:
+        return isinstance(_payload(data).get(self.table), list)
+
+    def rows(self, data) -> Rows:
+        payload = _payload(data)
+        for row in payload[self.table]:
+            if isinstance(row, dict):
+                yield self.table, row
+        yield from _summary_rows(payload, skip=(self.table,))
+
+
+class MineralDataAdapter(StatementAdapter):
+    """Statement 4.1: one row per mineral and year"""
+    name = 'mineral_data'
+    table = 'mineral_data'
+
+
+class AccidentCausesAdapter(StatementAdapter):
+    """Statements 4.3-4.5: one row per cause with yearly "accidents (killed)" cells"""
+    name = 'accident_causes'
+    table = 'accident_causes'
+
+    def rows(self, data) -> Rows:
+        payload = _payload(data)
+        for row in payload[self.table]:
+            yield self.table, row
+        if isinstance(payload.get('total'), dict):
+            yield 'total', {'cause': 'TOTAL', **payload['total']}
+        for location, values in (payload.get('location_summary') or {}).items():
+            if isinstance(values, dict):
+                yield 'location_summary', {'location': location, **values}
+
+
+class RecordsAdapter(StatementAdapter):
+    """Statement 4.6a: one row per mineral, state and district"""
+    name = 'records'
+    table = 'records'
+
+
+class InquiryRecordsAdapter(StatementAdapter):
+    """Statement 4.11: one row per court of inquiry"""
+    name = 'inquiry_records'
+    table = 'inquiry_records'
+
+
+class TopLevelArrayAdapter(StatementAdapter):
+    """Statement 4.12: bare top-level array of accident records"""
+    name = 'top_level_array'
+
+    def matches(self, data) -> bool:
+        return isinstance(data, list)
+
+    def rows(self, data) -> Rows:
+        for row in data:
+            if isinstance(row, dict):
+                yield 'records', row
+
+
+class CodeDictionaryAdapter(StatementAdapter):
+    """Statement 4.0: nested dictionary of cause and place codes"""
+    name = 'code_dictionary'
+
+    def matches(self, data) -> bool:
+        return isinstance(data, dict) and 'data' not in data and any(
+            isinstance(v, dict) and self._is_code_tree(v) for v in data.values()
+        )
+
+    def _is_code_tree(self, node) -> bool:
+        if isinstance(node, str):
+            return True
+        return isinstance(node, dict) and bool(node) and all(self._is_code_tree(v) for v in node.values())
+
+    def rows(self, data) -> Rows:
+        for section, tree in data.items():
+            yield from self._walk(section, [], tree)
+
+    def _walk(self, section: str, path: List[str], node) -> Rows:
+        for key, value in node.items():
+            if isinstance(value, dict):
+                yield from self._walk(section, path + [key], value)
+            else:
+                yield section, {
+                    'section': section,
+                    'category': ' / '.join(path) if path else section,
+                    'code': key,
+                    'description': value,
+                }
+
+
+class GenericTableAdapter(StatementAdapter):
+    """Fallback: every list of objects in the payload is a table"""
+    name = 'generic'
+
+    def matches(self, data) -> bool:
+        return True
+
+    def rows(self, data) -> Rows:
+        payload = _payload(data)
+        tables = tuple(
+            key for key, value in payload.items()
+            if isinstance(value, list) and value and all(isinstance(v, dict) for v in value)
+        )
+        for table in tables:
+            for row in payload[table]:
+                yield table, row
+        yield from _summary_rows(payload, skip=tables)
+
+
+ADAPTERS = [
+    MineralDataAdapter(),
+    AccidentCausesAdapter(),
+    RecordsAdapter(),
+    InquiryRecordsAdapter(),
+    TopLevelArrayAdapter(),
+    CodeDictionaryAdapter(),
+    GenericTableAdapter(),
+]
+
+
+def select_adapter(data) -> StatementAdapter:
+    """First adapter that recognises the statement shape"""
+    for adapter in ADAPTERS:
+        if adapter.matches(data):
+            return adapter
+    return ADAPTERS[-1]
+
+# ==========================================
+# CHUNKER
+# ==========================================
+
+class StatementChunker:
+    """Split a statement file into compact, token-bounded row groups"""
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+
+    def file_context(self, data) -> Dict:
+        """Scalar description fields shared by every chunk of a file"""
+        sources = [data, _payload(data)] if isinstance(data, dict) else []
+        context = {}
+        for source in sources:
+            for key in CONTEXT_FIELDS:
+                if isinstance(source.get(key), (str, int, float)):
+                    context[key] = source[key]
+        return _clean(context)
+
+    def explode(self, row: Dict) -> List[Dict]:
+        """Split an oversized row along its nested tables, keeping parent keys"""
+        if estimate_tokens(compact_json(row)) <= self.token_budget:
+            return [row]
+
+        nested = [
+            key for key, value in row.items()
+            if isinstance(value, list) and value and all(isinstance(v, dict) for v in value)
+        ]
+        if not nested:
+            return [row]
+
+        parent = {k: v for k, v in row.items() if k not in nested}
+        parent_keys = _row_keys(parent)
+        rows = []
+        for key in nested:
+            for child in row[key]:
+                rows.extend(self.explode({**parent_keys, **child}))
+        remainder = {k: v for k, v in parent.items() if k not in parent_keys}
+        if remainder:
+            rows.insert(0, parent)
+        return rows
+
+    def split(self, row: Dict, room: int) -> List[Dict]:
+        """Cut a row longer than `room` characters into parts that each fit
+
+        Every part repeats the row's identifying keys; a single value too
+        long even on its own is truncated.
+        """
+        if len(compact_json(row)) <= room:
+            return [row]
+        keys = _row_keys(row)
+        parts, part = [], dict(keys)
+        for key, value in row.items():
+            if key in keys:
+                continue
+            if len(compact_json({**part, key: value})) > room and len(part) > len(keys):
+                parts.append(part)
+                part = dict(keys)
+            if len(compact_json({**part, key: value})) > room:
+                value = _truncate(value, room - len(compact_json({**part, key: ''})))
+            part[key] = value
+        if len(part) > len(keys) or not parts:
+            parts.append(part)
+        return parts
+
+    @staticmethod
+    def _body(filename: str, section: str, rows: List[Dict], context: Dict) -> Dict:
+        body = {'source': filename, 'section': section, 'rows': rows}
+        if context:
+            body['context'] = context
+        return body
+
+    def chunk(self, filename: str, data) -> List[Dict]:
+        """Return one {'content', 'metadata'} dict per row group"""
+        adapter = select_adapter(data)
+        context = self.file_context(data)
+        statement = statement_number(filename)
+        # Sizes are counted in characters, so a chunk's estimate stays within the budget
+        limit = self.token_budget * CHARS_PER_TOKEN
+
+        groups: List[Tuple[str, List[Dict]]] = []
+        envelopes: Dict[str, int] = {}
+        current_section, current_rows, current_size = None, [], 0
+        for section, raw_row in adapter.rows(data):
+            # Every chunk repeats the source/section/context envelope
+            if section not in envelopes:
+                envelopes[section] = len(compact_json(self._body(filename, section, [], context)))
+            envelope = envelopes[section]
+            for row in self.explode(_clean(raw_row)):
+                if not row:
+                    continue
+                for part in self.split(row, limit - envelope):
+                    size = len(compact_json(part))
+                    if current_rows and (
+                        section != current_section
+                        or current_size + 1 + size > limit   # 1 for the separating comma
+                    ):
+                        groups.append((current_section, current_rows))
+                        current_rows = []
+                    if not current_rows:
+                        current_section, current_size = section, envelope - 1
+                    current_rows.append(part)
+                    current_size += 1 + size
+        if current_rows:
+            groups.append((current_section, current_rows))
+
+        chunks = []
+        for index, (section, rows) in enumerate(groups):
+            content = compact_json(self._body(filename, section, rows, context))
+
+            metadata = {
+                'source_file': filename,
+                'adapter': adapter.name,
+                'section': section,
+                'chunk_index': index,
+                'num_rows': len(rows),
+            }
+            if statement:
+                metadata['statement'] = statement
+            metadata.update(self.row_metadata(rows))
+            # Canonical filter fields replace the raw mineral/state/district/year keys
+            metadata.update(entity_metadata(rows, context, section))
+
+            chunks.append({'content': content, 'metadata': metadata})
+        return chunks
+
+    def row_metadata(self, rows: List[Dict]) -> Dict:
+        """Merge identifying keys of grouped rows into vector-store metadata"""
+        values: Dict[str, List] = {}
+        for row in rows:
+            for key, value in _row_keys(row).items():
+                bucket = values.setdefault(key, [])
+                if value not in bucket:
+                    bucket.append(value)
+
+        metadata = {}
+        for key, bucket in values.items():
+            if key == 'section':
+                continue
+            # Pinecone accepts scalars or lists of strings
+            metadata[key] = bucket[0] if len(bucket) == 1 else [str(v) for v in bucket]
+        return metadata
@@ -0,0 +1,178 @@
+# statement_loader.py - Parallel, streaming parse and chunking of statement files
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from ingest_manifest import make_vector_id
+from statement_chunker import DEFAULT_TOKEN_BUDGET, StatementChunker
+
+# ==========================================
+# DISCOVERY
+# ==========================================
+
+def discover_json_files(folder: str) -> List[Tuple[str, str]]:
+    """(path, source name) of every statement file under `folder`, in a stable order
+
+    Year folders (datasets/2021/...) are walked too. The source name is the
+    path relative to `folder`, so files at the top level keep their bare
+    filename (and vector IDs) while same-named files of different years
+    stay distinct.
+    """
+    root = os.path.expanduser(folder)
+    found = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories[:] = sorted(d for d in subdirectories if not d.startswith('.'))
+        for filename in filenames:
+            if filename.lower().endswith('.json') and not filename.startswith('.'):
+                path = os.path.join(directory, filename)
+                found.append((path, os.path.relpath(path, root).replace(os.sep, '/')))
+    return sorted(found, key=lambda item: item[1])
+
+# ==========================================
+# PER-FILE WORK (runs in the pool)
+# ==========================================
+
+class LoadedFile(NamedTuple):
+    """One file's chunks, ready to embed, or the reason it has none"""
+    path: str
+    source: str
+    chunks: List[Tuple[str, Dict]]   # (content, metadata with doc_id)
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+
+def normalize_chunk(source: str, chunk: Dict) -> Tuple[str, Dict]:
+    """(content, metadata) with the stable vector ID and raw-JSON marker added"""
+    metadata = {
+        **chunk['metadata'],
+        'doc_id': make_vector_id(source, chunk['metadata']['chunk_index']),
+        'raw_json': True,
+    }
+    return chunk['content'], metadata
+
+
+def load_file(path: str, source: str, token_budget: int = DEFAULT_TOKEN_BUDGET) -> LoadedFile:
+    """Parse and chunk one file; never raises, so one bad file cannot stop a run"""
+    started = time.perf_counter()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        return LoadedFile(path, source, [], f"{source}: {e}", time.perf_counter() - started)
+    try:
+        chunks = StatementChunker(token_budget=token_budget).chunk(source, data)
+    except Exception as e:
+        return LoadedFile(path, source, [], f"{source}: chunking failed: {type(e).__name__}: {e}",
+                          time.perf_counter() - started)
+    # Only the compact chunks cross back to the parent; the parsed tree dies here
+    return LoadedFile(path, source, [normalize_chunk(source, chunk) for chunk in chunks],
+                      None, time.perf_counter() - started)
+
+# ==========================================
+# LOADER
+# ==========================================
+
+class StreamingLoader:
+    """Fan files out across a process pool and yield their chunks in file order
+
+    At most `max_in_flight` files are submitted ahead of the consumer, so
+    memory is bounded by that window rather than by the size of the corpus,
+    and the first chunks reach the embedding stage while later files are
+    still being parsed. Each file is parsed whole inside its worker (a
+    statement is a single JSON document), and only its chunks come back.
+    `workers` <= 1 parses in the calling process. A worker that dies (e.g.
+    killed for memory) only fails the file it was parsing; see `_next`.
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET, workers: int = 4,
+                 max_in_flight: Optional[int] = None):
+        self.token_budget = token_budget
+        self.workers = workers
+        self.max_in_flight = max_in_flight or max(1, workers) * 2
+        self.counters = {'files_loaded': 0, 'files_failed': 0, 'chunks': 0}
+        self.errors: List[str] = []
+        self.parse_seconds = 0.0
+
+    def _record(self, loaded: LoadedFile) -> LoadedFile:
+        self.parse_seconds += loaded.seconds
+        if loaded.error:
+            self.counters['files_failed'] += 1
+            self.errors.append(loaded.error)
+        else:
+            self.counters['files_loaded'] += 1
+            self.counters['chunks'] += len(loaded.chunks)
+        return loaded
+
+    def iter_files(self, files: Iterable[Tuple[str, str]]) -> Iterator[LoadedFile]:
+        """LoadedFile per (path, source name), in input order"""
+        if self.workers <= 1:
+            for path, source in files:
+                yield self._record(load_file(path, source, self.token_budget))
+            return
+
+        pool = ProcessPoolExecutor(max_workers=self.workers)
+        pending = deque()   # (path, source, future)
+        try:
+            for path, source in files:
+                pending.append((path, source, self._submit(pool, path, source)))
+                if len(pending) >= self.max_in_flight:
+                    loaded, pool = self._next(pending, pool)
+                    yield self._record(loaded)
+            while pending:
+                loaded, pool = self._next(pending, pool)
+                yield self._record(loaded)
+        finally:
+            # A consumer that stops early leaves nothing running behind it
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, pool: ProcessPoolExecutor, path: str, source: str) -> Future:
+        try:
+            return pool.submit(load_file, path, source, self.token_budget)
+        except BrokenProcessPool as e:
+            # The pool died since the last result was read; _next sorts it out
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    def _next(self, pending: deque, pool: ProcessPoolExecutor) -> Tuple[LoadedFile, ProcessPoolExecutor]:
+        """(LoadedFile of the oldest pending file, pool to use from now on)
+
+        When a worker dies, every future of its pool fails with
+        BrokenProcessPool, whichever file was to blame. The oldest file is
+        then parsed alone in a fresh pool: if that breaks too, the file is
+        reported as failed; otherwise it was innocent. Either way the files
+        still pending (except those that had already finished) are
+        resubmitted to the fresh pool.
+        """
+        path, source, future = pending.popleft()
+        try:
+            return future.result(), pool
+        except BrokenProcessPool:
+            pass
+
+        pool.shutdown(wait=False)
+        pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            loaded = pool.submit(load_file, path, source, self.token_budget).result()
+        except BrokenProcessPool:
+            loaded = LoadedFile(path, source, [], f"{source}: worker process died while parsing")
+            pool.shutdown(wait=False)
+            pool = ProcessPoolExecutor(max_workers=self.workers)
+
+        for position, (other_path, other_source, other) in enumerate(pending):
+            if not (other.done() and other.exception() is None):
+                pending[position] = (other_path, other_source,
+                                     self._submit(pool, other_path, other_source))
+        return loaded, pool
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            'workers': self.workers,
+            'parse_seconds': round(self.parse_seconds, 3),
+            'errors': list(self.errors),
+        }
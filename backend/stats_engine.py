@@ -0,0 +1,1035 @@
+# stats_engine.py - Typed columnar tables over the DGMS statements, with a small query engine
+import json
+import operator
+import os
+import re
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from entities import EntityExtractor
+from statement_chunker import CodeDictionaryAdapter, statement_number
+from statement_loader import discover_json_files
+
+PLACEHOLDERS = {'', '-', '--', '---', 'nil', 'n/a', 'na', 'none', 'null'}
+PAIR_PATTERN = re.compile(r'^\s*(-?[\d,]+(?:\.\d+)?)\s*\(\s*(-?[\d,]+(?:\.\d+)?)\s*\)\s*$')
+YEAR_COLUMN = re.compile(r'^year_(\d{4})$')
+
+AGGREGATIONS = ('count', 'sum', 'mean', 'min', 'max', 'rate')
+
+# Rows whose `level` is not 'detail' are totals/summaries; they are skipped
+# unless the query filters on `level`, so group-by sums do not double count.
+DETAIL = 'detail'
+
+
+class StatsQueryError(ValueError):
+    """Raised for malformed stats queries (unknown table, column or aggregation)"""
+
+# ==========================================
+# VALUE PARSING
+# ==========================================
+
+def parse_number(value) -> Optional[float]:
+    """Number from an int/float/numeric string; placeholders and text give None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        text = value.strip()
+        if text.lower() in PLACEHOLDERS:
+            return None
+        try:
+            return float(text.replace(',', ''))
+        except ValueError:
+            return None
+    return None
+
+
+def parse_pair(value) -> Tuple[Optional[float], Optional[float]]:
+    """Split an "accidents (persons)" cell such as "3 (3)" or "0(1)"
+
+    Plain numbers give (n, None); placeholders give (None, None).
+    """
+    if isinstance(value, str):
+        match = PAIR_PATTERN.match(value)
+        if match:
+            return parse_number(match.group(1)), parse_number(match.group(2))
+    return parse_number(value), None
+
+
+def parse_year(date: Optional[str]) -> Optional[int]:
+    """Four-digit year from a dd/mm/yy date"""
+    if not isinstance(date, str):
+        return None
+    match = re.search(r'(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})', date)
+    if not match:
+        return None
+    year = int(match.group(3))
+    if year < 100:
+        year += 2000 if year <= 30 else 1900
+    return year
+
+
+def _label(value) -> Optional[str]:
+    if value is None:
+        return None
+    text = ' '.join(str(value).split())
+    return text or None
+
+
+def _flatten(prefix: str, value, row: Dict):
+    """Nested measure objects become underscore-joined numeric columns"""
+    if isinstance(value, dict):
+        for key, inner in value.items():
+            _flatten(f"{prefix}_{key}" if prefix else key, inner, row)
+    elif not isinstance(value, list):
+        row[prefix] = parse_number(value)
+
+# ==========================================
+# COLUMNAR TABLE
+# ==========================================
+
+class Table:
+    """Typed columns: numeric ones are float64 arrays (NaN = missing), the rest strings"""
+
+    def __init__(self, name: str, columns: Dict[str, object], types: Dict[str, str],
+                 description: str = '', sources: Optional[List[str]] = None):
+        self.name = name
+        self.columns = columns
+        self.types = types
+        self.description = description
+        self.sources = sources or []
+        self.num_rows = len(next(iter(columns.values()))) if columns else 0
+
+    @classmethod
+    def from_rows(cls, name: str, rows: List[Dict], description: str = '',
+                  sources: Optional[List[str]] = None,
+                  string_columns: Tuple[str, ...] = ()) -> 'Table':
+        names = list(dict.fromkeys(key for row in rows for key in row))
+        columns, types = {}, {}
+        for column in names:
+            values = [row.get(column) for row in rows]
+            numeric = column not in string_columns and all(
+                v is None or (isinstance(v, (int, float)) and not isinstance(v, bool))
+                for v in values
+            )
+            if numeric:
+                columns[column] = np.array(
+                    [np.nan if v is None else float(v) for v in values], dtype=np.float64
+                )
+                types[column] = 'number'
+            else:
+                columns[column] = [_label(v) for v in values]
+                types[column] = 'string'
+        return cls(name, columns, types, description, sources)
+
+    def column(self, name: str):
+        if name not in self.columns:
+            raise StatsQueryError(f"Unknown column '{name}' in table '{self.name}'")
+        return self.columns[name]
+
+    def value(self, column: str, row: int):
+        value = self.columns[column][row]
+        if self.types[column] == 'number':
+            return _output_number(value)
+        return value
+
+    def schema(self) -> Dict:
+        return {
+            'description': self.description,
+            'sources': self.sources,
+            'num_rows': self.num_rows,
+            'columns': dict(self.types),
+        }
+
+
+def _output_number(value) -> Optional[float]:
+    if value is None or np.isnan(value):
+        return None
+    value = float(value)
+    return int(value) if value.is_integer() else round(value, 4)
+
+# ==========================================
+# STATEMENT NORMALIZERS
+# ==========================================
+# Each normalizer turns one statement's JSON into (table name, row) pairs.
+
+TableRows = Iterator[Tuple[str, Dict]]
+
+
+def _data(doc) -> Dict:
+    if isinstance(doc, dict) and isinstance(doc.get('data'), dict):
+        return doc['data']
+    return doc if isinstance(doc, dict) else {}
+
+
+def normalize_mineral_year(doc, statement: str) -> TableRows:
+    """4.1: accidents, casualties and rates per mineral and year"""
+    for record in _data(doc).get('mineral_data') or []:
+        fatal = record.get('fatal_accidents') or {}
+        serious = record.get('serious_accidents') or {}
+        rates = record.get('rates_per_1000_persons_employed') or {}
+        yield 'mineral_year', {
+            'mineral': record.get('mineral'),
+            'year': parse_number(record.get('year')),
+            'fatal_accidents': parse_number(fatal.get('no_of_accidents')),
+            'persons_killed': parse_number(fatal.get('no_of_persons_killed')),
+            'fatal_persons_seriously_injured': parse_number(fatal.get('no_of_persons_seriously_injured')),
+            'serious_accidents': parse_number(serious.get('no_of_accidents')),
+            'persons_seriously_injured': parse_number(serious.get('no_of_persons_seriously_injured')),
+            'death_rate': parse_number(rates.get('death_rate')),
+            'serious_injury_rate': parse_number(rates.get('serious_injury_rate')),
+        }
+
+
+def normalize_rate_trend(doc, statement: str) -> TableRows:
+    """4.2: accident/death/serious-injury rates per 1000 employed, by mineral and year"""
+    data = _data(doc)
+    groups = [(entry.get('name'), DETAIL, entry) for entry in data.get('minerals') or []]
+    groups += [(entry.get('label'), 'total', entry) for entry in data.get('totals') or []]
+    for mineral, level, entry in groups:
+        for point in entry.get('data') or []:
+            row = {'mineral': mineral, 'level': level, 'year': parse_number(point.get('year'))}
+            for key, value in point.items():
+                if key != 'year':
+                    _flatten(key, value, row)
+            yield 'rate_trend', row
+
+
+def normalize_cause_year(doc, statement: str) -> TableRows:
+    """4.3-4.5: yearly "accidents (persons)" cells per cause, plus totals by location"""
+    data = _data(doc)
+
+    def cells(cause: str, location: str, level: str, columns: Dict) -> TableRows:
+        for key, value in (columns or {}).items():
+            match = YEAR_COLUMN.match(key)
+            if not match:
+                continue
+            accidents, persons = parse_pair(value)
+            yield 'cause_year', {
+                'statement': statement,
+                'cause': cause,
+                'location': location,
+                'level': level,
+                'year': float(match.group(1)),
+                'accidents': accidents,
+                'persons': persons,
+            }
+
+    for record in data.get('accident_causes') or []:
+        yield from cells(record.get('cause'), 'all', DETAIL, record)
+    yield from cells('TOTAL', 'all', 'total', data.get('total'))
+    for location, columns in (data.get('location_summary') or {}).items():
+        yield from cells('TOTAL', location, 'location_summary', columns)
+
+
+def normalize_district_accidents(doc, statement: str) -> TableRows:
+    """4.6a: accidents and casualties per mineral, state and district"""
+    for record in _data(doc).get('records') or []:
+        accidents = record.get('accidents') or {}
+        row = {
+            'mineral': record.get('mineral'),
+            'state': record.get('state'),
+            'district': record.get('district'),
+            'fatal_accidents': parse_number(accidents.get('fatal')),
+            'serious_accidents': parse_number(accidents.get('serious')),
+        }
+        for measure in ('persons_killed', 'persons_seriously_injured'):
+            breakdown = dict(record.get(measure) or {})
+            row[measure] = parse_number(breakdown.pop('total', None))
+            _flatten(measure, breakdown, row)
+        yield 'district_accidents', row
+
+
+def normalize_district_rates(doc, statement: str) -> TableRows:
+    """4.6b: death and serious-injury rates per 1000 employed, by district, state and mineral"""
+    def rates(values) -> Dict:
+        row = {}
+        _flatten('', values or {}, row)
+        return row
+
+    for mineral in _data(doc).get('minerals') or []:
+        name = mineral.get('mineral_name')
+        for state in mineral.get('states') or []:
+            for district in state.get('districts') or []:
+                yield 'district_rates', {
+                    'mineral': name, 'state': state.get('state_name'),
+                    'district': district.get('district_name'), 'level': DETAIL,
+                    **rates(district.get('casualty_rates')),
+                }
+            yield 'district_rates', {
+                'mineral': name, 'state': state.get('state_name'), 'district': None,
+                'level': 'state', **rates(state.get('total_state_summary')),
+            }
+        yield 'district_rates', {
+            'mineral': name, 'state': None, 'district': None,
+            'level': 'all_india', **rates(mineral.get('all_india_summary')),
+        }
+
+
+def normalize_cause_location(doc, statement: str) -> TableRows:
+    """4.7: fatal/serious accidents and casualties by cause, mineral and workplace location"""
+    data = _data(doc)
+
+    def by_location(base: Dict, entry: Dict) -> TableRows:
+        for location in ('below_ground', 'open_cast', 'above_ground', 'total'):
+            row = dict(base, location=location)
+            _flatten('', entry.get(location) or {}, row)
+            yield 'cause_location', row
+
+    for section in data.get('sections') or []:
+        category = section.get('category')
+        for subcategory in section.get('subcategories') or []:
+            for entry in subcategory.get('entries') or []:
+                yield from by_location({
+                    'category': category, 'cause': subcategory.get('subcategory'),
+                    'mineral': entry.get('mineral_or_cause'), 'level': DETAIL,
+                }, entry)
+        total = section.get('total_category_row')
+        if total:
+            yield from by_location({
+                'category': category, 'cause': None, 'mineral': None, 'level': 'total',
+            }, total)
+    total = data.get('all_india_total_row')
+    if total:
+        yield from by_location({
+            'category': None, 'cause': None, 'mineral': None, 'level': 'all_india',
+        }, total)
+
+
+def normalize_cause_mineral(doc, statement: str) -> TableRows:
+    """4.8 (fatal) and 4.9 (serious): instances and casualties by broad cause and mineral"""
+    severity = 'fatal' if statement == '4.8' else 'serious'
+    for record in (doc.get('accident_summary') if isinstance(doc, dict) else None) or []:
+        category = (record.get('category') or '').lower()
+        cause_level = DETAIL if 'specific' in category else (
+            'total' if 'total' in category else 'location_summary'
+        )
+        for entry in record.get('mineral_data') or []:
+            mineral = entry.get('mineral_name')
+            level = cause_level
+            if level == DETAIL and (mineral or '').lower() == 'total':
+                level = 'total'
+            yield 'cause_mineral', {
+                'statement': statement,
+                'severity': severity,
+                'cause': record.get('cause'),
+                'mineral': mineral,
+                'level': level,
+                'instances': parse_number(entry.get('instances')),
+                'killed': parse_number(entry.get('killed')),
+                'injured': parse_number(entry.get('injured')),
+            }
+
+
+def normalize_region_accidents(doc, statement: str) -> TableRows:
+    """4.10: accidents and casualties per DGMS region/zone"""
+    data = _data(doc)
+    rows = [(record.get('region_zone'), record) for record in data.get('accident_data') or []]
+    if data.get('all_india_total'):
+        rows.append(('ALL INDIA', data['all_india_total']))
+    for region, record in rows:
+        row = {
+            'region': region,
+            'level': 'total' if region == 'ALL INDIA' or (region or '').endswith('Zone') else DETAIL,
+        }
+        _flatten('fatal', record.get('fatal_accidents') or {}, row)
+        _flatten('serious', record.get('serious_accidents') or {}, row)
+        yield 'region_accidents', row
+
+
+def normalize_inquiries(doc, statement: str) -> TableRows:
+    """4.11: courts of inquiry into major accidents"""
+    for record in _data(doc).get('inquiry_records') or []:
+        yield 'inquiries', {
+            'serial_number': parse_number(record.get('serial_number')),
+            'date': record.get('accident_date'),
+            'year': parse_year(record.get('accident_date')),
+            'mine_name': record.get('mine_name'),
+            'cause': record.get('cause_of_accident'),
+            'persons_killed': parse_number(record.get('persons_killed')),
+        }
+
+
+def normalize_fatal_records(doc, statement: str) -> TableRows:
+    """4.12: individual fatal accidents with their cause code"""
+    records = doc if isinstance(doc, list) else _data(doc).get('records') or []
+    for record in records:
+        if not isinstance(record, dict) or not record.get('date'):
+            continue   # code headings, not accidents
+        yield 'fatal_records', {
+            'record_id': parse_number(record.get('record_id')),
+            'code': record.get('code'),
+            'cause': record.get('category'),
+            'date': record.get('date'),
+            'year': parse_year(record.get('date')),
+            'mine_name': record.get('mine_name'),
+            'owner': record.get('owner'),
+            'district': record.get('district'),
+            'state': record.get('state'),
+            'persons_killed': float(len(record.get('persons_killed') or [])),
+        }
+
+
+def normalize_major_accidents(doc, statement: str) -> TableRows:
+    """4.13: major accidents with casualties"""
+    for record in _data(doc).get('accidents') or []:
+        yield 'major_accidents', {
+            'serial_number': parse_number(record.get('serial_number')),
+            'date': record.get('date_of_accident'),
+            'year': parse_year(record.get('date_of_accident')),
+            'mine_name': record.get('mine_name'),
+            'cause': record.get('cause_of_accident'),
+            'persons_killed': parse_number(record.get('persons_killed')),
+            'persons_seriously_injured': parse_number(record.get('persons_seriously_injured')),
+        }
+
+
+def normalize_responsibility(doc, statement: str) -> TableRows:
+    """4.14: fatal accidents by responsibility and cause group"""
+    data = _data(doc)
+    year = parse_number(data.get('year'))
+    for record in data.get('accident_data') or []:
+        responsibility = record.get('responsibility_major_cause_group')
+        level = 'total' if (responsibility or '').lower() == 'total' else DETAIL
+        for key, value in record.items():
+            match = re.match(r'^cause_group_(\d+)$', key)
+            if match:
+                yield 'responsibility', {
+                    'responsibility': responsibility, 'cause_group': float(match.group(1)),
+                    'level': level, 'year': year, 'fatal_accidents': parse_number(value),
+                }
+
+
+def normalize_codes(doc, statement: str) -> TableRows:
+    """4.0: the DGMS cause and place codes (category paths joined with ' / ')"""
+    adapter = CodeDictionaryAdapter()
+    if adapter.matches(doc):
+        for _, row in adapter.rows(doc):
+            yield 'codes', row
+
+
+NORMALIZERS: Dict[str, Callable] = {
+    '4.0': normalize_codes,
+    '4.1': normalize_mineral_year,
+    '4.2': normalize_rate_trend,
+    '4.3': normalize_cause_year,
+    '4.4': normalize_cause_year,
+    '4.5': normalize_cause_year,
+    '4.6a': normalize_district_accidents,
+    '4.6b': normalize_district_rates,
+    '4.7': normalize_cause_location,
+    '4.8': normalize_cause_mineral,
+    '4.9': normalize_cause_mineral,
+    '4.10': normalize_region_accidents,
+    '4.11': normalize_inquiries,
+    '4.12': normalize_fatal_records,
+    '4.13': normalize_major_accidents,
+    '4.14': normalize_responsibility,
+}
+
+TABLE_DESCRIPTIONS = {
+    'mineral_year': "Accidents, casualties and rates per 1000 employed by mineral and year (4.1)",
+    'rate_trend': "Accident, death and serious-injury rate trends by mineral and year (4.2)",
+    'cause_year': "Accidents and persons affected by cause and year (4.3-4.5)",
+    'district_accidents': "Accidents and casualties by mineral, state and district (4.6a)",
+    'district_rates': "Death and serious-injury rates by mineral, state and district (4.6b)",
+    'cause_location': "Accidents and casualties by cause, mineral and location (4.7)",
+    'cause_mineral': "Fatal (4.8) and serious (4.9) accidents by broad cause and mineral",
+    'region_accidents': "Accidents and casualties by DGMS region/zone (4.10)",
+    'inquiries': "Courts of inquiry into major accidents (4.11)",
+    'fatal_records': "Individual fatal accidents with cause codes (4.12)",
+    'major_accidents': "Major accidents and their casualties (4.13)",
+    'responsibility': "Fatal accidents by responsibility and cause group (4.14)",
+    'codes': "DGMS accident classification codes (4.0)",
+}
+
+STRING_COLUMNS = ('code', 'date', 'statement', 'source')
+YEAR_FOLDER = re.compile(r'^(?:19|20)\d{2}$')
+
+
+def report_year(source: str) -> Optional[float]:
+    """Year of the nearest year folder in a source path ("2021/Statement 4.1.json" -> 2021)"""
+    for part in reversed(source.split('/')[:-1]):
+        if YEAR_FOLDER.match(part):
+            return float(part)
+    return None
+
+
+def normalize_folder(folder: str) -> Tuple[Dict[str, Table], List[Dict]]:
+    """Load every statement under `folder` into typed tables; (tables, per-file errors)
+
+    Year folders are walked too. Every row carries its `source` (path
+    relative to `folder`) and, inside a year folder, its `report_year`, so
+    the same statement from different years is never merged silently.
+    """
+    rows: Dict[str, List[Dict]] = {}
+    sources: Dict[str, List[str]] = {}
+    errors = []
+    for path, source in discover_json_files(folder):
+        statement = statement_number(os.path.basename(path))
+        normalizer = NORMALIZERS.get(statement)
+        if normalizer is None:
+            continue
+        provenance = {'source': source}
+        year = report_year(source)
+        if year is not None:
+            provenance['report_year'] = year
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                doc = json.load(f)
+            for table, row in normalizer(doc, statement):
+                rows.setdefault(table, []).append({**row, **provenance})
+                if source not in sources.setdefault(table, []):
+                    sources[table].append(source)
+        except Exception as e:
+            errors.append({'file': source, 'error': str(e)})
+
+    tables = {
+        name: Table.from_rows(name, table_rows, TABLE_DESCRIPTIONS.get(name, ''),
+                              sources.get(name), STRING_COLUMNS)
+        for name, table_rows in rows.items()
+    }
+    return tables, errors
+
+# ==========================================
+# QUERY ENGINE
+# ==========================================
+
+NUMERIC_OPERATORS = {
+    '$eq': operator.eq, '$ne': operator.ne,
+    '$gt': operator.gt, '$gte': operator.ge,
+    '$lt': operator.lt, '$lte': operator.le,
+}
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def parse_metric(spec: str) -> Tuple[str, str, Optional[str], Optional[str]]:
+    """"alias=agg:column" / "agg:column" / "rate:num/den" / "count" -> (alias, agg, col, den)"""
+    alias = None
+    if '=' in spec:
+        alias, spec = (part.strip() for part in spec.split('=', 1))
+    agg, _, column = spec.partition(':')
+    agg = agg.strip().lower()
+    if agg not in AGGREGATIONS:
+        raise StatsQueryError(f"Unknown aggregation '{agg}'")
+    denominator = None
+    if agg == 'rate':
+        column, _, denominator = column.partition('/')
+        if not column or not denominator:
+            raise StatsQueryError("rate needs 'rate:numerator/denominator'")
+    elif agg != 'count' and not column:
+        raise StatsQueryError(f"'{agg}' needs a column, e.g. '{agg}:persons_killed'")
+    if alias is None:
+        alias = agg if not column else f"{agg}_{column}" + (f"_per_{denominator}" if denominator else '')
+    return alias, agg, column or None, denominator or None
+
+
+class StatsEngine:
+    """Filter / group-by / aggregate / top-n over the normalized statement tables
+
+    A query is a dict:
+        {"table": "district_accidents",
+         "filters": {"mineral": "coal", "fatal_accidents": {"$gt": 0}},
+         "group_by": ["state"],
+         "metrics": ["killed=sum:persons_killed", "rate:persons_killed/fatal_accidents"],
+         "sort": "-killed", "limit": 5}
+    Filters use the same operators as vector-store metadata filters ($eq,
+    $ne, $in, $nin, $gt, $gte, $lt, $lte, $and, $or); string matches are
+    case-insensitive. Without metrics the matching rows are returned.
+    """
+
+    def __init__(self, tables: Optional[Dict[str, Table]] = None,
+                 errors: Optional[List[Dict]] = None):
+        self.tables = tables or {}
+        self.errors = errors or []
+        self.snapshot: Optional[Dict] = None   # set when backed by a stats snapshot
+        self._entities: Optional[EntityExtractor] = None
+
+    @classmethod
+    def from_folder(cls, folder: str) -> 'StatsEngine':
+        if not os.path.isdir(os.path.expanduser(folder)):
+            print(f"⚠️ Stats datasets folder not found: {folder}")
+            return cls()
+        return cls(*normalize_folder(folder))
+
+    def catalog(self) -> Dict:
+        return {name: table.schema() for name, table in sorted(self.tables.items())}
+
+    def table(self, name: str) -> Table:
+        if name not in self.tables:
+            raise StatsQueryError(f"Unknown table '{name}'")
+        return self.tables[name]
+
+    # ---------- filtering ----------
+
+    def _compare(self, table: Table, column: str, op: str, operand) -> np.ndarray:
+        values = table.column(column)
+        if table.types[column] == 'number':
+            if op in ('$in', '$nin'):
+                numbers = [parse_number(v) for v in operand]
+                mask = np.isin(values, [n for n in numbers if n is not None])
+                return mask if op == '$in' else ~mask
+            number = parse_number(operand)
+            if number is None:
+                raise StatsQueryError(f"Column '{column}' is numeric; got {operand!r}")
+            compare = NUMERIC_OPERATORS.get(op) or self._bad_op(op)
+            with np.errstate(invalid='ignore'):
+                return compare(values, number)
+
+        if hasattr(values, 'mask_in') and op in ('$eq', '$ne', '$in', '$nin'):
+            # Dictionary-encoded column (snapshot): match on codes, not strings
+            targets = operand if op in ('$in', '$nin') else [operand]
+            mask = values.mask_in({_casefold(v) for v in targets})
+            return mask if op in ('$eq', '$in') else ~mask
+
+        folded = [_casefold(v) for v in values]
+        if op in ('$in', '$nin'):
+            wanted = {_casefold(v) for v in operand}
+            mask = np.array([v in wanted for v in folded], dtype=bool)
+            return mask if op == '$in' else ~mask
+        target = _casefold(operand)
+        if op == '$eq':
+            return np.array([v == target for v in folded], dtype=bool)
+        if op == '$ne':
+            return np.array([v != target for v in folded], dtype=bool)
+        if op in ('$gt', '$gte', '$lt', '$lte'):
+            compare = NUMERIC_OPERATORS[op]
+            return np.array([v is not None and compare(v, target) for v in folded], dtype=bool)
+        return self._bad_op(op)
+
+    @staticmethod
+    def _bad_op(op: str):
+        raise StatsQueryError(f"Unsupported filter operator: {op}")
+
+    def _mask(self, table: Table, filters: Optional[Dict]) -> np.ndarray:
+        mask = np.ones(table.num_rows, dtype=bool)
+        for key, condition in (filters or {}).items():
+            if key == '$and':
+                for sub in condition:
+                    mask &= self._mask(table, sub)
+            elif key == '$or':
+                any_mask = np.zeros(table.num_rows, dtype=bool)
+                for sub in condition:
+                    any_mask |= self._mask(table, sub)
+                mask &= any_mask
+            elif isinstance(condition, dict):
+                for op, operand in condition.items():
+                    mask &= self._compare(table, key, op, operand)
+            elif isinstance(condition, list):
+                mask &= self._compare(table, key, '$in', condition)
+            else:
+                mask &= self._compare(table, key, '$eq', condition)
+        return mask
+
+    @staticmethod
+    def _filters_mention(filters: Optional[Dict], column: str) -> bool:
+        if not filters:
+            return False
+        for key, condition in filters.items():
+            if key == column:
+                return True
+            if key in ('$and', '$or') and any(StatsEngine._filters_mention(sub, column) for sub in condition):
+                return True
+        return False
+
+    # ---------- aggregation ----------
+
+    @staticmethod
+    def _aggregate(table: Table, rows: np.ndarray, agg: str, column: Optional[str],
+                   denominator: Optional[str]):
+        if agg == 'count':
+            if column is None:
+                return len(rows)
+            values = table.column(column)
+            if table.types[column] == 'number':
+                return int(np.count_nonzero(~np.isnan(values[rows])))
+            return sum(1 for i in rows if values[i] is not None)
+
+        for name in (column, denominator):
+            if name is not None and table.types.get(name, 'number') != 'number':
+                raise StatsQueryError(f"'{agg}' needs a numeric column; '{name}' is text")
+        values = table.column(column)[rows]
+        present = values[~np.isnan(values)]
+        if agg == 'rate':
+            denominators = table.column(denominator)[rows]
+            both = ~np.isnan(values) & ~np.isnan(denominators)
+            total = denominators[both].sum()
+            return _output_number(values[both].sum() / total) if total else None
+        if present.size == 0:
+            return None
+        return _output_number({
+            'sum': present.sum, 'mean': present.mean, 'min': present.min, 'max': present.max,
+        }[agg]())
+
+    def query(self, spec: Dict) -> Dict:
+        """Run one query spec; raises StatsQueryError for malformed specs"""
+        started = time.perf_counter()
+        if not isinstance(spec, dict) or not spec.get('table'):
+            raise StatsQueryError("Query needs a 'table'")
+        table = self.table(spec['table'])
+        filters = spec.get('filters') or {}
+        group_by = spec.get('group_by') or []
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        metrics = spec.get('metrics') or []
+        if isinstance(metrics, str):
+            metrics = [metrics]
+        limit = spec.get('limit')
+
+        mask = self._mask(table, filters)
+        if 'level' in table.columns and not self._filters_mention(filters, 'level'):
+            mask &= self._compare(table, 'level', '$eq', DETAIL)
+        matched = np.flatnonzero(mask)
+
+        if not metrics and not group_by:
+            columns = spec.get('columns') or list(table.columns)
+            for column in columns:
+                table.column(column)
+            result_rows = [{c: table.value(c, int(i)) for c in columns} for i in matched]
+        else:
+            parsed = [parse_metric(m) for m in metrics] or [parse_metric('count')]
+            for column in group_by:
+                table.column(column)
+            groups: Dict[tuple, List[int]] = {}
+            for i in matched:
+                key = tuple(table.value(column, int(i)) for column in group_by)
+                groups.setdefault(key, []).append(int(i))
+            result_rows = []
+            for key, indices in groups.items():
+                row = dict(zip(group_by, key))
+                rows = np.asarray(indices, dtype=np.int64)
+                for alias, agg, column, denominator in parsed:
+                    row[alias] = self._aggregate(table, rows, agg, column, denominator)
+                result_rows.append(row)
+
+        sort = spec.get('sort')
+        if sort:
+            descending = sort.startswith('-')
+            sort_key = sort.lstrip('-+')
+            present = [r for r in result_rows if r.get(sort_key) is not None]
+            missing = [r for r in result_rows if r.get(sort_key) is None]
+            present.sort(key=lambda r: r[sort_key], reverse=descending)
+            result_rows = present + missing
+        if limit is not None:
+            result_rows = result_rows[:max(0, int(limit))]
+
+        return {
+            'table': table.name,
+            'description': table.description,
+            'sources': table.sources,
+            'filters': filters,
+            'group_by': group_by,
+            'metrics': metrics,
+            'matched_rows': int(matched.size),
+            'rows': result_rows,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    # ---------- questions ----------
+
+    def vocabulary(self, column: str) -> List[str]:
+        """Distinct values of a string column across all tables, longest first"""
+        values = set()
+        for table in self.tables.values():
+            if table.types.get(column) == 'string':
+                values.update(v for v in table.columns[column] if v)
+        return sorted(values, key=len, reverse=True)
+
+    def entities(self) -> EntityExtractor:
+        """Gazetteer extractor over the tables' mineral/state/district/mine names"""
+        if self._entities is None:
+            self._entities = EntityExtractor.from_stats(self)
+        return self._entities
+
+    def plan(self, question: str) -> Optional[Dict]:
+        """Map a common numeric question to a query spec, or None"""
+        return plan_question(question, self)
+
+    def answer(self, question: str) -> Optional[Dict]:
+        """Query result for a recognised numeric question, or None"""
+        spec = self.plan(question)
+        if spec is None:
+            return None
+        try:
+            result = self.query(spec)
+        except StatsQueryError:
+            return None
+        return result if result['rows'] else None
+
+# ==========================================
+# QUESTION PLANNER
+# ==========================================
+
+TOP_WORDS = re.compile(r'\b(top|most|leading|highest|main|major|biggest)\b')
+TOP_N = re.compile(r'\btop\s+(\d+)\b')
+KILLED_WORDS = re.compile(r'\b(killed|deaths?|died|fatal\w*|dead)\b')
+INJURED_WORDS = re.compile(r'\b(injur(?:ed|y|ies)|seriously)\b')
+ACCIDENT_WORDS = re.compile(r'\baccidents?\b')
+BY_MINERAL = re.compile(r'\b(by|per|each|every|across)\s+minerals?\b')
+YEAR_MENTION = re.compile(r'\b(?:19|20)\d{2}\b')
+BY_YEAR = re.compile(r'\b(by|per|each|every)\s+years?\b|\byearly\b|\btrend\b')
+CAUSE_WORDS = re.compile(r'\bcauses?\b')
+
+# Constraints other than minerals, states and districts; a question naming
+# one is declined unless the spec filters on the matching column
+CAUSE_MENTION = re.compile(
+    r'\b(due to|because of|caused by|owing to|resulting from|falls? of|roofs?|sides?|'
+    r'dumpers?|trucks?|tippers?|wagons?|explosi\w*|blast\w*|gas|fires?|electric\w*|'
+    r'drown\w*|inundation|irruption|winding|haulage|ropes?|conveyors?|machinery|'
+    r'suffocat\w*|fumes|dust|flying pieces|rock ?burst|ground movement)\b'
+)
+CODE_MENTION = re.compile(r'\bcodes?\s*(?:no\.?\s*)?\d+|\b0\d{3}\b')
+LOCATION_MENTION = re.compile(
+    r'\b(open[\s-]?cast|underground|below[\s-]?ground|above[\s-]?ground|surface|'
+    r'quarr(?:y|ies)|benches)\b'
+)
+
+# Names a question may use that the statement tables need not contain; a
+# question naming one the tables lack is declined instead of answered
+# without that constraint
+REFERENCE_NAMES = {
+    'mineral': ('coal', 'lignite', 'bauxite', 'chromite', 'dolomite', 'mica', 'barytes',
+                'fluorite', 'graphite', 'gypsum', 'zinc', 'diamond', 'uranium', 'phosphorite',
+                'kyanite', 'feldspar', 'quartzite', 'wollastonite', 'vermiculite', 'bentonite'),
+    'state': ('andhra pradesh', 'arunachal pradesh', 'assam', 'bihar', 'chhattisgarh', 'goa',
+              'gujarat', 'haryana', 'himachal pradesh', 'jammu and kashmir', 'jharkhand',
+              'karnataka', 'kerala', 'madhya pradesh', 'maharashtra', 'manipur', 'meghalaya',
+              'mizoram', 'nagaland', 'orissa', 'punjab', 'rajasthan', 'sikkim', 'tamilnadu',
+              'telangana', 'tripura', 'uttar pradesh', 'uttarakhand', 'west bengal'),
+}
+# Current spellings -> the ones the statements use
+NAME_ALIASES = {'odisha': 'orissa', 'tamil nadu': 'tamilnadu'}
+
+
+def _mentions(question: str, vocabulary: List[str]) -> List[str]:
+    found = []
+    for value in vocabulary:
+        if len(value) < 3:
+            continue
+        if re.search(r'(?<!\w)' + re.escape(value.casefold()) + r'(?!\w)', question):
+            if not any(value.casefold() in other.casefold() for other in found):
+                found.append(value)
+    return found
+
+
+def _unknown_names(question: str, engine: StatsEngine) -> List[str]:
+    """Reference minerals/states named in `question` that no table contains"""
+    unknown = []
+    for column, names in REFERENCE_NAMES.items():
+        known = {value.casefold() for value in engine.vocabulary(column)}
+        for name in names:
+            # "non-coal" names the tables' own category, not coal
+            if name not in known and re.search(r'(?<![\w-])' + re.escape(name) + r'(?![\w-])', question):
+                unknown.append(name)
+    return unknown
+
+
+def _constraints(question: str, engine: StatsEngine) -> List[str]:
+    """Columns `question` constrains besides mineral/state/district (cause, code, location, mine)"""
+    named = []
+    if CAUSE_MENTION.search(question) or _mentions(question, engine.vocabulary('cause')):
+        named.append('cause')
+    if CODE_MENTION.search(question):
+        named.append('code')
+    if LOCATION_MENTION.search(question):
+        named.append('location')
+    if engine.entities().extract(question).get('mine'):
+        named.append('mine_name')
+    return named
+
+
+def _covers(table: Table, filters: Optional[Dict], mentioned: Dict[str, List[str]],
+            constraints: List[str]) -> bool:
+    """True if the spec filters on every named entity and constraint and the table contains it"""
+    for column in constraints:
+        if column not in table.types or not StatsEngine._filters_mention(filters, column):
+            return False
+    for column, names in mentioned.items():
+        if not names:
+            continue
+        if column not in table.types or not StatsEngine._filters_mention(filters, column):
+            return False
+        values = {_casefold(v) for v in table.columns[column] if v}
+        if any(name.casefold() not in values for name in names):
+            return False
+    return True
+
+
+def plan_question(question: str, engine: StatsEngine) -> Optional[Dict]:
+    """Heuristic planner for deaths by mineral/year, rates by state and top causes
+
+    Returns None when the question names a mineral, state, district, cause,
+    code, mine type or mine the chosen table does not filter on, rather than
+    dropping that constraint.
+    """
+    q = ' '.join(question.casefold().split())
+    for name, alias in NAME_ALIASES.items():
+        q = re.sub(r'\b' + re.escape(name) + r'\b', alias, q)
+    if _unknown_names(q, engine):
+        return None
+    states = _mentions(q, engine.vocabulary('state'))
+    folded_states = {state.casefold() for state in states}
+    mentioned = {
+        'mineral': _mentions(q, engine.vocabulary('mineral')),
+        'state': states,
+        'district': [d for d in _mentions(q, engine.vocabulary('district'))
+                     if d.casefold() not in folded_states],
+    }
+    spec = _plan_spec(q, engine, mentioned)
+    if spec is None:
+        return None
+    table = engine.table(spec['table'])
+    years = sorted({float(y) for y in YEAR_MENTION.findall(q)})
+    if years and 'year' not in table.types:
+        # The district tables are undated; only a year folder can date them
+        if 'report_year' not in table.types:
+            return None
+        spec['filters']['report_year'] = {'$in': years}
+    if len(_report_years(table)) > 1:
+        # Statements from several year folders: keep each report's figures apart
+        key = 'group_by' if spec.get('group_by') else 'columns'
+        spec[key] = list(spec.get(key) or []) + ['report_year']
+    if not _covers(table, spec.get('filters'), mentioned, _constraints(q, engine)):
+        return None
+    return spec
+
+
+def _report_years(table: Table) -> set:
+    """Distinct report years in `table` (None for files outside a year folder)"""
+    if 'report_year' not in table.types:
+        return set()
+    return {table.value('report_year', row) for row in range(table.num_rows)}
+
+
+def _plan_spec(q: str, engine: StatsEngine, mentioned: Dict[str, List[str]]) -> Optional[Dict]:
+    years = sorted({float(y) for y in YEAR_MENTION.findall(q)})
+    minerals, states, districts = mentioned['mineral'], mentioned['state'], mentioned['district']
+    serious = bool(re.search(r'\bserious', q))
+    killed, injured = bool(KILLED_WORDS.search(q)), bool(INJURED_WORDS.search(q))
+
+    if 'rate' in q and 'district_rates' in engine.tables and states:
+        measure = 'serious_injury_rate_per_thousand_persons_employed_overall' if injured \
+            else 'death_rate_per_thousand_persons_employed_overall'
+        filters = {'state': {'$in': states}, 'level': 'state'}
+        if minerals:
+            filters['mineral'] = {'$in': minerals}
+        return {
+            'table': 'district_rates', 'filters': filters,
+            'columns': ['mineral', 'state', measure], 'sort': f"-{measure}",
+        }
+
+    if 'rate' in q and 'mineral_year' in engine.tables and (minerals or years):
+        measure = 'serious_injury_rate' if injured else 'death_rate'
+        filters = {}
+        if minerals:
+            filters['mineral'] = {'$in': minerals}
+        if years:
+            filters['year'] = {'$in': years}
+        return {'table': 'mineral_year', 'filters': filters,
+                'columns': ['mineral', 'year', measure]}
+
+    if TOP_WORDS.search(q) and CAUSE_WORDS.search(q) and 'cause_mineral' in engine.tables:
+        top_n = TOP_N.search(q)
+        measure = 'injured' if serious or (injured and not killed) else 'killed'
+        filters = {'severity': 'serious' if measure == 'injured' else 'fatal'}
+        if minerals:
+            filters['mineral'] = {'$in': minerals}
+        else:
+            filters['mineral'] = {'$ne': 'Total'}
+        return {
+            'table': 'cause_mineral', 'filters': filters, 'group_by': ['cause'],
+            'metrics': [f"{measure}=sum:{measure}", 'instances=sum:instances'],
+            'sort': f"-{measure}", 'limit': int(top_n.group(1)) if top_n else 5,
+        }
+
+    if not (killed or injured or ACCIDENT_WORDS.search(q)):
+        return None
+
+    if (states or districts) and 'district_accidents' in engine.tables:
+        filters = {}
+        if states:
+            filters['state'] = {'$in': states}
+        if districts:
+            filters['district'] = {'$in': districts}
+        if minerals:
+            filters['mineral'] = {'$in': minerals}
+        return {
+            'table': 'district_accidents', 'filters': filters,
+            'group_by': ['state', 'district'] if districts else ['state'],
+            'metrics': ['fatal_accidents=sum:fatal_accidents', 'persons_killed=sum:persons_killed',
+                        'serious_accidents=sum:serious_accidents',
+                        'persons_seriously_injured=sum:persons_seriously_injured'],
+        }
+
+    if (minerals or years) and 'mineral_year' in engine.tables:
+        filters = {}
+        if minerals:
+            filters['mineral'] = {'$in': minerals}
+        if years:
+            filters['year'] = {'$in': years}
+        group_by = []
+        if minerals or BY_MINERAL.search(q):
+            group_by.append('mineral')
+        if len(years) > 1 or BY_YEAR.search(q) or not group_by:
+            group_by.append('year')
+        if killed and not injured:
+            metrics = ['fatal_accidents=sum:fatal_accidents', 'persons_killed=sum:persons_killed']
+        elif injured and not killed:
+            metrics = ['serious_accidents=sum:serious_accidents',
+                       'persons_seriously_injured=sum:persons_seriously_injured']
+        else:
+            metrics = ['fatal_accidents=sum:fatal_accidents', 'persons_killed=sum:persons_killed',
+                       'serious_accidents=sum:serious_accidents',
+                       'persons_seriously_injured=sum:persons_seriously_injured']
+        sort = 'year' if BY_YEAR.search(q) else f"-{metrics[-1].split('=')[0]}"
+        return {'table': 'mineral_year', 'filters': filters, 'group_by': group_by,
+                'metrics': metrics, 'sort': sort}
+
+    return None
+
+# ==========================================
+# PRESENTATION
+# ==========================================
+
+def format_result(result: Dict) -> str:
+    """Plain-text rendering of a query result for prompts and direct answers"""
+    header = f"{result['description']} [{', '.join(result['sources'])}]"
+    if not result['rows']:
+        return header + "\nNo matching rows."
+    lines = [header]
+    for row in result['rows']:
+        lines.append("- " + ", ".join(
+            f"{key}: {'n/a' if value is None else value}" for key, value in row.items()
+        ))
+    return "\n".join(lines)
+
+
+def stats_query_from_request(request) -> Dict:
+    """Query spec from a JSON body, or from the query string of a GET
+
+    GET form: ?table=..&group_by=a,b&metric=..&metric=..&sort=..&limit=..;
+    any other parameter is an equality filter.
+    """
+    if request.method == 'POST':
+        spec = request.get_json(silent=True)
+        if not isinstance(spec, dict):
+            raise StatsQueryError("Expected a JSON object")
+        return spec
+    args = request.args
+    spec = {
+        'table': args.get('table'),
+        'group_by': [c for c in (args.get('group_by') or '').split(',') if c],
+        'metrics': args.getlist('metric'),
+        'sort': args.get('sort'),
+        'limit': int(args['limit']) if args.get('limit') else None,
+        'columns': [c for c in (args.get('columns') or '').split(',') if c] or None,
+    }
+    reserved = {'table', 'group_by', 'metric', 'sort', 'limit', 'columns'}
+    spec['filters'] = {key: args.get(key) for key in args if key not in reserved}
+    return spec
@@ -0,0 +1,330 @@
+# stats_snapshot.py - Precompiled, memory-mapped snapshot of the statement tables
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from statement_loader import discover_json_files
+from stats_engine import StatsEngine, Table, normalize_folder
+
+SNAPSHOT_FORMAT = 1
+# Bump when the normalizers change so existing snapshots are rebuilt
+NORMALIZER_VERSION = 3
+MANIFEST_FILE = "manifest.json"
+MAGIC = b"DGMSSNAP"
+ALIGNMENT = 8
+
+# ==========================================
+# SOURCE HASH
+# ==========================================
+
+def source_files(datasets_folder: str) -> List[Tuple[str, str]]:
+    """(path, relative source name) of every statement file, year folders included"""
+    return discover_json_files(datasets_folder)
+
+
+def source_hash(datasets_folder: str, known: Optional[Dict] = None) -> Tuple[str, Dict[str, Dict]]:
+    """(combined hash, per-file {sha256, size, mtime_ns}) of the statement files and normalizer version
+
+    `known` is the per-file map of a previous manifest; a file whose size and
+    mtime are unchanged reuses its recorded sha256 instead of being re-read.
+    """
+    known = known or {}
+    files = {}
+    combined = hashlib.sha256(f"normalizer:{NORMALIZER_VERSION}".encode('utf-8'))
+    for path, name in source_files(datasets_folder):
+        stat = os.stat(path)
+        previous = known.get(name)
+        if (isinstance(previous, dict) and previous.get('size') == stat.st_size
+                and previous.get('mtime_ns') == stat.st_mtime_ns):
+            digest = previous['sha256']
+        else:
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        files[name] = {'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        combined.update(f"{name}:{digest}\n".encode('utf-8'))
+    return combined.hexdigest(), files
+
+# ==========================================
+# STRING DICTIONARY
+# ==========================================
+
+class StringDictionary:
+    """Strings stored once as a UTF-8 blob plus an offsets array; decoded lazily"""
+
+    def __init__(self, blob, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        self.decoded: Dict[int, str] = {}
+        self.folded: Optional[List[str]] = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, code: int) -> Optional[str]:
+        if code < 0:
+            return None
+        value = self.decoded.get(code)
+        if value is None:
+            start, end = int(self.offsets[code]), int(self.offsets[code + 1])
+            value = bytes(self.blob[start:end]).decode('utf-8')
+            self.decoded[code] = value
+        return value
+
+    def codes_where(self, predicate) -> np.ndarray:
+        """Codes of the casefolded strings matching `predicate`"""
+        if self.folded is None:
+            self.folded = [self.get(code).casefold() for code in range(len(self))]
+        return np.fromiter(
+            (code for code, value in enumerate(self.folded) if predicate(value)), dtype=np.int32
+        )
+
+
+class DictionaryColumn:
+    """Read-only string column backed by int32 codes (-1 = missing)"""
+
+    def __init__(self, codes: np.ndarray, dictionary: StringDictionary):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, row: int) -> Optional[str]:
+        return self.dictionary.get(int(self.codes[row]))
+
+    def __iter__(self):
+        for code in self.codes:
+            yield self.dictionary.get(int(code))
+
+    def mask_in(self, folded_values: set) -> np.ndarray:
+        """Rows whose casefolded value is in `folded_values`, compared on codes"""
+        wanted = self.dictionary.codes_where(lambda value: value in folded_values)
+        return np.isin(self.codes, wanted)
+
+# ==========================================
+# BUILD
+# ==========================================
+
+def _aligned(size: int) -> int:
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def build_snapshot(datasets_folder: str, snapshot_path: str) -> Dict:
+    """Normalize the statements and atomically publish a snapshot; returns its manifest"""
+    started = time.perf_counter()
+    previous = read_manifest(snapshot_path)
+    digest, files = source_hash(datasets_folder, (previous or {}).get('source_files'))
+    tables, errors = normalize_folder(datasets_folder)
+
+    strings = sorted({
+        value
+        for table in tables.values()
+        for column, kind in table.types.items() if kind == 'string'
+        for value in table.columns[column] if value is not None
+    })
+    codes = {value: code for code, value in enumerate(strings)}
+    encoded = [value.encode('utf-8') for value in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+
+    chunks: List[bytes] = []
+    position = 0
+
+    def append(data: bytes) -> Dict:
+        nonlocal position
+        padding = _aligned(position) - position
+        if padding:
+            chunks.append(b'\0' * padding)
+            position += padding
+        entry = {'offset': position, 'nbytes': len(data)}
+        chunks.append(data)
+        position += len(data)
+        return entry
+
+    append(MAGIC + SNAPSHOT_FORMAT.to_bytes(8, 'little'))
+    dictionary = {
+        'count': len(strings),
+        'offsets': append(offsets.tobytes()),
+        'blob': append(b''.join(encoded)),
+    }
+
+    table_entries = {}
+    for name, table in sorted(tables.items()):
+        columns = {}
+        for column, kind in table.types.items():
+            if kind == 'number':
+                array = np.ascontiguousarray(table.columns[column], dtype='<f8')
+                columns[column] = {'type': 'number', 'dtype': '<f8', **append(array.tobytes())}
+            else:
+                array = np.asarray(
+                    [codes[v] if v is not None else -1 for v in table.columns[column]], dtype='<i4'
+                )
+                columns[column] = {'type': 'string', 'dtype': '<i4', **append(array.tobytes())}
+        table_entries[name] = {
+            'description': table.description,
+            'sources': table.sources,
+            'num_rows': table.num_rows,
+            'columns': columns,
+        }
+
+    os.makedirs(snapshot_path, exist_ok=True)
+
+    # Content-addressed data file, so concurrent builders write identical bytes
+    data_file = f"snapshot-{digest[:16]}.bin"
+    data_path = os.path.join(snapshot_path, data_file)
+    tmp_path = f"{data_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, data_path)
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': (previous or {}).get('version', 0) + (
+            0 if previous and previous.get('source_hash') == digest else 1
+        ),
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'source_hash': digest,
+        'source_files': files,
+        'data_file': data_file,
+        'nbytes': position,
+        'dictionary': dictionary,
+        'tables': table_entries,
+        'errors': errors,
+    }
+    write_manifest(snapshot_path, manifest)
+
+    # Workers still mapping an old file keep it alive until they reload
+    for name in os.listdir(snapshot_path):
+        if name.startswith('snapshot-') and name.endswith('.bin') and name != data_file:
+            os.remove(os.path.join(snapshot_path, name))
+
+    manifest['build_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return manifest
+
+# ==========================================
+# LOAD
+# ==========================================
+
+def read_manifest(snapshot_path: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(snapshot_path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('format') == SNAPSHOT_FORMAT else None
+
+
+def write_manifest(snapshot_path: str, manifest: Dict):
+    """Atomically replace the snapshot manifest"""
+    manifest_path = os.path.join(snapshot_path, MANIFEST_FILE)
+    tmp_manifest = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_manifest, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_manifest, manifest_path)
+
+
+def open_snapshot(snapshot_path: str, manifest: Optional[Dict] = None) -> StatsEngine:
+    """Memory-map a published snapshot into a StatsEngine (no JSON parsing)"""
+    manifest = manifest or read_manifest(snapshot_path)
+    if manifest is None:
+        raise FileNotFoundError(f"No stats snapshot at {snapshot_path}")
+    buffer = np.memmap(os.path.join(snapshot_path, manifest['data_file']), dtype=np.uint8, mode='r')
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"Corrupt stats snapshot: {manifest['data_file']}")
+
+    def view(entry: Dict, dtype: str) -> np.ndarray:
+        count = entry['nbytes'] // np.dtype(dtype).itemsize
+        return np.frombuffer(buffer, dtype=dtype, count=count, offset=entry['offset'])
+
+    spec = manifest['dictionary']
+    blob = spec['blob']
+    dictionary = StringDictionary(
+        memoryview(buffer)[blob['offset']:blob['offset'] + blob['nbytes']],
+        view(spec['offsets'], '<i8'),
+    )
+
+    tables = {}
+    for name, entry in manifest['tables'].items():
+        columns, types = {}, {}
+        for column, info in entry['columns'].items():
+            array = view(info, info['dtype'])
+            columns[column] = array if info['type'] == 'number' else DictionaryColumn(array, dictionary)
+            types[column] = info['type']
+        tables[name] = Table(name, columns, types, entry['description'], entry['sources'])
+
+    engine = StatsEngine(tables, manifest.get('errors'))
+    engine.snapshot = {
+        'path': snapshot_path,
+        'version': manifest['version'],
+        'source_hash': manifest['source_hash'],
+        'built_at': manifest['built_at'],
+        'nbytes': manifest['nbytes'],
+    }
+    return engine
+
+
+def load_stats_engine(snapshot_path: Optional[str], datasets_folder: str,
+                      rebuild: bool = True) -> StatsEngine:
+    """Snapshot-backed engine; a stale or missing snapshot is rebuilt (or parsing is used)"""
+    if not snapshot_path:
+        return StatsEngine.from_folder(datasets_folder)
+    try:
+        manifest = read_manifest(snapshot_path)
+        if source_files(datasets_folder):
+            digest, files = source_hash(datasets_folder, (manifest or {}).get('source_files'))
+            if manifest is None or manifest['source_hash'] != digest:
+                if not rebuild:
+                    print(f"⚠️ Stats snapshot at {snapshot_path} is stale; parsing statements instead")
+                    return StatsEngine.from_folder(datasets_folder)
+                manifest = build_snapshot(datasets_folder, snapshot_path)
+                print(f"✓ Rebuilt stats snapshot v{manifest['version']} in {manifest['build_ms']} ms")
+            elif manifest.get('source_files') != files:
+                # Same content, new mtimes (e.g. a fresh checkout): remember
+                # them so the next boot does not hash those files again
+                try:
+                    write_manifest(snapshot_path, {**manifest, 'source_files': files})
+                except OSError:
+                    pass    # read-only snapshot; hashing again next boot is harmless
+        elif manifest is None:
+            return StatsEngine.from_folder(datasets_folder)
+        return open_snapshot(snapshot_path, manifest)
+    except OSError as e:
+        print(f"⚠️ Could not use stats snapshot ({e}); parsing statements instead")
+        return StatsEngine.from_folder(datasets_folder)
+
+# ==========================================
+# MAIN
+# ==========================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the DGMS statements into a stats snapshot")
+    parser.add_argument('--datasets', default="./datasets", help="Folder of statement JSON files")
+    parser.add_argument('--out', default="./stats_snapshot", help="Snapshot directory")
+    parser.add_argument('--check', action='store_true',
+                        help="Only report whether the snapshot is current (exit 1 if stale)")
+    args = parser.parse_args()
+
+    manifest = read_manifest(args.out)
+    digest, _ = source_hash(args.datasets, (manifest or {}).get('source_files'))
+    current = manifest is not None and manifest['source_hash'] == digest
+    if args.check:
+        print(f"Snapshot {'current' if current else 'stale'} (source hash {digest[:16]})")
+        raise SystemExit(0 if current else 1)
+
+    manifest = build_snapshot(args.datasets, args.out)
+    rows = sum(table['num_rows'] for table in manifest['tables'].values())
+    print(f"✓ Snapshot v{manifest['version']}: {len(manifest['tables'])} tables, {rows} rows, "
+          f"{manifest['dictionary']['count']} strings, {manifest['nbytes']} bytes "
+          f"in {manifest['build_ms']} ms -> {os.path.join(args.out, manifest['data_file'])}")
+    for error in manifest['errors']:
+        print(f"  ✗ {error['file']}: {error['error']}")
+
+
+if __name__ == "__main__":
+    main()
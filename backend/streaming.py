@@ -0,0 +1,64 @@
+# streaming.py - Server-sent events helpers for streamed Gemini answers
+import json
+from typing import Dict, Iterator, Optional, Tuple
+
+from flask import Response
+
+
+def format_sse(event: str, data: Dict) -> str:
+    """One server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def sse_response(events: Iterator[Tuple[str, Dict]]) -> Response:
+    """Stream (event, data) pairs to the client as text/event-stream
+
+    When the client disconnects the WSGI server closes this generator, which
+    closes `events` in turn so the producer can cancel upstream work.
+    """
+    def generate():
+        try:
+            for event, data in events:
+                yield format_sse(event, data)
+        finally:
+            events.close()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',   # keep reverse proxies from buffering chunks
+    })
+
+
+def chunk_text(chunk) -> str:
+    """Text of a streamed chunk; chunks without text parts (e.g. safety stops) yield ''"""
+    try:
+        return chunk.text or ''
+    except ValueError:
+        return ''
+
+
+def usage_metadata(response) -> Optional[Dict]:
+    """Token usage reported by Gemini, if any"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_token_count', None),
+        'completion_tokens': getattr(usage, 'candidates_token_count', None),
+        'total_tokens': getattr(usage, 'total_token_count', None),
+    }
+
+
+def cancel_stream(response):
+    """Best-effort abort of an in-flight streaming generate_content call"""
+    if response is None:
+        return
+    for target in (response, getattr(response, '_iterator', None)):
+        for method in ('cancel', 'close'):
+            func = getattr(target, method, None)
+            if callable(func):
+                try:
+                    func()
+                except Exception:
+                    pass
+                return
@@ -0,0 +1,23 @@
+# conftest.py - Make the backend modules importable and share the statement fixtures
+import os
+import sys
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASETS = os.path.join(BACKEND, 'datasets')
+if BACKEND not in sys.path:
+    sys.path.insert(0, BACKEND)
+
+
+@pytest.fixture(scope='session')
+def datasets():
+    """Folder of the bundled statement files"""
+    return DATASETS
+
+
+@pytest.fixture(scope='session')
+def stats_engine():
+    """StatsEngine over the bundled statement files (parsed once per run)"""
+    from stats_engine import StatsEngine
+    return StatsEngine.from_folder(DATASETS)
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, CircuitBreaker, Overloaded, PriorityClass
+
+
+def controller(capacity: int = 1, queue: int = 1, max_wait: float = 0.05) -> AdmissionController:
+    return AdmissionController(capacity, {
+        'search': PriorityClass(priority=0, limit=capacity, queue=queue, max_wait=max_wait),
+        'chat': PriorityClass(priority=1, limit=capacity, queue=queue, max_wait=max_wait),
+    })
+
+
+def test_full_queue_is_shed_with_429():
+    admission = controller(queue=0)
+    with admission.admit('chat'):
+        with pytest.raises(Overloaded) as shed:
+            admission.admit('chat')
+    assert shed.value.status == 429
+    assert shed.value.reason == 'queue_full'
+    assert shed.value.response()[1]['Retry-After'] == str(shed.value.retry_after)
+    assert admission.stats()['classes']['chat']['shed']['queue_full'] == 1
+
+
+def test_waiting_too_long_or_past_the_deadline_is_shed_with_503():
+    admission = controller()
+    with admission.admit('chat'):
+        with pytest.raises(Overloaded) as timed_out:
+            admission.admit('chat')
+        with pytest.raises(Overloaded) as expired:
+            admission.admit('chat', deadline=time.monotonic() - 1)
+    assert (timed_out.value.status, timed_out.value.reason) == (503, 'queue_timeout')
+    assert (expired.value.status, expired.value.reason) == (503, 'deadline')
+    stats = admission.stats()
+    assert stats['in_flight'] == 0 and stats['queued'] == 0
+
+
+def test_freed_slot_goes_to_the_higher_priority_class():
+    admission = controller(max_wait=5)
+    order = []
+    running = admission.admit('chat')
+
+    def wait_for(name):
+        with admission.admit(name):
+            order.append(name)
+
+    threads = [threading.Thread(target=wait_for, args=(name,)) for name in ('chat', 'search')]
+    for thread in threads:
+        thread.start()
+        while admission.stats()['queued'] < threads.index(thread) + 1:
+            time.sleep(0.005)
+    running.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['search', 'chat']
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    admission = controller(max_wait=5)
+
+    async def main():
+        ticket = await admission.aadmit('chat')
+        waiter = asyncio.ensure_future(admission.aadmit('chat'))
+        await asyncio.sleep(0.01)
+        assert admission.stats()['queued'] == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert admission.stats()['queued'] == 0
+        ticket.release()
+
+    asyncio.run(main())
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_disabled_controller_admits_everything():
+    admission = AdmissionController(1, {'chat': PriorityClass(0, 1, 0, 0.0)}, enabled=False)
+    tickets = [admission.admit('chat', deadline=time.monotonic() - 1) for _ in range(3)]
+    assert admission.stats()['in_flight'] == 3
+    for ticket in tickets:
+        ticket.release()
+
+
+def test_breaker_opens_after_threshold_and_probes_after_reset():
+    breaker = CircuitBreaker('gemini', failure_threshold=2, window=4, reset_timeout=0.05)
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.stats()['state'] == 'open'
+    assert not breaker.allow()
+    assert breaker.retry_after() >= 1
+
+    time.sleep(0.06)
+    assert breaker.allow()              # the probe
+    assert breaker.stats()['state'] == 'half_open'
+    assert not breaker.allow()          # one probe at a time
+    breaker.record_failure()
+    assert breaker.stats()['state'] == 'open'
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    stats = breaker.stats()
+    assert stats['state'] == 'closed' and stats['recent_failures'] == 0
+    assert stats['opened'] == 2 and stats['rejected'] == 2
+
+
+def test_breaker_ignores_fast_deadline_timeouts():
+    breaker = CircuitBreaker('gemini', failure_threshold=1, slow_call_seconds=10)
+    breaker.record_timeout(0.5)
+    assert breaker.stats()['state'] == 'closed'
+    breaker.record_timeout(12)
+    assert breaker.stats()['state'] == 'open'
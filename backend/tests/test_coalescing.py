@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from coalescing import SingleFlight
+
+
+def test_concurrent_callers_share_one_computation():
+    flight = SingleFlight(grace_seconds=60)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return ['answer']
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('q', compute)))
+    leader.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(flight.do('q', compute)))
+               for _ in range(3)]
+    for thread in waiters:
+        thread.start()
+    time.sleep(0.05)        # let the waiters block on the leader (late ones hit the grace period)
+    release.set()
+    for thread in [leader, *waiters]:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(result == ['answer'] for result, _ in results)
+    assert flight.stats()['shared'] == 3
+    assert flight.stats()['leaders'] == 1
+
+
+def test_grace_period_reuses_results_but_never_errors():
+    flight = SingleFlight(grace_seconds=60)
+    assert flight.do('q', lambda: 1) == (1, False)
+    assert flight.do('q', lambda: 2) == (1, True)
+    assert flight.stats()['grace_hits'] == 1
+
+    def fail():
+        raise RuntimeError('upstream down')
+
+    with pytest.raises(RuntimeError):
+        flight.do('other', fail)
+    assert flight.do('other', lambda: 3) == (3, False)
+    assert flight.stats()['errors'] == 1
+
+
+def test_disabled_always_computes():
+    flight = SingleFlight(enabled=False)
+    assert flight.do('q', lambda: 1) == (1, False)
+    assert flight.do('q', lambda: 2) == (2, False)
+
+
+def test_async_callers_share_one_task():
+    flight = SingleFlight(grace_seconds=0)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'answer'
+
+    async def main():
+        return await asyncio.gather(*(flight.ado('q', compute) for _ in range(4)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert {result for result, _ in results} == {'answer'}
+
+
+def test_async_computation_is_cancelled_with_its_last_caller():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def compute():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        callers = [asyncio.ensure_future(flight.ado('q', compute)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled            # one caller is still waiting
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert cancelled == [1]
+    assert flight.stats()['in_flight'] == 0
@@ -0,0 +1,45 @@
+import pytest
+
+from code_router import CodeLookupRouter
+
+
+@pytest.fixture(scope='module')
+def router(stats_engine):
+    return CodeLookupRouter.from_stats(stats_engine)
+
+
+def test_lookup_codes_exact_and_heading(router):
+    assert [e['code'] for e in router.lookup_codes("what is code 0222")] == ['0222']
+    heading = [e['code'] for e in router.lookup_codes("codes under 0110")]
+    assert heading and all(code.startswith('011') for code in heading)
+
+
+def test_lookup_codes_ignores_plain_numbers(router):
+    # Only 0-prefixed four-digit tokens count as codes without the word "code"
+    assert router.lookup_codes("accidents in 222 mines") == []
+    assert router.lookup_codes("fatalities in 2015") == []
+
+
+@pytest.mark.parametrize('question', [
+    "what is code 0222", "0111", "What does 0111 mean?", "explain code 0223",
+    "list ground movement codes", "code for fall of roof",
+])
+def test_pure_lookups_are_answered_directly(router, question):
+    lookup = router.route(question)
+    assert lookup is not None and lookup['direct']
+    assert lookup['answer'].endswith("Source: Statement4.0.json")
+
+
+@pytest.mark.parametrize('question', [
+    "list accidents due to 0112",
+    "How many fatal accidents under code 0111 in 2015?",
+    "the accident on 0111 street",
+])
+def test_questions_about_accidents_keep_the_code_as_context(router, question):
+    lookup = router.route(question)
+    assert lookup is not None and not lookup['direct']
+    assert lookup['sources'][0]['metadata']['code'] in question
+
+
+def test_unrelated_questions_fall_through(router):
+    assert router.route("How many people died in gold mines?") is None
@@ -0,0 +1,51 @@
+from array import array
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache, SQLiteEmbeddingStore
+
+
+class Embeddings:
+    model = 'test/embedding'
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [[float(len(text)), 0.1] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_memory_tier_holds_float32_and_returns_lists():
+    upstream = Embeddings()
+    embeddings = CachedEmbeddings(upstream, EmbeddingCache(memory_entries=8))
+    first = embeddings.embed_documents(['roof fall', 'roof  fall'])
+    again = embeddings.embed_documents(['roof fall'])
+    assert upstream.calls == 1
+    assert isinstance(again[0], list)
+    assert again[0] == array('f', first[0]).tolist()
+    stored = next(iter(embeddings.cache.memory.entries.values()))
+    assert isinstance(stored, array) and stored.typecode == 'f'
+
+
+def last_used(store: SQLiteEmbeddingStore, key: str) -> float:
+    return store.conn.execute("SELECT last_used FROM embeddings WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_disk_hits_buffer_last_used_updates(tmp_path):
+    store = SQLiteEmbeddingStore(str(tmp_path / 'cache.sqlite'), touch_batch=3, touch_interval=3600)
+    store.put_many({'a': [1.0], 'b': [2.0], 'c': [3.0]})
+    written = last_used(store, 'a')
+
+    assert list(store.get_many(['a', 'b'])['a']) == [1.0]
+    assert last_used(store, 'a') == written
+    assert set(store.touched) == {'a', 'b'}
+
+    store.get_many(['c'])
+    assert not store.touched
+    assert last_used(store, 'a') > written
+
+    store.get_many(['b'])
+    store.flush()
+    assert not store.touched
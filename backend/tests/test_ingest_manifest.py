@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ingest_manifest import IngestManifest, make_vector_id
+
+
+def document(source: str, index: int, text: str) -> SimpleNamespace:
+    return SimpleNamespace(page_content=text, metadata={
+        'source_file': source, 'chunk_index': index, 'doc_id': make_vector_id(source, index),
+    })
+
+
+def test_vector_ids_do_not_collide_across_spellings():
+    names = ['Statement 4.1.json', 'Statement_4.1.json', 'statement-4.1.json',
+             '2021/Statement 4.1.json']
+    ids = {make_vector_id(name, 0) for name in names}
+    assert len(ids) == len(names)
+    assert make_vector_id('Statement 4.1.json', 3) == make_vector_id('Statement 4.1.json', 3)
+    assert make_vector_id('Statement 4.1.json', 3).endswith('-0003')
+
+
+def test_plan_diffs_against_the_manifest(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    manifest = IngestManifest(path)
+    first = [document('a.json', 0, 'one'), document('a.json', 1, 'two'), document('b.json', 0, 'x')]
+    plan = manifest.plan(first)
+    assert plan.summary() == {'upsert': 3, 'unchanged': 0, 'delete': 0}
+    manifest.record_upserts(plan.upsert)
+    manifest.bump_version()
+    manifest.save()
+
+    reloaded = IngestManifest(path)
+    assert reloaded.index_version == 1
+    second = [document('a.json', 0, 'one'), document('a.json', 1, 'changed')]
+    plan = reloaded.plan(second)
+    assert plan.unchanged == [make_vector_id('a.json', 0)]
+    assert [vector_id for vector_id, _, _ in plan.upsert] == [make_vector_id('a.json', 1)]
+    assert plan.delete == [make_vector_id('b.json', 0)]
+    assert reloaded.plan(second, force=True).summary()['upsert'] == 2
+
+
+def test_plan_rejects_duplicate_ids(tmp_path):
+    manifest = IngestManifest(str(tmp_path / 'manifest.json'))
+    twice = [document('a.json', 0, 'one'), document('a.json', 0, 'two')]
+    with pytest.raises(ValueError, match='Duplicate vector ID'):
+        manifest.plan(twice)
@@ -0,0 +1,94 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from ingest_manifest import IngestManifest
+from ingest_pipeline import IngestionPipeline
+from statement_chunker import StatementChunker
+from statement_loader import discover_json_files, load_file
+
+
+@pytest.fixture
+def nested_datasets(tmp_path, datasets):
+    """Two bundled statements, one of them also filed under a year folder"""
+    folder = tmp_path / 'datasets'
+    (folder / '2021').mkdir(parents=True)
+    names = sorted(name for name in os.listdir(datasets) if name.endswith('.json'))[:2]
+    for name in names:
+        shutil.copy(os.path.join(datasets, name), folder / name)
+    shutil.copy(os.path.join(datasets, names[0]), folder / '2021' / names[0])
+    return str(folder)
+
+
+class Embeddings:
+    def embed_documents(self, texts):
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class MiscountingEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        return super().embed_documents(texts)[:-1]
+
+
+class Index:
+    def __init__(self):
+        self.vectors = {}
+
+    def upsert(self, vectors):
+        self.vectors.update((vector['id'], vector) for vector in vectors)
+
+    def delete(self, ids):
+        for vector_id in ids:
+            self.vectors.pop(vector_id, None)
+
+
+def pipeline(tmp_path, embeddings, index=None, checkpoint_path=None) -> IngestionPipeline:
+    return IngestionPipeline(embeddings, index or Index(), StatementChunker(),
+                             IngestManifest(str(tmp_path / 'manifest.json')),
+                             checkpoint_path=checkpoint_path, embed_workers=2,
+                             embed_batch_size=4, upsert_batch_size=8, queue_size=2,
+                             requests_per_second=0)
+
+
+def run_with_timeout(func, *args, timeout: float = 30.0):
+    """Run `func` in a thread so a hung pipeline fails the test instead of the run"""
+    outcome = {}
+
+    def target():
+        try:
+            outcome['value'] = func(*args)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline hung"
+    return outcome
+
+
+def test_run_keys_vectors_like_the_streaming_loader(tmp_path, nested_datasets):
+    files = discover_json_files(nested_datasets)
+    index = Index()
+    outcome = run_with_timeout(pipeline(tmp_path, Embeddings(), index).run, files)
+    assert 'error' not in outcome
+    expected = {metadata['doc_id']
+                for path, source in files for _, metadata in load_file(path, source).chunks}
+    assert set(index.vectors) == expected
+    assert any(v['metadata']['source_file'].startswith('2021/') for v in index.vectors.values())
+
+
+@pytest.mark.parametrize('embeddings, checkpoint, stage', [
+    (MiscountingEmbeddings(), None, 'embed'),
+    # The checkpoint's folder does not exist, so recording an upserted batch raises
+    (Embeddings(), 'missing/checkpoint.jsonl', 'upsert'),
+])
+def test_stage_crash_is_raised_not_hung(tmp_path, nested_datasets, embeddings, checkpoint, stage):
+    checkpoint_path = str(tmp_path / checkpoint) if checkpoint else None
+    outcome = run_with_timeout(pipeline(tmp_path, embeddings, None, checkpoint_path).run,
+                               discover_json_files(nested_datasets))
+    assert isinstance(outcome.get('error'), RuntimeError)
+    assert f"{stage} stage failed" in str(outcome['error'])
+    assert not os.path.exists(tmp_path / 'manifest.json')
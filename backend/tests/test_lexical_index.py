@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+pytest.importorskip('langchain')
+
+from lexical_index import LexicalIndex, LexicalIndexWriter
+
+
+def publish(writer: LexicalIndexWriter, text: str):
+    writer.add('doc-1', text, {'source_file': 'a.json'})
+    writer.flush()
+
+
+def arrays(path: str) -> set:
+    return {name for name in os.listdir(path) if name.endswith('.npy')}
+
+
+def test_writer_deletes_arrays_one_publish_late(tmp_path):
+    path = str(tmp_path / 'lexical')
+    writer = LexicalIndexWriter(path)
+    publish(writer, 'roof fall')
+    first = arrays(path)
+    publish(writer, 'roof fall in a coal mine')
+    assert first < arrays(path)
+    publish(writer, 'explosion')
+    assert not first & arrays(path)
+    assert len(arrays(path)) == 6
+
+
+def test_reader_keeps_previous_arrays_when_a_publish_races(tmp_path, monkeypatch):
+    path = str(tmp_path / 'lexical')
+    writer = LexicalIndexWriter(path)
+    publish(writer, 'roof fall')
+    reader = LexicalIndex(path, reload_interval=0)
+    assert [doc.metadata['source_file'] for doc, _ in reader.search_with_score('roof')] == ['a.json']
+
+    publish(writer, 'explosion')
+
+    def vanished(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(LexicalIndex, 'open_arrays', staticmethod(vanished))
+    assert len(reader.search_with_score('roof')) == 1
+    monkeypatch.undo()
+    assert reader.search_with_score('roof') == []
+    assert len(reader.search_with_score('explosion')) == 1
@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('langchain')
+
+import local_vectorstore
+from local_vectorstore import LocalVectorIndex, LocalVectorStore
+
+
+def vectors(count: int, dimension: int = 16, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return [{'id': f"doc-{i:03d}", 'values': rng.normal(size=dimension).tolist(),
+             'metadata': {'text': f"chunk {i}", 'year': 2020 + i % 3}} for i in range(count)]
+
+
+def published(path: str):
+    meta, matrix, scales = LocalVectorStore.open_arrays(path)
+    return meta, np.array(matrix), None if scales is None else np.array(scales)
+
+
+def test_republishing_keeps_int8_codes_and_scales(tmp_path):
+    path = str(tmp_path / 'store')
+    index = LocalVectorIndex(path, quantize=True)
+    index.upsert(vectors(20))
+    index.flush()
+    _, codes, scales = published(path)
+
+    for _ in range(3):
+        index = LocalVectorIndex(path, quantize=True)
+        index.upsert(vectors(1, seed=7))    # touches one row; the rest must not drift
+        index.flush()
+    meta, republished, rescales = published(path)
+    kept = [meta['ids'].index(f"doc-{i:03d}") for i in range(1, 20)]
+    assert np.array_equal(republished[kept], codes[1:])
+    assert np.array_equal(rescales[kept], scales[1:])
+
+
+def test_blockwise_scores_match_a_full_product(tmp_path, monkeypatch):
+    path = str(tmp_path / 'store')
+    index = LocalVectorIndex(path, quantize=True)
+    index.upsert(vectors(50))
+    index.flush()
+    monkeypatch.setattr(local_vectorstore, 'SCORE_BLOCK_ROWS', 7)
+
+    store = LocalVectorStore(path, embedding=None)
+    query = np.random.default_rng(1).normal(size=16)
+    expected = (np.asarray(store.matrix, dtype=np.float32) @ (query / np.linalg.norm(query))) * store.scales
+    hits = store.similarity_search_with_score_by_vector(query.tolist(), k=5)
+    best = np.sort(expected)[::-1][:5]
+    assert np.allclose([score for _, score in hits], best, atol=1e-5)
+
+    filtered = store.similarity_search_with_score_by_vector(query.tolist(), k=50, filter={'year': 2021})
+    assert len(filtered) == 17
+    assert all(doc.metadata['year'] == 2021 for doc, _ in filtered)
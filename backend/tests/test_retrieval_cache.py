@@ -0,0 +1,72 @@
+import asyncio
+
+from retrieval_cache import RetrievalCache
+
+
+class Version:
+    def __init__(self):
+        self.value = 1
+
+    def __call__(self):
+        return self.value
+
+
+def test_version_bump_invalidates_entries():
+    version = Version()
+    cache = RetrievalCache(version_source=version)
+    calls = []
+
+    def compute(embedding):
+        calls.append(version.value)
+        return [f"v{version.value}"]
+
+    assert cache.get_or_compute('Roof  fall', 5, compute) == ['v1']
+    assert cache.get_or_compute('roof fall', 5, compute) == ['v1']
+    assert cache.get_or_compute('roof fall', 3, compute) == ['v1']
+    assert calls == [1, 1]
+
+    version.value = 2
+    assert cache.get_or_compute('roof fall', 5, compute) == ['v2']
+    stats = cache.stats()
+    assert stats['invalidations'] == 1
+    assert stats['index_version'] == 2
+    assert stats['entries'] == 1
+
+
+def test_results_computed_across_a_version_bump_are_not_cached():
+    version = Version()
+    cache = RetrievalCache(version_source=version)
+
+    def compute(embedding):
+        version.value += 1      # the uploader publishes while the search runs
+        return ['stale']
+
+    assert cache.get_or_compute('roof fall', 5, compute) == ['stale']
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['stale_puts'] == 1
+    assert cache.get_or_compute('roof fall', 5, lambda embedding: ['fresh']) == ['fresh']
+    assert cache.get_or_compute('roof fall', 5, lambda embedding: ['unused']) == ['fresh']
+
+
+def test_async_path_checks_the_version_too():
+    version = Version()
+    cache = RetrievalCache(version_source=version)
+
+    async def compute(embedding):
+        version.value += 1
+        return ['stale']
+
+    assert asyncio.run(cache.aget_or_compute('roof fall', 5, compute)) == ['stale']
+    assert cache.stats()['entries'] == 0
+
+
+def test_near_duplicate_matches_within_scope_only():
+    cache = RetrievalCache(similarity_threshold=0.99)
+    embeddings = {'roof fall deaths': [1.0, 0.0], 'deaths from roof falls': [0.999, 0.01],
+                  'explosions': [0.0, 1.0]}
+    embed = embeddings.__getitem__
+    cache.get_or_compute('roof fall deaths', 5, lambda embedding: ['a'], embed=embed)
+    assert cache.get_or_compute('deaths from roof falls', 5, lambda e: ['b'], embed=embed) == ['a']
+    assert cache.get_or_compute('deaths from roof falls', 3, lambda e: ['c'], embed=embed) == ['c']
+    assert cache.get_or_compute('explosions', 5, lambda e: ['d'], embed=embed) == ['d']
+    assert cache.stats()['near_hits'] == 1
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import session_store
+from session_store import MemorySessionStore, SessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemorySessionStore(max_turns=4, idle_ttl=60)
+    return SQLiteSessionStore(str(tmp_path / 'sessions.sqlite'), max_turns=4, idle_ttl=60)
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store.time, 'time', clock)
+    return clock
+
+
+def turn(n: int):
+    return {'user': f"question {n}", 'assistant': f"answer {n}"}
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+def test_ring_buffer_keeps_newest_turns(store):
+    for n in range(6):
+        stored = store.append('s1', turn(n))
+    assert stored == 4
+    assert [t['user'] for t in store.get_history('s1')] == [f"question {n}" for n in range(2, 6)]
+
+
+def test_append_after_idle_ttl_starts_a_new_session(store, clock):
+    store.append('s1', turn(1))
+    store.append('s1', turn(2))
+    clock.now += 120        # idle past the TTL, before any periodic eviction ran
+    assert store.append('s1', turn(3)) == 1
+    assert [t['user'] for t in store.get_history('s1')] == ['question 3']
+    assert store.stats()['evicted'] == 1
+
+
+def test_compact_applies_only_on_top_of_the_expected_summary(store):
+    for n in range(4):
+        store.append('s1', turn(n))
+    page, total = store.get_page('s1')
+    seqs = [item['seq'] for item in page]
+    assert total == 4 and seqs == sorted(seqs)
+
+    first = {'text': 'asked about 0 and 1', 'through_seq': seqs[1]}
+    assert store.compact('s1', first, base_seq=0)
+    summary, turns = store.get_conversation('s1')
+    assert summary == first
+    assert [t['user'] for t in turns] == ['question 2', 'question 3']
+
+    # A compaction computed before `first` landed must not overwrite it
+    stale = {'text': 'asked about 0', 'through_seq': seqs[0]}
+    assert not store.compact('s1', stale, base_seq=0)
+    assert store.get_conversation('s1')[0] == first
+
+    second = {'text': 'asked about 0 to 2', 'through_seq': seqs[2]}
+    assert store.compact('s1', second, base_seq=seqs[1])
+    summary, turns = store.get_conversation('s1')
+    assert summary == second and [t['user'] for t in turns] == ['question 3']
+    assert store.stats()['summaries'] == 1
+
+
+def test_compact_of_a_cleared_or_unknown_session_is_dropped(store):
+    store.append('s1', turn(1))
+    seq = store.get_page('s1')[0][0]['seq']
+    store.clear('s1')
+    assert not store.compact('s1', {'text': 'late', 'through_seq': seq}, base_seq=0)
+    assert not store.compact('nobody', {'text': 'x', 'through_seq': 1}, base_seq=0)
+    assert store.get_conversation('s1') == (None, [])
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from statement_chunker import StatementChunker, estimate_tokens
+from statement_loader import discover_json_files
+
+
+@pytest.mark.parametrize('budget', [400, 200, 120])
+def test_every_bundled_chunk_fits_the_budget(datasets, budget):
+    chunker = StatementChunker(budget)
+    for path, name in discover_json_files(datasets):
+        with open(path, encoding='utf-8') as f:
+            chunks = chunker.chunk(name, json.load(f))
+        assert chunks, name
+        for chunk in chunks:
+            assert estimate_tokens(chunk['content']) <= budget, (name, chunk['metadata'])
+            json.loads(chunk['content'])
+
+
+def test_long_section_names_count_against_the_budget():
+    section = 'a_very_long_section_name_' * 8
+    data = {'data': {section: [{'code': f'{n:04d}', 'value': 'x' * 40} for n in range(40)]}}
+    for chunk in StatementChunker(100).chunk('Statement_4.2.json', data):
+        assert estimate_tokens(chunk['content']) <= 100
+
+
+def test_oversized_row_is_split_and_keeps_its_keys():
+    row = {'code': '0112', 'state': 'Goa', **{f'field_{n}': 'y' * 60 for n in range(20)}}
+    chunks = StatementChunker(120).chunk('Statement_4.12.json', [row])
+    assert len(chunks) > 1
+    parts = [part for chunk in chunks for part in json.loads(chunk['content'])['rows']]
+    assert all(part['code'] == '0112' and part['state'] == 'Goa' for part in parts)
+    fields = {key for part in parts for key in part} - {'code', 'state'}
+    assert fields == {f'field_{n}' for n in range(20)}
+    assert all(estimate_tokens(chunk['content']) <= 120 for chunk in chunks)
+
+
+def test_value_longer_than_a_chunk_is_truncated():
+    row = {'code': '0113', 'incident_summary': 'roof fell "suddenly" ' * 200}
+    chunks = StatementChunker(100).chunk('Statement_4.12.json', [row])
+    [summary] = [part['incident_summary'] for chunk in chunks
+                 for part in json.loads(chunk['content'])['rows'] if 'incident_summary' in part]
+    assert summary.endswith('…') and summary.startswith('roof fell')
+    assert all(estimate_tokens(chunk['content']) <= 100 for chunk in chunks)
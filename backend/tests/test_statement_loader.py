@@ -0,0 +1,39 @@
+import multiprocessing
+import os
+
+import pytest
+
+import statement_loader
+from statement_loader import StreamingLoader, discover_json_files
+
+real_load_file = statement_loader.load_file
+
+
+def crashing_load_file(path, source, token_budget):
+    if source == 'poison.json':
+        os._exit(1)     # what an OOM kill looks like to the pool
+    return real_load_file(path, source, token_budget)
+
+
+def test_discover_walks_year_folders(tmp_path):
+    (tmp_path / '2021').mkdir()
+    for name in ('b.json', '2021/a.json', 'notes.txt', '.hidden.json'):
+        (tmp_path / name).write_text('{}')
+    assert [source for _, source in discover_json_files(str(tmp_path))] == ['2021/a.json', 'b.json']
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason="workers must inherit the patched load_file")
+def test_dead_worker_fails_only_its_file(datasets, monkeypatch):
+    monkeypatch.setattr(statement_loader, 'load_file', crashing_load_file)
+    files = discover_json_files(datasets)[:5]
+    files.insert(2, (files[0][0], 'poison.json'))
+
+    loader = StreamingLoader(workers=2, max_in_flight=4)
+    loaded = list(loader.iter_files(files))
+
+    assert [item.source for item in loaded] == [source for _, source in files]
+    failed = [item.source for item in loaded if item.error]
+    assert failed == ['poison.json']
+    assert all(item.chunks for item in loaded if not item.error)
+    assert loader.stats()['files_failed'] == 1
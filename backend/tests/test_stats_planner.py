@@ -0,0 +1,64 @@
+import pytest
+
+from stats_engine import plan_question
+
+
+@pytest.mark.parametrize('question', [
+    "How many people were killed by fall of roof in 2014?",
+    "deaths due to dumpers in 2015",
+    "accidents because of explosives in 2013",
+    "how many died in 2014 in open cast mines",
+    "How many fatal accidents under code 0111 in 2015?",
+    "Tell me about Champion Reef Gold mine accidents",
+])
+def test_declines_constraints_the_table_cannot_filter(stats_engine, question):
+    assert plan_question(question, stats_engine) is None
+
+
+def test_fatal_counts_as_killed(stats_engine):
+    spec = plan_question("How many fatal accidents in 2015?", stats_engine)
+    assert spec['table'] == 'mineral_year'
+    assert spec['filters'] == {'year': {'$in': [2015.0]}}
+    assert spec['metrics'] == ['fatal_accidents=sum:fatal_accidents',
+                               'persons_killed=sum:persons_killed']
+
+
+def test_serious_injuries_by_year(stats_engine):
+    spec = plan_question("How many persons were seriously injured in 2016?", stats_engine)
+    assert spec['metrics'] == ['serious_accidents=sum:serious_accidents',
+                               'persons_seriously_injured=sum:persons_seriously_injured']
+
+
+def test_mineral_is_pushed_into_the_filters(stats_engine):
+    spec = plan_question("fatal accidents in gold mines", stats_engine)
+    assert [m.casefold() for m in spec['filters']['mineral']['$in']] == ['gold']
+    assert stats_engine.answer("fatal accidents in gold mines")['rows']
+
+
+def test_because_is_not_a_cause_question(stats_engine):
+    # "because" contains "cause" but does not ask for the top causes
+    spec = plan_question("Most deaths were in iron ore mines, is that because they are deeper?",
+                         stats_engine)
+    assert spec['table'] == 'mineral_year'
+
+
+def test_top_causes(stats_engine):
+    spec = plan_question("top 3 causes of serious injuries in iron ore mines", stats_engine)
+    assert spec['table'] == 'cause_mineral'
+    assert spec['group_by'] == ['cause']
+    assert spec['limit'] == 3
+    assert spec['filters']['severity'] == 'serious'
+
+
+def test_state_rates(stats_engine):
+    spec = plan_question("death rate in Jharkhand", stats_engine)
+    assert spec['table'] == 'district_rates'
+    assert [s.casefold() for s in spec['filters']['state']['$in']] == ['jharkhand']
+
+
+@pytest.mark.parametrize('question', [
+    "How many people were killed in coal mines in 2015?",   # no coal rows in the bundled tables
+    "What is the weather like?",
+])
+def test_declines_what_the_tables_cannot_answer(stats_engine, question):
+    assert plan_question(question, stats_engine) is None